@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# File created on 18 Oct 2026
+from __future__ import division
+
+__author__ = "Greg Caporaso"
+__copyright__ = "Copyright 2011-2013, The PICRUSt Project"
+__credits__ = ["Greg Caporaso","Jesse Zaneveld"]
+__license__ = "GPL"
+__version__ = "1.0.0-dev"
+__maintainer__ = "Greg Caporaso"
+__email__ = "gregcaporaso@gmail.com"
+__status__ = "Development"
+
+from os import fork, pipe, read, write, close, waitpid, _exit
+from resource import getrusage, RUSAGE_SELF
+from time import time
+from numpy import sqrt, around, maximum, empty, array_equal
+from numpy.random import RandomState
+from cogent.util.option_parsing import parse_command_line_parameters, make_option
+from picrust.predict_traits import calc_confidence_interval_95
+from picrust.predict_metagenomes import variance_of_sum
+
+script_info = {}
+script_info['brief_description'] = "Measure the peak memory of calculating confidence intervals and summed variances."
+script_info['script_description'] = "Each approach runs in a forked process on the same random predictions and variances, and the growth of its peak resident set size while calculating the 95% confidence intervals and the variance of a sum is reported. 'temporaries' is the allocation pattern calc_confidence_interval_95 and variance_of_sum used before they took out= arrays, 'default' calls them without out=, and 'chunked' writes into preallocated results a block of rows at a time. The results of all approaches are checked against each other. It is a development benchmark, so it is not installed with the scripts or run by all_tests.py."
+script_info['script_usage'] = [("","Benchmark the default 2000 x 7000 inputs.","%prog"),
+                               ("","Benchmark smaller inputs in blocks of 100 rows.","%prog -r 500 -c 7000 -b 100")]
+script_info['output_description']= "The extra peak RSS (in MB) and run time of each approach, printed to stdout."
+script_info['required_options'] = []
+script_info['optional_options'] = [
+ make_option('-r','--rows',default=2000,type='int',help='rows of the inputs [default: %default]'),
+ make_option('-c','--columns',default=7000,type='int',help='columns of the inputs [default: %default]'),
+ make_option('-b','--block_rows',default=250,type='int',help='rows per block of the chunked approach [default: %default]')]
+script_info['version'] = __version__
+script_info['help_on_no_arguments'] = False
+
+def with_temporaries(predictions,variances,other_variances):
+    """Calculate the results as before out= arrays were supported"""
+    stdev = sqrt(variances)
+    CI_95 = 1.96*stdev
+    lower_95_CI = around(predictions - CI_95)
+    upper_95_CI = around(predictions + CI_95)
+    lower_95_CI = around(lower_95_CI)
+    upper_95_CI = around(upper_95_CI)
+    lower_95_CI = maximum(0.0,lower_95_CI)
+    upper_95_CI = maximum(0.0,upper_95_CI)
+    #variance_of_sum always calculated the correlation term, even with r=0
+    r,sign_of_varB = 0,1
+    summed = variances + other_variances + \
+      2*(sqrt(variances)*sqrt(other_variances))*r*sign_of_varB
+    return lower_95_CI,upper_95_CI,summed
+
+def with_defaults(predictions,variances,other_variances):
+    """Calculate the results with newly allocated outputs"""
+    lower_95_CI,upper_95_CI = calc_confidence_interval_95(predictions,variances)
+    return lower_95_CI,upper_95_CI,variance_of_sum(variances,other_variances)
+
+def make_chunked(block_rows):
+    """Return a function calculating the results into preallocated arrays, block_rows at a time"""
+    def chunked(predictions,variances,other_variances):
+        lower_95_CI = empty(predictions.shape)
+        upper_95_CI = empty(predictions.shape)
+        summed = empty(predictions.shape)
+        for start in range(0,len(predictions),block_rows):
+            block = slice(start,start+block_rows)
+            calc_confidence_interval_95(predictions[block],variances[block],\
+              out=(lower_95_CI[block],upper_95_CI[block]))
+            variance_of_sum(variances[block],other_variances[block],\
+              out=summed[block])
+        return lower_95_CI,upper_95_CI,summed
+    return chunked
+
+def make_inputs(rows,columns):
+    random = RandomState(0)
+    predictions = random.poisson(20,(rows,columns)).astype(float)
+    variances = random.exponential(10,(rows,columns))
+    other_variances = random.exponential(10,(rows,columns))
+    return predictions,variances,other_variances
+
+def measure(f,rows,columns):
+    """Return the extra peak RSS (in MB) and run time of f, measured in a forked process"""
+    read_fd,write_fd = pipe()
+    pid = fork()
+    if pid == 0:
+        close(read_fd)
+        inputs = make_inputs(rows,columns)
+        start_rss = getrusage(RUSAGE_SELF).ru_maxrss
+        start = time()
+        f(*inputs)
+        elapsed = time() - start
+        #ru_maxrss is in KB on Linux
+        extra_rss = (getrusage(RUSAGE_SELF).ru_maxrss - start_rss)/1024
+        write(write_fd,"%f %f" %(extra_rss,elapsed))
+        _exit(0)
+    close(write_fd)
+    result = read(read_fd,1024)
+    close(read_fd)
+    waitpid(pid,0)
+    return map(float,result.split())
+
+def main():
+    option_parser, opts, args =\
+       parse_command_line_parameters(**script_info)
+
+    approaches = [('temporaries',with_temporaries),('default',with_defaults),\
+      ('chunked',make_chunked(opts.block_rows))]
+
+    #check the approaches agree on small inputs before measuring them
+    inputs = make_inputs(50,opts.columns)
+    expected = with_temporaries(*inputs)
+    for name,f in approaches[1:]:
+        for exp,obs in zip(expected,f(*inputs)):
+            if not array_equal(exp,obs):
+                option_parser.error("The %s results differ from the original results" % name)
+
+    input_mb = opts.rows*opts.columns*8/2**20
+    print "Inputs: 3 arrays of %i x %i floats (%.0f MB each)" \
+      %(opts.rows,opts.columns,input_mb)
+    print "approach\textra peak RSS (MB)\ttime (s)"
+    for name,f in approaches:
+        extra_rss,elapsed = measure(f,opts.rows,opts.columns)
+        print "%s\t%.0f\t%.2f" %(name,extra_rss,elapsed)
+
+if __name__ == "__main__":
+    main()
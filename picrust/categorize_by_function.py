@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+# File created on 18 Oct 2026
+from __future__ import division
+
+__author__ = "Daniel McDonald"
+__copyright__ = "Copyright 2011-2013, The PICRUSt Project"
+__credits__ = ["Daniel McDonald", "Morgan Langille", "Jesse Zaneveld"]
+__license__ = "GPL"
+__version__ = "1.0.0-dev"
+__maintainer__ = "Daniel McDonald"
+__email__ = "mcdonadt@colorado.edu"
+__status__ = "Development"
+
+from os.path import splitext
+from numpy import array, arange, repeat, cumsum, bincount, int64
+from biom.table import table_factory, TableException
+from picrust.util import get_sparse_coordinates, sparse_matrix_from_coordinates,\
+  parse_precalc_trait_metadata, parse_precalc_header, parse_precalc_block,\
+  iter_line_blocks, biom_meta_to_string
+import gzip
+import StringIO
+
+def make_collapse_f(category, level, ignore):
+    """produce a collapsing function for one-to-many relationships"""
+    # adjust level such that, for instance, level 1 corresponds to index 0
+    if level > 0:
+        level -= 1
+
+    if ignore is not None:
+        ignore_labels = set(ignore.split(','))
+    else:
+        ignore_labels = None
+
+    def collapse(md):
+        is_single_level = False
+
+        for path in md[category]:
+
+            # need to convert strings to lists (if needed) before checking
+            #if they are in the ignore list
+            if isinstance(path,basestring):
+                # If we have a list of strings, we want the whole thing (only)
+                path = md[category]
+                is_single_level = True
+
+            if ignore is not None and path[level].lower() in ignore_labels:
+                continue
+
+            yield (path[:(level+1)],path[level])
+
+            #If we only have one list of strings, we're done - bail.
+            if is_single_level:
+                break
+    return collapse
+
+def compile_category_aggregation(observation_metadata, category, level,\
+    ignore=None):
+    """Return the categories at level and the observations aggregated into each
+
+    observation_metadata -- the metadata of each observation of a table,
+      containing category
+    category, level, ignore -- as passed to categorize_by_function
+
+    Returns the sorted category ids, the metadata of each category, and
+    arrays of the category and observation indices of the entries of the
+    (categories x observations) aggregation matrix.  An observation that
+    falls into a category several times has an entry for each time, so it
+    is counted that many times, as by
+    Table.collapseObservationsByMetadata with one_to_many=True.  The
+    aggregation only depends on the observation metadata, so it can be
+    applied to any table with the same observations (see
+    collapse_by_aggregation).
+    """
+    collapse_f = make_collapse_f(category, level, ignore)
+    category_paths = {}
+    entry_categories = []
+    entry_observations = []
+    for observation_idx,md in enumerate(observation_metadata):
+        paths = collapse_f(md)
+        while True:
+            #a path that doesn't reach level ends the generator, dropping
+            #the observation's remaining paths as collapseObservationsByMetadata
+            #does
+            try:
+                path,category_id = paths.next()
+            except (IndexError,StopIteration):
+                break
+            #categories are keyed by their name, and described by the last
+            #path seen that leads to them
+            category_paths[category_id] = path
+            entry_categories.append(category_id)
+            entry_observations.append(observation_idx)
+
+    category_ids = sorted(category_paths)
+    category_idxs = dict((c,i) for i,c in enumerate(category_ids))
+    category_metadata = [{category:category_paths[c]} for c in category_ids]
+    return category_ids,category_metadata,\
+      array([category_idxs[c] for c in entry_categories],dtype=int64),\
+      array(entry_observations,dtype=int64)
+
+def get_observation_coordinates(table):
+    """Return observation indices, sample indices and values of table's nonzero entries, by observation"""
+    if table._biom_matrix_type == 'sparse':
+        rows,cols,values = get_sparse_coordinates(table._data)
+        #the sums of each category are accumulated in observation order
+        order = rows.argsort(kind='mergesort')
+        return rows[order],cols[order],values[order]
+    data = array(table._data,dtype=float)
+    rows,cols = data.nonzero()
+    return rows,cols,data[rows,cols]
+
+def aggregate_coordinates(aggregation, rows, cols, values, n_observations,\
+    n_samples):
+    """Return the dense (categories x samples) product of an aggregation and a sparse matrix
+
+    aggregation -- as returned by compile_category_aggregation
+    rows, cols, values -- the observation indices, sample indices and
+      values of the nonzero entries of an (observations x samples)
+      matrix, ordered by observation
+
+    Each category's sums are accumulated in observation order.
+    """
+    category_ids,category_metadata,entry_categories,entry_observations = \
+      aggregation
+    #the aggregation entries of each observation are consecutive, starting
+    #at its offset
+    n_entries = bincount(entry_observations,minlength=n_observations)
+    offsets = cumsum(n_entries) - n_entries
+    #repeat each matrix entry once for each category its observation is in
+    entry_counts = n_entries[rows]
+    value_idxs = repeat(arange(len(rows)),entry_counts)
+    within_observation = arange(len(value_idxs)) - \
+      repeat(cumsum(entry_counts) - entry_counts,entry_counts)
+    categories = entry_categories[offsets[rows[value_idxs]] + within_observation]
+    data = bincount(categories*n_samples + cols[value_idxs],\
+      weights=values[value_idxs],minlength=len(category_ids)*n_samples)
+    #without any entries, bincount counts (as integers) rather than sums
+    return data.reshape((len(category_ids),n_samples)).astype(float)
+
+def collapse_by_aggregation(table, aggregation, coordinates=None):
+    """Return table collapsed by an aggregation from compile_category_aggregation
+
+    coordinates -- table's nonzero entries, as returned by
+      get_observation_coordinates.  Pass them to collapse one table by
+      several aggregations without extracting them again.
+
+    The collapsed table is the product of the aggregation matrix and the
+    table's data (see aggregate_coordinates).  It is the same type of
+    table as table.  Raises TableException if no observations fall into
+    any category.
+    """
+    category_ids,category_metadata,entry_categories,entry_observations = \
+      aggregation
+    if not category_ids:
+        raise TableException, "Collapsed table is empty!"
+    if coordinates is None:
+        coordinates = get_observation_coordinates(table)
+    rows,cols,values = coordinates
+    data = aggregate_coordinates(aggregation,rows,cols,values,\
+      len(table.ObservationIds),len(table.SampleIds))
+
+    if table._biom_matrix_type == 'sparse':
+        collapsed_rows,collapsed_cols = data.nonzero()
+        data = sparse_matrix_from_coordinates(collapsed_rows,collapsed_cols,\
+          data[collapsed_rows,collapsed_cols],data.shape)
+    return table_factory(data,table.SampleIds[:],category_ids,\
+      table.SampleMetadata,category_metadata,table.TableId,\
+      constructor=table.__class__)
+
+def categorize_by_function(table, category, level, ignore=None):
+    """Collapse the observations in table to level in the category hierarchy
+
+    table -- BIOM Table whose observation metadata contains category
+    category -- the metadata category describing the hierarchy
+      (e.g. KEGG_Pathways)
+    level -- the level to collapse to (1 is the highest level)
+    ignore -- comma-separated labels to skip while collapsing, or None
+    """
+    return categorize_by_function_levels(table, category, [level], ignore)[0]
+
+def categorize_by_function_levels(table, category, levels, ignore=None):
+    """Return a list of table collapsed to each of levels, as by categorize_by_function
+
+    The table's nonzero entries are only extracted once for all levels.
+    """
+    for level in levels:
+        if level <= 0:
+            raise ValueError("level must be greater than zero!")
+
+    coordinates = get_observation_coordinates(table)
+    return [collapse_by_aggregation(table,\
+      compile_category_aggregation(table.ObservationMetadata,category,level,\
+        ignore),coordinates) for level in levels]
+
+def write_categorized_precalc(data_table_fp, category, level_output_fps,\
+    ignore=None, md_prefix='metadata_', block_size=2**22, verbose=False):
+    """Write tab-delimited precalculated tables of the counts of each category per OTU
+
+    data_table_fp -- tab-delimited table of predicted gene counts per OTU,
+      with category in its trait metadata
+    category -- the trait metadata describing the hierarchy (e.g.
+      KEGG_Pathways)
+    level_output_fps -- (level, output filepath) pairs of the levels to
+      collapse to and the tables to write.  Input and output files are
+      gzipped if their names end in .gz
+    ignore -- comma-separated labels to skip while collapsing, or None
+
+    Each OTU's count of a category is the sum of its counts of the genes
+    in the category, counting a gene once for each of its paths into the
+    category, as categorize_by_function does.  Predicting metagenomes with
+    a derived table gives the category counts directly, except that they
+    are rounded per category rather than per gene.  Each category's path
+    is stored as its category metadata, and the per-OTU metadata columns
+    (e.g. NSTI) are carried over.  The table is collapsed a block of lines
+    at a time.  Returns the number of OTUs written to each table.  Raises
+    ValueError if no genes have category metadata, or none fall into any
+    category at one of the levels.
+    """
+    levels = [level for level,output_fp in level_output_fps]
+    for level in levels:
+        if level <= 0:
+            raise ValueError("level must be greater than zero!")
+
+    if splitext(data_table_fp)[1] == '.gz':
+        open_data_table = lambda: gzip.open(data_table_fp,'rb')
+    else:
+        open_data_table = lambda: open(data_table_fp,'U')
+    #the trait metadata can follow the OTUs, so it is read in a first pass
+    data_table_fh = open_data_table()
+    trait_metadata = [md for trait_id,md in \
+      parse_precalc_trait_metadata(data_table_fh,md_prefix)]
+    data_table_fh.close()
+    if not any(category in md for md in trait_metadata):
+        raise ValueError("No genes in %s have %s metadata." \
+          %(data_table_fp,category))
+    aggregations = []
+    for level in levels:
+        aggregation = compile_category_aggregation(trait_metadata,category,\
+          level,ignore)
+        if not aggregation[0]:
+            raise ValueError("No genes in %s fall into a %s category at level %d." \
+              %(data_table_fp,category,level))
+        aggregations.append(aggregation)
+
+    data_table_fh = open_data_table()
+    header = data_table_fh.readline().rstrip('\n')
+    trait_ids,col_meta_locs,end_of_data = parse_precalc_header(\
+      StringIO.StringIO(header),md_prefix)
+    col_meta_names = sorted(col_meta_locs,key=col_meta_locs.get)
+    output_fhs = []
+    for (level,output_fp),aggregation in zip(level_output_fps,aggregations):
+        if splitext(output_fp)[1] == '.gz':
+            output_fh = gzip.open(output_fp,'wb')
+        else:
+            output_fh = open(output_fp,'w')
+        category_ids,category_metadata = aggregation[:2]
+        output_fh.write('\t'.join(['#OTU_IDs'] + category_ids + \
+          [md_prefix+name for name in col_meta_names]) + '\n')
+        output_fh.write('\t'.join([md_prefix+category] + \
+          [biom_meta_to_string(md[category]) for md in category_metadata]) + '\n')
+        output_fhs.append(output_fh)
+
+    n_written = 0
+    block_args = (len(trait_ids),col_meta_locs,end_of_data,None,md_prefix,None)
+    for block in iter_line_blocks(data_table_fh,block_size):
+        otu_ids,data,col_meta,metadata_lines = parse_precalc_block(\
+          (block,)+block_args)
+        if not otu_ids:
+            continue
+        #the gene counts of each OTU, by gene
+        trait_idxs,otu_idxs = data.T.nonzero()
+        values = data[otu_idxs,trait_idxs]
+        for aggregation,output_fh in zip(aggregations,output_fhs):
+            category_data = aggregate_coordinates(aggregation,trait_idxs,\
+              otu_idxs,values,len(trait_ids),len(otu_ids))
+            for otu_id,values_by_category,md in zip(otu_ids,\
+              category_data.T.tolist(),col_meta):
+                #the repr of a list of floats holds the shortest string
+                #that parses back to each value, so no precision is lost
+                fields = [otu_id,repr(values_by_category)[1:-1].replace(', ','\t')]
+                fields.extend(md[name] for name in col_meta_names)
+                output_fh.write('\t'.join(fields) + '\n')
+        n_written += len(otu_ids)
+        if verbose:
+            print "Collapsed the gene counts of %i OTUs" % n_written
+
+    data_table_fh.close()
+    for output_fh in output_fhs:
+        output_fh.close()
+    return n_written
+
+def format_categorized_table(table, category, tab_delimited=False):
+    """Return the collapsed table as a BIOM JSON or tab-delimited string"""
+    if tab_delimited:
+        return table.delimitedSelf(header_key=category,header_value=category,\
+          metadata_formatter=lambda s: '; '.join(s))
+    else:
+        return table.getBiomFormatJsonString('picrust %s - categorize_by_function'\
+                                           % __version__)
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# File created on 18 Oct 2026
+from __future__ import division
+
+__author__ = "Greg Caporaso"
+__copyright__ = "Copyright 2011-2013, The PICRUSt Project"
+__credits__ = ["Greg Caporaso","Jesse Zaneveld","Morgan Langille"]
+__license__ = "GPL"
+__version__ = "1.0.0-dev"
+__maintainer__ = "Greg Caporaso"
+__email__ = "gregcaporaso@gmail.com"
+__status__ = "Development"
+
+import json
+from warnings import warn
+from os.path import join, exists
+from numpy import array, zeros, concatenate, bincount, cumsum, save, load,\
+  int32, int64
+from biom.table import table_factory, DenseGeneTable
+from picrust.predict_metagenomes import load_data_table, open_precalc_blocks,\
+  get_function_ids_in_category
+from picrust.util import make_output_dir, get_table_data_array,\
+  select_precalc_traits, check_precalc_ids_loaded, file_digest
+
+INDEX_INFO_FILENAME = 'index.json'
+
+def build_function_index(data_table_fp,output_dir,load_data_table_in_biom=False,\
+    processes=1,verbose=False):
+    """Write an inverted index of the OTUs with nonzero counts of each function
+
+    data_table_fp -- a precalculated table of gene counts per OTU, in the
+      tab-delimited format (parsed in blocks by processes processes) or,
+      if load_data_table_in_biom, in BIOM format
+    output_dir -- the directory to write the index to
+
+    For each function, the index lists the OTUs (in file order) that have
+    it and their counts, as consecutive slices of the postings_otus.npy
+    and postings_counts.npy arrays, starting at the offsets in
+    offsets.npy.  The function and OTU ids, their metadata and the sha1
+    digest of data_table_fp are stored alongside, so the index only needs
+    to be rebuilt when the precalculated table changes.  Returns the
+    number of postings.  See FunctionIndex.
+    """
+    if load_data_table_in_biom:
+        genome_table = load_data_table(data_table_fp,\
+          load_data_table_in_biom=True,suppress_subset_loading=True,\
+          transpose=True,verbose=verbose)
+        blocks = [(list(genome_table.SampleIds),\
+          get_table_data_array(genome_table).T,\
+          list(genome_table.SampleMetadata or [{}]*len(genome_table.SampleIds)))]
+        function_ids = list(genome_table.ObservationIds)
+        otu_ids = blocks[0][0]
+        get_function_metadata = lambda: list(genome_table.ObservationMetadata \
+          or [{}]*len(function_ids))
+    else:
+        reader = open_precalc_blocks(data_table_fp,processes=processes,\
+          verbose=verbose)
+        blocks = reader
+        function_ids = reader.trait_ids
+        otu_ids = reader.otu_ids
+        #trait metadata is complete once every block has been read
+        get_function_metadata = lambda: reader.row_meta
+
+    otu_metadata = []
+    postings_functions = []
+    postings_otus = []
+    postings_counts = []
+    n_otus = 0
+    for block_otu_ids,data,col_meta in blocks:
+        otu_idxs,function_idxs = data.nonzero()
+        postings_functions.append(function_idxs.astype(int32))
+        postings_otus.append((otu_idxs + n_otus).astype(int32))
+        postings_counts.append(data[otu_idxs,function_idxs])
+        otu_metadata.extend(col_meta)
+        n_otus += len(block_otu_ids)
+        if verbose:
+            print "Indexed %i OTUs" % n_otus
+
+    postings_functions = concatenate(postings_functions or [zeros(0,dtype=int32)])
+    #a stable sort by function keeps the OTUs of each function in file order
+    order = postings_functions.argsort(kind='mergesort')
+    offsets = zeros(len(function_ids)+1,dtype=int64)
+    offsets[1:] = cumsum(bincount(postings_functions,minlength=len(function_ids)))
+
+    make_output_dir(output_dir)
+    save(join(output_dir,'offsets.npy'),offsets)
+    save(join(output_dir,'postings_otus.npy'),\
+      concatenate(postings_otus or [zeros(0,dtype=int32)])[order])
+    save(join(output_dir,'postings_counts.npy'),\
+      concatenate(postings_counts or [zeros(0)])[order])
+    save(join(output_dir,'function_ids.npy'),array(function_ids,dtype=unicode))
+    save(join(output_dir,'otu_ids.npy'),array(otu_ids,dtype=unicode))
+    json.dump(get_function_metadata(),\
+      open(join(output_dir,'function_metadata.json'),'w'))
+    json.dump(otu_metadata,open(join(output_dir,'otu_metadata.json'),'w'))
+    info = {'data_table':data_table_fp,\
+      'data_table_sha1':file_digest(data_table_fp),\
+      'n_functions':len(function_ids),'n_otus':len(otu_ids),\
+      'n_postings':len(order)}
+    json.dump(info,open(join(output_dir,INDEX_INFO_FILENAME),'w'),indent=1)
+    return len(order)
+
+class FunctionIndex(object):
+    """Look up the OTUs carrying each function in an index built by build_function_index
+
+    The postings are memory-mapped, so opening the index is cheap and a
+    lookup only reads the postings of the requested functions.
+    """
+
+    def __init__(self,index_dir):
+        info_fp = join(index_dir,INDEX_INFO_FILENAME)
+        if not exists(info_fp):
+            raise IOError("No function index found in %s. Build one with build_function_index.py" % index_dir)
+        self.index_dir = index_dir
+        self.info = json.load(open(info_fp,'U'))
+        self.function_ids = [str(f) for f in load(join(index_dir,'function_ids.npy'))]
+        self._function_idxs = dict((f,i) for i,f in enumerate(self.function_ids))
+        self._offsets = load(join(index_dir,'offsets.npy'))
+        self._otus = load(join(index_dir,'postings_otus.npy'),mmap_mode='r')
+        self._counts = load(join(index_dir,'postings_counts.npy'),mmap_mode='r')
+        self._otu_ids = None
+        self._function_metadata = None
+        self._otu_metadata = None
+
+    @property
+    def otu_ids(self):
+        if self._otu_ids is None:
+            self._otu_ids = [str(o) for o in load(join(self.index_dir,'otu_ids.npy'))]
+        return self._otu_ids
+
+    def function_metadata(self):
+        """Return the (function id, metadata) pairs of the indexed functions"""
+        if self._function_metadata is None:
+            self._function_metadata = json.load(\
+              open(join(self.index_dir,'function_metadata.json'),'U'))
+        return zip(self.function_ids,self._function_metadata)
+
+    def postings(self,function_id):
+        """Return arrays of the indices (into otu_ids) and counts of the OTUs with function_id
+
+        Raises KeyError if function_id is not indexed.
+        """
+        i = self._function_idxs[str(function_id)]
+        start,end = self._offsets[i],self._offsets[i+1]
+        return array(self._otus[start:end]),array(self._counts[start:end])
+
+    def lookup(self,function_id):
+        """Return (OTU id, count) pairs for the OTUs that have function_id"""
+        otu_idxs,counts = self.postings(function_id)
+        return [(self.otu_ids[i],count) for i,count in \
+          zip(otu_idxs.tolist(),counts.tolist())]
+
+    def check_data_table(self):
+        """Warn if the table the index was built from has changed since
+
+        Returns False (after warning) if the sha1 digest of the table at
+        info['data_table'] differs from the one stored when the index was
+        built, and True otherwise.  A table that no longer exists at that
+        path can't be checked, and is not reported as changed.
+        """
+        data_table_fp = self.info['data_table']
+        if not exists(data_table_fp) or \
+          file_digest(data_table_fp) == self.info['data_table_sha1']:
+            return True
+        warn("%s has changed since the function index in %s was built from it. Rebuild the index with build_function_index.py." \
+          %(data_table_fp,self.index_dir))
+        return False
+
+    def select_functions(self,function_ids=None,category_names=None,\
+        metadata_category='KEGG_Pathways'):
+        """Return the function ids to load, as determine_functions_to_load does
+
+        Returns None (for all functions) if neither function_ids nor
+        category_names is given.  Raises ValueError if no functions are in
+        category_names.
+        """
+        if not function_ids and not category_names:
+            return None
+        functions_to_load = list(function_ids or [])
+        if category_names:
+            category_function_ids = get_function_ids_in_category(\
+              self.function_metadata(),metadata_category,category_names)
+            if not category_function_ids:
+                raise ValueError("No functions in %s are annotated with: %s" \
+                  %(self.index_dir,', '.join(category_names)))
+            functions_to_load.extend(f for f in category_function_ids \
+              if f not in functions_to_load)
+        return functions_to_load
+
+    def get_genome_table(self,functions_to_load=None,ids_to_load=None):
+        """Return a table of the counts of functions_to_load for the OTUs in ids_to_load
+
+        The table matches the one load_data_table returns with
+        transpose=True (functions as observations and OTUs as samples,
+        both in file order, with their metadata), but only the postings of
+        functions_to_load are read.  None loads all functions or OTUs.
+        Raises ValueError if any functions or OTUs are not indexed.
+        """
+        function_ids,function_idxs = select_precalc_traits(self.function_ids,\
+          functions_to_load)
+        if ids_to_load:
+            ids_to_load = set(map(str,ids_to_load))
+            otu_idxs = [i for i,otu_id in enumerate(self.otu_ids) \
+              if otu_id in ids_to_load]
+            otu_ids = [self.otu_ids[i] for i in otu_idxs]
+            check_precalc_ids_loaded(otu_ids,ids_to_load.difference(otu_ids))
+        else:
+            otu_idxs = range(len(self.otu_ids))
+            otu_ids = list(self.otu_ids)
+
+        #the column of each indexed OTU in the table, or -1 if not loaded
+        columns = zeros(len(self.otu_ids),dtype=int64) - 1
+        columns[otu_idxs] = range(len(otu_idxs))
+        data = zeros((len(function_ids),len(otu_ids)))
+        for row,function_id in enumerate(function_ids):
+            postings_otus,counts = self.postings(function_id)
+            postings_columns = columns[postings_otus]
+            loaded = postings_columns >= 0
+            data[row,postings_columns[loaded]] = counts[loaded]
+
+        if self._otu_metadata is None:
+            self._otu_metadata = json.load(\
+              open(join(self.index_dir,'otu_metadata.json'),'U'))
+        function_metadata = [md for function_id,md in self.function_metadata()]
+        return table_factory(data,otu_ids,function_ids,\
+          [self._otu_metadata[i] for i in otu_idxs],\
+          [function_metadata[i] for i in function_idxs],\
+          constructor=DenseGeneTable)
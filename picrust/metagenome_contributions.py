@@ -11,20 +11,123 @@ __maintainer__ = "Jesse Zaneveld"
 __email__ = "zaneveld@gmail.com"
 __status__ = "Development"
 
-from numpy import dot, array, around
+import gzip
+from os import remove
+from os.path import join
+from multiprocessing import Pool
+from itertools import izip
+from shutil import rmtree, copyfileobj
+from tempfile import mkdtemp
+from StringIO import StringIO
+from zipfile import ZipFile, ZIP_DEFLATED
+from numpy import dot, array, around, arange, repeat, tile, maximum,\
+  dtype, load, in1d, zeros, ones, empty, lexsort, searchsorted, bincount,\
+  unique, concatenate
+from numpy.lib import format as npy_format
 from biom.table import table_factory
 from picrust.predict_metagenomes import get_overlapping_ids,extract_otu_and_genome_data
 
-def partition_metagenome_contributions(otu_table,genome_table, limit_to_functions=[], remove_zero_rows=True,verbose=True):
+CONTRIBUTIONS_HEADER = ["Gene","Sample","OTU","GeneCountPerGenome",\
+  "OTUAbundanceInSample","CountContributedByOTU",\
+  "ContributionPercentOfSample","ContributionPercentOfAllSamples",\
+  "Kingdom","Phylum","Class","Order","Family","Genus","Species"]
+CONTRIBUTIONS_ID_COLUMNS = CONTRIBUTIONS_HEADER[:3]
+CONTRIBUTIONS_VALUE_COLUMNS = CONTRIBUTIONS_HEADER[3:8]
+CONTRIBUTIONS_TAXONOMY_COLUMNS = CONTRIBUTIONS_HEADER[8:]
+#the OTU id of the summed contributions omitted by top_k or min_fraction
+OTHER_CONTRIBUTIONS_ID = 'Other'
+
+def partition_metagenome_contributions(otu_table,genome_table, limit_to_functions=[], remove_zero_rows=True,\
+    top_k=None,min_fraction=None,verbose=True):
     """Return a list of the contribution of each organism to each function, per sample
     (rewritten version using numpy)
     otu_table -- the BIOM Table object for the OTU table
     genome_table -- the BIOM Table object for the predicted genomes
     limit_to_functions -- a list of function ids to include.  If empty, include all function ids
+    top_k -- if provided, only list the top_k OTUs contributing the most
+      to each gene in each sample
+    min_fraction -- if provided, only list OTUs contributing at least this
+      fraction of each gene's count in a sample
+    The contributions omitted by top_k or min_fraction are summed into a
+    row for OTU 'Other' (see iter_contribution_arrays).
     Output table as a list of lists with header
     Function\tOrganism\tSample\tCounts\tpercent_of_sample
+
+    See iter_metagenome_contributions, which yields the same rows one gene
+    at a time without holding all of them in memory.
+    """
+    result = [list(CONTRIBUTIONS_HEADER)]
+    for gene_rows in iter_metagenome_contributions(otu_table,genome_table,\
+      limit_to_functions=limit_to_functions,remove_zero_rows=remove_zero_rows,\
+      top_k=top_k,min_fraction=min_fraction,verbose=verbose):
+        result.extend(gene_rows)
+    return result
+
+def iter_metagenome_contributions(otu_table,genome_table,limit_to_functions=[],\
+    remove_zero_rows=True,top_k=None,min_fraction=None,verbose=True):
+    """Yield the rows of partition_metagenome_contributions for each gene in turn
+
+    Each item is the list of rows (without the header) for one gene, so
+    only one gene's rows need to be held in memory at a time.
+
+    Rather than looping over every gene, sample and OTU, the contributions
+    of each gene are calculated at once for the OTUs that have it, and
+    only the nonzero contributions are listed (unless remove_zero_rows is
+    False).  Rows are ordered by gene, then sample, then OTU.
+    """
+
+    data = prepare_contribution_data(otu_table,genome_table,\
+      limit_to_functions,verbose=verbose)
+    sample_ids = array(data['sample_ids'],dtype=object)
+    otu_ids = array(data['otu_ids'],dtype=object)
+
+    for j,sample_idxs,otu_idxs,values in iter_contribution_arrays(\
+      data['otu_data'],data['genome_data'],remove_zero_rows=remove_zero_rows,\
+      top_k=top_k,min_fraction=min_fraction):
+        yield format_gene_contribution_rows(data['gene_ids'][j],sample_idxs,\
+          otu_idxs,values,sample_ids,otu_ids,data['taxonomy'])
+
+def prepare_contribution_data(otu_table,genome_table,limit_to_functions=[],\
+    verbose=True):
+    """Return the aligned data and ids needed to calculate contributions, as a dict
+
+    otu_data and genome_data are as returned by extract_otu_and_genome_data.
+    otu_ids and taxonomy (a list per OTU) end with an entry for the summed
+    contributions omitted by top_k or min_fraction (see
+    iter_contribution_arrays).
+    """
+    genome_table = limit_genome_table_to_functions(genome_table,\
+      limit_to_functions,verbose=verbose)
+    otu_data,genome_data,overlapping_ids = extract_otu_and_genome_data(otu_table,genome_table)
+    #We have a list of data with abundances and gene copy numbers
+    return {'otu_data':otu_data,'genome_data':genome_data,\
+      'gene_ids':list(genome_table.ObservationIds),\
+      'sample_ids':list(otu_table.SampleIds),\
+      'otu_ids':list(overlapping_ids) + [OTHER_CONTRIBUTIONS_ID],\
+      'taxonomy':get_otu_taxonomy(otu_table,overlapping_ids) + [[]]}
+
+def format_gene_contribution_rows(gene_id,sample_idxs,otu_idxs,values,\
+    sample_ids,otu_ids,taxonomy):
+    """Return the rows for one gene from the arrays of iter_contribution_arrays
+
+    sample_ids,otu_ids -- object arrays of the ids the indices refer to
+    taxonomy -- the taxonomy of each OTU, as a list of lists
     """
+    gene_counts,abundances,counts,sample_percents,all_samples_percents = \
+      [v.tolist() for v in values]
+    return [[gene_id,sample_id,otu_id,gene_count,abundance,count,\
+      sample_percent,all_samples_percent] + taxonomy[otu_idx] \
+      for sample_id,otu_id,otu_idx,gene_count,abundance,count,\
+      sample_percent,all_samples_percent in zip(sample_ids[sample_idxs],\
+      otu_ids[otu_idxs],otu_idxs.tolist(),gene_counts,abundances,counts,\
+      sample_percents,all_samples_percents)]
 
+def limit_genome_table_to_functions(genome_table,limit_to_functions,verbose=True):
+    """Return genome_table filtered to the genes in limit_to_functions
+
+    If limit_to_functions is empty, genome_table is returned unchanged.
+    Raises ValueError if none of the genes are in the genome table.
+    """
     if limit_to_functions:
         if verbose:
             print "Filtering the genome table to include only user-specified functions:",limit_to_functions
@@ -40,56 +143,399 @@ def partition_metagenome_contributions(otu_table,genome_table, limit_to_function
         
         if genome_table.isEmpty():
             raise ValueError("User filtering by functions (%s) removed all results from the genome table"%(str(limit_to_functions)))
+    return genome_table
 
-    otu_data,genome_data,overlapping_ids = extract_otu_and_genome_data(otu_table,genome_table)
-    #We have a list of data with abundances and gene copy numbers
-    lines=[]
-    result = [["Gene","Sample","OTU","GeneCountPerGenome",\
-            "OTUAbundanceInSample","CountContributedByOTU",\
-            "ContributionPercentOfSample","ContributionPercentOfAllSamples",
-                   "Kingdom","Phylum","Class","Order","Family","Genus","Species"]]
+def iter_contribution_arrays(otu_data,genome_data,remove_zero_rows=True,\
+    top_k=None,min_fraction=None):
+    """Yield the contributions of each OTU to each gene as arrays, gene by gene
+
+    otu_data,genome_data -- aligned OTU abundances and gene counts, as
+      returned by extract_otu_and_genome_data
+    top_k -- if provided, only list the top_k OTUs contributing most to
+      the gene in each sample (ties are broken by OTU order)
+    min_fraction -- if provided, only list OTUs contributing at least
+      this fraction of the gene's count in each sample
 
-    #TODO refactor as array operations for speed
+    For each gene (column of genome_data) j, yields j,sample_idxs,otu_idxs,values
+    where sample_idxs (columns of otu_data) and otu_idxs (rows of both
+    arrays) give the sample and OTU of each contribution, and values are
+    arrays of the GeneCountPerGenome, OTUAbundanceInSample,
+    CountContributedByOTU, ContributionPercentOfSample and
+    ContributionPercentOfAllSamples of each contribution.
 
+    If top_k or min_fraction omit any contributions to a sample, they are
+    summed into one row for the sample, following its other rows, with an
+    otu_idx of otu_data.shape[0].  Its GeneCountPerGenome is the mean
+    gene count of the omitted OTUs, weighted by their abundance.
+    """
     #Zero-valued total counts will be set to epsilon 
     epsilon = 1e-5
+    all_otus = arange(otu_data.shape[0])
 
-    for j,gene_id in enumerate(genome_table.ObservationIds):
-        all_gene_rows = []
-        for k,sample_id in enumerate(otu_table.SampleIds):
-            #Add raw counts for the gene in this sample to a list
-            sample_gene_rows = []
-            for i,otu_id in enumerate(overlapping_ids):
-                otu_gene_count = genome_data[i][j]
-                otu_abundance = otu_data[i][k]
-                contribution =  otu_gene_count * otu_abundance
-                if remove_zero_rows and contribution == 0.0:
-                    #skip zero contributions
-                    continue
-                sample_gene_rows.append([gene_id,sample_id,otu_id,otu_gene_count,otu_abundance,contribution])
-            #Now get the percentage of each genes contribution to the sample overall
-            total_counts =max(epsilon,sum([float(row[-1]) for row in sample_gene_rows]))
-
-            for row in sample_gene_rows:
-                percent_of_sample = float(row[-1])/total_counts
-                row.append(percent_of_sample)
-            all_gene_rows.extend(sample_gene_rows)
-        
-        count_idx = -2 #Counts are now in the next to last position in each row
-        total_counts =max(epsilon,sum([float(row[count_idx]) for row in all_gene_rows]))
-        otu_index=2 #position of otu ids in the table
+    for j in range(genome_data.shape[1]):
+        gene_counts = genome_data[:,j]
+        if remove_zero_rows:
+            #only OTUs with the gene can contribute
+            gene_otus = gene_counts.nonzero()[0]
+        else:
+            gene_otus = all_otus
+        #The contribution of each OTU with the gene (columns) to each
+        #sample (rows), so that nonzero() lists them sample by sample
+        contributions = otu_data[gene_otus].T * gene_counts[gene_otus]
+        if remove_zero_rows:
+            sample_idxs,otu_positions = contributions.nonzero()
+        else:
+            sample_idxs = repeat(arange(contributions.shape[0]),len(gene_otus))
+            otu_positions = tile(arange(len(gene_otus)),contributions.shape[0])
+        otu_idxs = gene_otus[otu_positions]
+        counts = contributions[sample_idxs,otu_positions]
 
-        for row in all_gene_rows:
-            percent_of_sample = float(row[count_idx])/total_counts
-            row.append(percent_of_sample)
+        sample_totals = maximum(contributions.sum(axis=1),epsilon)
+        percent_of_sample = counts/sample_totals[sample_idxs]
+        all_samples_total = max(epsilon,counts.sum())
+        percent_of_all_samples = counts/all_samples_total
+        values = [gene_counts[otu_idxs],otu_data[otu_idxs,sample_idxs],\
+          counts,percent_of_sample,percent_of_all_samples]
 
-            #add taxonomy information for each OTU
-            obs_index=otu_table.getObservationIndex(row[otu_index])
-            if otu_table.ObservationMetadata and 'taxonomy' in otu_table.ObservationMetadata[obs_index]:
-                row.extend(otu_table.ObservationMetadata[obs_index]['taxonomy'])
+        if top_k is not None or min_fraction is not None:
+            keep = select_top_contributions(sample_idxs,counts,\
+              percent_of_sample,top_k,min_fraction)
+            sample_idxs,otu_idxs,values = aggregate_other_contributions(\
+              keep,sample_idxs,otu_idxs,values,sample_totals,\
+              all_samples_total,otu_data.shape[0])
+        yield j,sample_idxs,otu_idxs,values
 
-        lines.extend(all_gene_rows)
-    result.extend(lines)
+def select_top_contributions(sample_idxs,counts,percent_of_sample,\
+    top_k=None,min_fraction=None):
+    """Return a boolean array marking the contributions to keep in each sample
 
-    return result
+    sample_idxs -- the sample of each contribution, in increasing order
+    counts, percent_of_sample -- the count and fraction of its sample's
+      total of each contribution
+    top_k -- keep only the top_k largest counts in each sample (ties
+      are broken by position)
+    min_fraction -- keep only contributions of at least this fraction
 
+    Ranks are found with a single sort of all contributions by sample and
+    decreasing count, rather than sorting each sample separately.
+    """
+    keep = ones(len(counts),dtype=bool)
+    if top_k is not None and len(counts):
+        order = lexsort((arange(len(counts)),-counts,sample_idxs))
+        #the rank of each contribution within its sample
+        sample_starts = searchsorted(sample_idxs,sample_idxs,side='left')
+        ranks = empty(len(counts),dtype=int)
+        ranks[order] = arange(len(counts))
+        keep &= (ranks - sample_starts) < top_k
+    if min_fraction is not None:
+        keep &= percent_of_sample >= min_fraction
+    return keep
+
+def aggregate_other_contributions(keep,sample_idxs,otu_idxs,values,\
+    sample_totals,all_samples_total,other_otu_idx):
+    """Replace the contributions not in keep with one summed row per sample
+
+    values -- the arrays yielded by iter_contribution_arrays
+    sample_totals, all_samples_total -- the totals the percentages of
+      each sample and of all samples are relative to
+
+    Returns sample_idxs,otu_idxs,values with the summed rows (marked by
+    other_otu_idx) following the kept rows of each sample.
+    """
+    omitted = ~keep
+    if not omitted.any():
+        return sample_idxs,otu_idxs,values
+    n_samples = len(sample_totals)
+    other_counts = bincount(sample_idxs[omitted],weights=values[2][omitted],\
+      minlength=n_samples)
+    other_abundances = bincount(sample_idxs[omitted],\
+      weights=values[1][omitted],minlength=n_samples)
+    other_samples = unique(sample_idxs[omitted])
+    other_counts = other_counts[other_samples]
+    other_abundances = other_abundances[other_samples]
+    other_values = [other_counts/maximum(other_abundances,1e-300),\
+      other_abundances,other_counts,other_counts/sample_totals[other_samples],\
+      other_counts/all_samples_total]
+
+    #a stable sort by sample puts each summed row after the kept rows
+    sample_idxs = concatenate([sample_idxs[keep],other_samples])
+    order = sample_idxs.argsort(kind='mergesort')
+    otu_idxs = concatenate([otu_idxs[keep],\
+      zeros(len(other_samples),dtype=otu_idxs.dtype) + other_otu_idx])
+    values = [concatenate([v[keep],other_v])[order] \
+      for v,other_v in zip(values,other_values)]
+    return sample_idxs[order],otu_idxs[order],values
+
+def get_otu_taxonomy(otu_table,otu_ids):
+    """Return the taxonomy of each of otu_ids in otu_table, as a list of lists
+
+    OTUs without taxonomy metadata get an empty list.
+    """
+    if not otu_table.ObservationMetadata:
+        return [[] for otu_id in otu_ids]
+    taxonomy = []
+    for otu_id in otu_ids:
+        metadata = otu_table.ObservationMetadata[otu_table.getObservationIndex(otu_id)]
+        taxonomy.append(list(metadata.get('taxonomy',[])) if metadata else [])
+    return taxonomy
+
+def format_contributions(partitioned_metagenomes):
+    """Return the rows from partition_metagenome_contributions as tab-delimited text"""
+    return "\n".join(["\t".join(map(str,i)) for i in partitioned_metagenomes])
+
+def write_contributions(gene_rows,output_fp):
+    """Write contributions to output_fp as they are generated
+
+    gene_rows -- lists of rows for each gene, as yielded by
+      iter_metagenome_contributions
+
+    The output is the same as format_contributions (with the header),
+    gzip-compressed if output_fp ends in '.gz'.  Returns the number of
+    rows written.
+    """
+    if output_fp.endswith('.gz'):
+        output_fh = gzip.open(output_fp,'wb')
+    else:
+        output_fh = open(output_fp,'w')
+    output_fh.write("\t".join(CONTRIBUTIONS_HEADER))
+    n_rows = 0
+    for rows in gene_rows:
+        if rows:
+            output_fh.write("\n" + format_contributions(rows))
+            n_rows += len(rows)
+    output_fh.close()
+    return n_rows
+
+CONTRIBUTIONS_COLUMN_DTYPES = [(column,dtype('int32')) for column in \
+  CONTRIBUTIONS_ID_COLUMNS] + [(column,dtype('float64')) for column in \
+  CONTRIBUTIONS_VALUE_COLUMNS]
+
+def write_columnar_contributions(otu_table,genome_table,output_fp,\
+    limit_to_functions=[],remove_zero_rows=True,top_k=None,min_fraction=None,\
+    processes=1,verbose=True):
+    """Write the contributions as columns of a numpy .npz archive
+
+    Rather than repeating ids and taxonomy on every row, the Gene, Sample
+    and OTU columns hold integer codes into the Gene_ids, Sample_ids and
+    OTU_ids arrays, and the taxonomy of each OTU is stored once in the
+    taxonomy array (one row per OTU, padded with empty strings).  The
+    other columns of CONTRIBUTIONS_HEADER are float arrays.  Rows are in
+    the order of partition_metagenome_contributions, and the last OTU id
+    is OTHER_CONTRIBUTIONS_ID, for contributions omitted by top_k or
+    min_fraction.
+
+    Each column is spooled to a temporary file as the contributions of
+    each gene are calculated, so memory use doesn't grow with the output.
+    If processes is greater than 1, the genes are divided between that
+    many worker processes (see write_contributions_in_parallel).  Returns
+    the number of rows written.  See load_columnar_contributions.
+    """
+    if processes > 1:
+        return write_contributions_in_parallel(otu_table,genome_table,\
+          output_fp,processes,limit_to_functions=limit_to_functions,\
+          remove_zero_rows=remove_zero_rows,top_k=top_k,\
+          min_fraction=min_fraction,columnar=True,verbose=verbose)
+
+    data = prepare_contribution_data(otu_table,genome_table,\
+      limit_to_functions,verbose=verbose)
+    tmp_dir = mkdtemp(prefix='picrust_contributions')
+    try:
+        shard_fp = join(tmp_dir,'contributions')
+        n_rows = _spool_contribution_columns(iter_contribution_arrays(\
+          data['otu_data'],data['genome_data'],remove_zero_rows=remove_zero_rows,\
+          top_k=top_k,min_fraction=min_fraction),shard_fp)
+        _write_columnar_archive(output_fp,data,[shard_fp],n_rows,tmp_dir)
+    finally:
+        rmtree(tmp_dir)
+    return n_rows
+
+def _spool_contribution_columns(contribution_arrays,shard_fp,gene_offset=0):
+    """Append each column of contribution_arrays to the file shard_fp.<column>
+
+    contribution_arrays -- as yielded by iter_contribution_arrays
+    gene_offset -- added to the gene index of each contribution
+
+    Returns the number of rows written.
+    """
+    column_fhs = dict([(column,open('%s.%s' %(shard_fp,column),'wb')) \
+      for column,column_dtype in CONTRIBUTIONS_COLUMN_DTYPES])
+    n_rows = 0
+    for j,sample_idxs,otu_idxs,values in contribution_arrays:
+        gene_idxs = zeros(len(otu_idxs),dtype=int) + j + gene_offset
+        for (column,column_dtype),data in zip(CONTRIBUTIONS_COLUMN_DTYPES,\
+          [gene_idxs,sample_idxs,otu_idxs] + values):
+            column_fhs[column].write(data.astype(column_dtype).tostring())
+        n_rows += len(otu_idxs)
+    for column_fh in column_fhs.values():
+        column_fh.close()
+    return n_rows
+
+def _write_columnar_archive(output_fp,data,shard_fps,n_rows,tmp_dir):
+    """Write the spooled columns of shard_fps, in order, and the ids of data to an .npz archive"""
+    taxonomy = data['taxonomy']
+    n_levels = max([0] + map(len,taxonomy))
+    taxonomy_array = array([otu_taxonomy + [u'']*(n_levels-len(otu_taxonomy)) \
+      for otu_taxonomy in taxonomy],dtype=unicode).reshape(len(taxonomy),n_levels)
+    lookups = {'Gene_ids':array(data['gene_ids'],dtype=unicode),\
+      'Sample_ids':array(data['sample_ids'],dtype=unicode),\
+      'OTU_ids':array(data['otu_ids'],dtype=unicode),\
+      'taxonomy':taxonomy_array}
+
+    archive = ZipFile(output_fp,'w',ZIP_DEFLATED,allowZip64=True)
+    for column,column_dtype in CONTRIBUTIONS_COLUMN_DTYPES:
+        #prepend the .npy header, now that the length is known
+        npy_fp = join(tmp_dir,column + '.npy')
+        npy_fh = open(npy_fp,'wb')
+        npy_fh.write(npy_format.magic(1,0))
+        npy_format.write_array_header_1_0(npy_fh,{'shape':(n_rows,),\
+          'fortran_order':False,'descr':npy_format.dtype_to_descr(column_dtype)})
+        for shard_fp in shard_fps:
+            column_fp = '%s.%s' %(shard_fp,column)
+            copyfileobj(open(column_fp,'rb'),npy_fh)
+            remove(column_fp)
+        npy_fh.close()
+        archive.write(npy_fp,column + '.npy')
+        remove(npy_fp)
+    for name,lookup in lookups.items():
+        npy_fh = StringIO()
+        npy_format.write_array(npy_fh,lookup)
+        archive.writestr(name + '.npy',npy_fh.getvalue())
+    archive.close()
+
+#The contribution data of write_contributions_in_parallel, which worker
+#processes inherit (read-only) when they are forked
+_shared_contribution_data = {}
+
+def _write_contributions_shard(args):
+    """Write the contributions to a range of genes to shard files (run in a worker process)"""
+    gene_start,gene_end,shard_fp,columnar,options = args
+    data = _shared_contribution_data
+    contribution_arrays = iter_contribution_arrays(data['otu_data'],\
+      data['genome_data'][:,gene_start:gene_end],**options)
+    if columnar:
+        return _spool_contribution_columns(contribution_arrays,shard_fp,\
+          gene_offset=gene_start)
+
+    sample_ids = array(data['sample_ids'],dtype=object)
+    otu_ids = array(data['otu_ids'],dtype=object)
+    shard_fh = open(shard_fp,'w')
+    n_rows = 0
+    for j,sample_idxs,otu_idxs,values in contribution_arrays:
+        if len(otu_idxs):
+            shard_fh.write("\n" + format_contributions(\
+              format_gene_contribution_rows(data['gene_ids'][gene_start+j],\
+              sample_idxs,otu_idxs,values,sample_ids,otu_ids,data['taxonomy'])))
+            n_rows += len(otu_idxs)
+    shard_fh.close()
+    return n_rows
+
+def write_contributions_in_parallel(otu_table,genome_table,output_fp,\
+    processes=2,limit_to_functions=[],remove_zero_rows=True,top_k=None,\
+    min_fraction=None,columnar=False,verbose=True):
+    """Write contributions with the genes divided between worker processes
+
+    The contributions to each gene are independent, so the genes are split
+    into contiguous ranges that worker processes write to temporary shard
+    files.  The workers are forked after the OTU and genome data are
+    aligned, so they share it rather than each loading their own copy.
+    Shards are merged in gene order as they finish, so the output is
+    identical to write_contributions (or, if columnar is True,
+    write_columnar_contributions).  Returns the number of rows written.
+    """
+    data = prepare_contribution_data(otu_table,genome_table,\
+      limit_to_functions,verbose=verbose)
+    options = {'remove_zero_rows':remove_zero_rows,'top_k':top_k,\
+      'min_fraction':min_fraction}
+    #several ranges per process, so that uneven genes balance out
+    n_genes = len(data['gene_ids'])
+    n_shards = max(1,min(n_genes,processes*4))
+    bounds = [n_genes*i//n_shards for i in range(n_shards+1)]
+
+    tmp_dir = mkdtemp(prefix='picrust_contributions')
+    _shared_contribution_data.update(data)
+    try:
+        shard_fps = [join(tmp_dir,'shard_%05d' % i) for i in range(n_shards)]
+        jobs = [(start,end,shard_fp,columnar,options) for start,end,shard_fp \
+          in zip(bounds[:-1],bounds[1:],shard_fps)]
+        pool = Pool(processes)
+        try:
+            shard_rows = pool.imap(_write_contributions_shard,jobs)
+            if columnar:
+                n_rows = sum(shard_rows)
+                _write_columnar_archive(output_fp,data,shard_fps,n_rows,tmp_dir)
+                return n_rows
+
+            if output_fp.endswith('.gz'):
+                output_fh = gzip.open(output_fp,'wb')
+            else:
+                output_fh = open(output_fp,'w')
+            output_fh.write("\t".join(CONTRIBUTIONS_HEADER))
+            n_rows = 0
+            for shard_fp,n_shard_rows in izip(shard_fps,shard_rows):
+                if verbose:
+                    print "Merging contributions from %s" % shard_fp
+                copyfileobj(open(shard_fp),output_fh)
+                remove(shard_fp)
+                n_rows += n_shard_rows
+            output_fh.close()
+            return n_rows
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        _shared_contribution_data.clear()
+        rmtree(tmp_dir)
+
+def load_columnar_contributions(input_fp,columns=None,genes=None,\
+    samples=None,otus=None):
+    """Load selected columns and rows of contributions from a .npz archive
+
+    input_fp -- an archive written by write_columnar_contributions
+    columns -- the names of the columns to load, from CONTRIBUTIONS_HEADER
+      (all of them if None)
+    genes, samples, otus -- if provided, only rows for these gene, sample
+      or OTU ids are loaded
+
+    Returns a dict of column name to array.  Only the requested columns
+    (and the id columns used for filtering) are read from the archive.
+    The Gene, Sample and OTU columns are decoded to ids, and the taxonomy
+    columns are looked up from the OTU of each row.
+    """
+    if columns is None:
+        columns = CONTRIBUTIONS_HEADER
+    unknown_columns = set(columns) - set(CONTRIBUTIONS_HEADER)
+    if unknown_columns:
+        raise ValueError("Unknown contribution columns: %s" \
+          % ', '.join(sorted(unknown_columns)))
+
+    data = load(input_fp)
+    codes = {}
+    def get_codes(column):
+        if column not in codes:
+            codes[column] = data[column]
+        return codes[column]
+
+    keep = None
+    for column,ids in zip(CONTRIBUTIONS_ID_COLUMNS,[genes,samples,otus]):
+        if ids is None:
+            continue
+        id_codes = in1d(data[column + '_ids'],map(unicode,ids)).nonzero()[0]
+        keep_column = in1d(get_codes(column),id_codes)
+        keep = keep_column if keep is None else keep & keep_column
+    select = lambda values: values if keep is None else values[keep]
+
+    result = {}
+    for column in columns:
+        if column in CONTRIBUTIONS_ID_COLUMNS:
+            result[column] = data[column + '_ids'][select(get_codes(column))]
+        elif column in CONTRIBUTIONS_VALUE_COLUMNS:
+            result[column] = select(data[column])
+        else:
+            taxonomy = data['taxonomy']
+            level = CONTRIBUTIONS_TAXONOMY_COLUMNS.index(column)
+            otu_codes = select(get_codes('OTU'))
+            if level < taxonomy.shape[1]:
+                result[column] = taxonomy[otu_codes,level]
+            else:
+                result[column] = zeros(len(otu_codes),dtype=taxonomy.dtype)
+    return result
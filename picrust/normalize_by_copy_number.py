@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# File created on 18 Oct 2026
+from __future__ import division
+
+__author__ = "Greg Caporaso"
+__copyright__ = "Copyright 2011-2013, The PICRUSt Project"
+__credits__ = ["Greg Caporaso","Morgan Langille"]
+__license__ = "GPL"
+__version__ = "1.0.0-dev"
+__maintainer__ = "Greg Caporaso"
+__email__ = "gregcaporaso@gmail.com"
+__status__ = "Development"
+
+from os.path import splitext
+from numpy import array, zeros, isfinite, floor, newaxis
+from biom.table import table_factory, DenseGeneTable
+from picrust.predict_metagenomes import IdAlignment, MARKER_COPY_NUMBER_METADATA,\
+  MISSING_MARKER_COPY_NUMBER
+from picrust.util import get_table_data_array, get_sparse_coordinates,\
+  sparse_matrix_from_coordinates, select_coordinates, parse_precalc_header,\
+  parse_precalc_block, iter_line_blocks
+import gzip
+import StringIO
+
+def round_copy_numbers(copy_numbers,otu_ids):
+    """Return an array of copy_numbers rounded to whole numbers
+
+    otu_ids -- the ids of the OTUs, used in error messages
+
+    Raises ValueError if any copy number isn't a finite number, or rounds
+    to less than 1.
+    """
+    invalid = ~isfinite(copy_numbers)
+    if invalid.any():
+        raise ValueError,\
+          "Invalid type passed as copy number for OTU ID %s. Must be int-able." \
+          % (otu_ids[invalid.argmax()])
+    #data can be floats so round them (halves away from zero, as round
+    #does for the copy numbers that are valid) to integers
+    copy_numbers = floor(copy_numbers + 0.5)
+    if (copy_numbers < 1).any():
+        raise ValueError, "Copy numbers must be greater than or equal to 1."
+    return copy_numbers
+
+def get_copy_numbers(count_table,otu_ids,count_idxs):
+    """Return the marker gene copy numbers of otu_ids as an array of rounded values
+
+    count_table -- BIOM Table of copy numbers, with OTUs as SampleIds and
+      the marker gene as the (first) observation
+    otu_ids -- the ids of the OTUs, used in error messages
+    count_idxs -- the index of each OTU in count_table.SampleIds
+
+    See round_copy_numbers.
+    """
+    copy_numbers = get_table_data_array(count_table,observation_idxs=[0],\
+      sample_idxs=count_idxs)[0]
+    return round_copy_numbers(copy_numbers,otu_ids)
+
+def normalize_by_copy_number(otu_table,count_table,\
+    metadata_identifier='CopyNumber'):
+    """Return a new OTU table with abundances divided by marker gene copy number
+
+    otu_table -- the BIOM Table object for the OTU table
+    count_table -- BIOM Table of copy numbers, with OTUs as SampleIds and
+      the marker gene as the (first) observation
+    metadata_identifier -- the observation metadata key under which copy
+      numbers are stored in the result
+
+    OTUs without a copy number in count_table are dropped.  The result is
+    the same type of table as otu_table: sparse tables are divided through
+    their nonzero values, without ever being made dense.  The OTU table's
+    sample and observation metadata are carried over.
+    """
+    #Need to only keep data relevant to our otu list
+    alignment = IdAlignment(otu_table.ObservationIds,count_table.SampleIds)
+    filtered_otus = alignment.ids
+    otu_idxs,count_idxs = alignment.indices
+    copy_numbers = get_copy_numbers(count_table,filtered_otus,count_idxs)
+
+    if otu_table._biom_matrix_type == 'sparse':
+        rows,cols,values = get_sparse_coordinates(otu_table._data)
+        #selecting the coordinates copies them, so the OTU table is unchanged
+        rows,cols,values = select_coordinates(rows,len(otu_table.ObservationIds),\
+          otu_idxs,cols,values)
+        values /= copy_numbers.take(rows)
+        data = sparse_matrix_from_coordinates(rows,cols,values,\
+          (len(filtered_otus),len(otu_table.SampleIds)))
+    else:
+        data = get_table_data_array(otu_table,observation_idxs=otu_idxs)
+        data /= copy_numbers[:,newaxis]
+
+    otu_metadata = otu_table.ObservationMetadata
+    observation_metadata = []
+    for otu_idx,copy_number in zip(otu_idxs,copy_numbers.astype(int).tolist()):
+        metadata = {metadata_identifier:copy_number}
+        if otu_metadata is not None and otu_metadata[otu_idx] is not None:
+            metadata.update(otu_metadata[otu_idx])
+        observation_metadata.append(metadata)
+
+    return table_factory(data,otu_table.SampleIds,filtered_otus,\
+      otu_table.SampleMetadata,observation_metadata,\
+      constructor=otu_table.__class__)
+
+def normalize_by_marker_copy_number(otu_table,genome_table,\
+    metadata_identifier='CopyNumber'):
+    """Return otu_table normalized by the copy numbers stored in a prenormalized genome_table
+
+    genome_table -- BIOM Table of gene counts already divided by marker
+      gene copy number, with OTUs as SampleIds and their copy numbers in
+      the MarkerCopyNumber sample metadata (see write_prenormalized_precalc)
+
+    The result is the table normalize_by_copy_number returns for the copy
+    number table that genome_table was derived from: OTUs without a copy
+    number are dropped.
+    """
+    otu_ids = []
+    copy_numbers = []
+    for otu_id,md in zip(genome_table.SampleIds,genome_table.SampleMetadata):
+        if md[MARKER_COPY_NUMBER_METADATA] != MISSING_MARKER_COPY_NUMBER:
+            otu_ids.append(otu_id)
+            copy_numbers.append(float(md[MARKER_COPY_NUMBER_METADATA]))
+    count_table = table_factory(array([copy_numbers]),otu_ids,\
+      [MARKER_COPY_NUMBER_METADATA],constructor=DenseGeneTable)
+    return normalize_by_copy_number(otu_table,count_table,metadata_identifier)
+
+def write_prenormalized_precalc(data_table_fp,count_table,output_fp,\
+    md_prefix='metadata_',block_size=2**22,verbose=False):
+    """Write a tab-delimited precalculated table divided by marker gene copy number
+
+    data_table_fp -- tab-delimited table of predicted gene counts per OTU
+    count_table -- BIOM Table of copy numbers, with OTUs as SampleIds and
+      the marker gene as the (first) observation
+    output_fp -- the derived table.  Input and output files are gzipped if
+      their names end in .gz
+
+    Each OTU's gene counts are divided by its copy number (rounded as by
+    normalize_by_copy_number), and the copy number is added as its
+    MarkerCopyNumber metadata.  Predicting metagenomes from raw OTU counts
+    with the derived table (see run_metagenome_prediction) gives the
+    prediction from the copy number normalized OTU table and the original
+    table.  normalize_by_copy_number drops OTUs without a copy number, so
+    they are kept with zero gene counts (and a MarkerCopyNumber of NA):
+    they then add nothing to predictions from raw OTU counts, rather than
+    failing them as unknown OTUs.  The table is converted a block of lines
+    at a time.  Returns the number of OTUs written.
+    """
+    copy_number_idxs = dict((otu_id,i) for i,otu_id in \
+      enumerate(count_table.SampleIds))
+    copy_numbers = get_table_data_array(count_table,observation_idxs=[0])[0]
+
+    if splitext(data_table_fp)[1] == '.gz':
+        data_table_fh = gzip.open(data_table_fp,'rb')
+    else:
+        data_table_fh = open(data_table_fp,'U')
+    if splitext(output_fp)[1] == '.gz':
+        output_fh = gzip.open(output_fp,'wb')
+    else:
+        output_fh = open(output_fp,'w')
+
+    header = data_table_fh.readline().rstrip('\n')
+    trait_ids,col_meta_locs,end_of_data = parse_precalc_header(\
+      StringIO.StringIO(header),md_prefix)
+    if MARKER_COPY_NUMBER_METADATA in col_meta_locs:
+        raise ValueError("%s has already been divided by marker gene copy number." % data_table_fp)
+    col_meta_names = sorted(col_meta_locs,key=col_meta_locs.get)
+    output_fh.write('\t'.join([header,md_prefix+MARKER_COPY_NUMBER_METADATA]) + '\n')
+
+    n_written = 0
+    block_args = (len(trait_ids),col_meta_locs,end_of_data,None,md_prefix,None)
+    for block in iter_line_blocks(data_table_fh,block_size):
+        otu_ids,data,col_meta,metadata_lines = parse_precalc_block(\
+          (block,)+block_args)
+        for line in metadata_lines:
+            output_fh.write(line + '\n')
+        kept = array([i for i,otu_id in enumerate(otu_ids) \
+          if otu_id in copy_number_idxs],dtype=int)
+        kept_ids = [otu_ids[i] for i in kept]
+        block_copy_numbers = round_copy_numbers(copy_numbers.take(\
+          [copy_number_idxs[otu_id] for otu_id in kept_ids]),kept_ids)
+        #OTUs without a copy number keep zero counts
+        divided = zeros(data.shape)
+        if len(kept):
+            divided[kept] = data.take(kept,axis=0) / \
+              block_copy_numbers[:,newaxis]
+        otu_copy_numbers = [MISSING_MARKER_COPY_NUMBER]*len(otu_ids)
+        for i,copy_number in zip(kept.tolist(),\
+          block_copy_numbers.astype(int).tolist()):
+            otu_copy_numbers[i] = str(copy_number)
+        for i,(otu_id,values) in enumerate(zip(otu_ids,divided.tolist())):
+            #the repr of a list of floats holds the shortest string that
+            #parses back to each value, so no precision is lost
+            fields = [otu_id,repr(values)[1:-1].replace(', ','\t')]
+            fields.extend(col_meta[i][name] for name in col_meta_names)
+            fields.append(otu_copy_numbers[i])
+            output_fh.write('\t'.join(fields) + '\n')
+        n_written += len(otu_ids)
+        if verbose:
+            print "Divided the gene counts of %i OTUs by copy number" % n_written
+
+    data_table_fh.close()
+    output_fh.close()
+    return n_written
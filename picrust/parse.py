@@ -11,8 +11,12 @@ __maintainer__ = "Greg Caporaso"
 __email__ = "gregcaporaso@gmail.com"
 __status__ = "Development"
 
+import re
+import gzip
+from json import JSONDecoder, loads
+from numpy import asarray, arange, zeros, ones
+from biom.parse import BIOM_TYPES
 
- 
 def parse_marker_gene_copy_numbers(counts_f,
                                    metadata_identifier):
     result = {}
@@ -156,3 +160,293 @@ def parse_asr_confidence_output(table_lines,param_names=['loglik','sigma'],forma
     return min_value_dict,max_value_dict,params,column_mapping 
         
 
+
+class _JsonStream(object):
+    """Incrementally scan a JSON document read block by block from a file
+
+    Only the part of the document between the current position and the end
+    of the last block read is held in memory.  offset is the position of
+    the start of the buffer within the whole document.
+    """
+
+    def __init__(self,fh,block_size=2**20):
+        self.fh = fh
+        self.block_size = block_size
+        self.buffer = ''
+        self.pos = 0
+        self.offset = 0
+        self.at_eof = False
+        self._decoder = JSONDecoder()
+
+    def position(self):
+        """Return the position of the scanner within the whole document"""
+        return self.offset + self.pos
+
+    def fill(self):
+        """Read another block, returning False at the end of the file"""
+        if self.at_eof:
+            return False
+        block = self.fh.read(self.block_size)
+        if not block:
+            self.at_eof = True
+            return False
+        self.offset += self.pos
+        self.buffer = self.buffer[self.pos:] + block
+        self.pos = 0
+        return True
+
+    def next_char(self):
+        """Skip whitespace, returning the next character without consuming it"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\n\r':
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                raise ValueError("Unexpected end of BIOM file")
+
+    def expect(self,chars):
+        """Consume and return the next character, which must be one of chars"""
+        c = self.next_char()
+        if c not in chars:
+            raise ValueError("Expected one of '%s' at position %d of BIOM file, found '%s'"\
+              % (chars,self.position(),c))
+        self.pos += 1
+        return c
+
+    def read_value(self):
+        """Decode and consume the next JSON value"""
+        self.next_char()
+        while True:
+            try:
+                value,end = self._decoder.raw_decode(self.buffer,self.pos)
+                #A value that ends with the buffer (e.g. a number) may
+                #continue in the next block
+                if end < len(self.buffer) or self.at_eof:
+                    self.pos = end
+                    return value
+            except ValueError:
+                if self.at_eof:
+                    raise
+            self.fill()
+
+    def iter_array(self):
+        """Decode and yield the elements of the next JSON array one at a time"""
+        self.expect('[')
+        if self.next_char() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.read_value()
+            if self.expect(',]') == ']':
+                return
+
+    def iter_array_blocks(self,decode=True):
+        """Yield the elements of the next JSON array of arrays in blocks
+
+        Each block is a list of decoded elements.  The elements must be flat
+        arrays of numbers (like the rows of BIOM data), so that every ']'
+        inside the array closes an element, and ']]' only occurs at the end
+        of the array.  Decoding a block of elements at a time is much faster
+        than decoding them one by one.  If decode is False the array is
+        consumed without being decoded, and nothing is yielded.
+        """
+        self.expect('[')
+        if self.next_char() == ']':
+            self.pos += 1
+            return
+        while True:
+            end = _ARRAY_OF_ARRAYS_END.search(self.buffer,self.pos)
+            if end:
+                if decode:
+                    yield self._decode_elements(end.start()+1)
+                self.pos = end.end()
+                return
+            #cut after the last element known to be complete (one whose
+            #']' is followed by a ',')
+            cut = self.buffer.rfind(']',self.pos)
+            if cut >= 0 and not self.buffer[cut+1:].strip(' \t\n\r'):
+                cut = self.buffer.rfind(']',self.pos,cut)
+            if cut >= 0:
+                if decode:
+                    yield self._decode_elements(cut+1)
+                self.pos = cut + 1
+            if not self.fill():
+                raise ValueError("Unexpected end of BIOM file")
+
+    def _decode_elements(self,end):
+        return loads('[%s]' % self.buffer[self.pos:end].lstrip(' \t\n\r,'))
+
+
+_ARRAY_OF_ARRAYS_END = re.compile(r'\]\s*\]')
+
+
+def _open_biom_file(biom_fp):
+    if biom_fp.endswith('.gz'):
+        return gzip.open(biom_fp,'rb')
+    return open(biom_fp,'U')
+
+def parse_biom_subset(biom_fp,ids_to_load,axis="samples",block_size=2**20,\
+    other_ids_to_load=None):
+    """Load a subset of the samples or observations of a BIOM file as a Table
+
+    biom_fp -- path to a BIOM format file (gzipped if it ends in '.gz')
+    ids_to_load -- the sample or observation ids to keep
+    axis -- 'samples' or 'observations'
+    other_ids_to_load -- if provided, also keep only these ids along the
+      other axis (e.g. a few functions of a precalculated genome table)
+
+    The file is read incrementally, keeping only the data and metadata for
+    ids_to_load, so memory use depends on the size of the subset rather
+    than the size of the file.  The subset's data is kept as the file is
+    read if the metadata for both axes comes before the data.  Otherwise (as
+    in files written by biom-format, which puts the data first) the data is
+    skipped, and read in a second streaming pass once the positions of
+    ids_to_load are known.
+
+    Raises KeyError if any of ids_to_load (or other_ids_to_load) are not
+    in the file.
+    """
+    if axis == 'samples':
+        axis_key,other_axis_key = 'columns','rows'
+    elif axis == 'observations':
+        axis_key,other_axis_key = 'rows','columns'
+    else:
+        raise ValueError("Unknown axis: %s" % axis)
+
+    to_keep = {axis_key:set(map(str,[i.strip() for i in ids_to_load])),\
+      other_axis_key:None}
+    if other_ids_to_load is not None:
+        to_keep[other_axis_key] = set(map(str,[i.strip() for i in other_ids_to_load]))
+    json_table = {}
+    #the position of each row/column in the subset (-1 if it isn't kept),
+    #or None if all are kept
+    new_positions = {}
+    data_offset = None
+
+    biom_fh = _open_biom_file(biom_fp)
+    stream = _JsonStream(biom_fh,block_size)
+    stream.expect('{')
+    while stream.next_char() != '}':
+        key = stream.read_value()
+        stream.expect(':')
+        if key in to_keep and to_keep[key] is not None:
+            kept_entries = []
+            kept_idxs = []
+            n_entries = 0
+            for i,entry in enumerate(stream.iter_array()):
+                n_entries += 1
+                if entry['id'] in to_keep[key]:
+                    kept_entries.append(entry)
+                    kept_idxs.append(i)
+            if len(kept_entries) != len(to_keep[key]):
+                raise KeyError("Not all of the to_keep ids are in %s!" % biom_fp)
+            json_table[key] = kept_entries
+            new_positions[key] = zeros(n_entries,dtype=int) - 1
+            new_positions[key][kept_idxs] = arange(len(kept_idxs))
+        elif key in to_keep:
+            json_table[key] = stream.read_value()
+            new_positions[key] = None
+        elif key == 'data':
+            if len(new_positions) < 2 or 'matrix_type' not in json_table:
+                data_offset = stream.position()
+                for block in stream.iter_array_blocks(decode=False):
+                    pass
+            else:
+                json_table['data'] = _subset_data_blocks(\
+                  stream.iter_array_blocks(),json_table['matrix_type'],\
+                  new_positions['rows'],new_positions['columns'])
+        else:
+            json_table[key] = stream.read_value()
+        if stream.expect(',}') == '}':
+            break
+    biom_fh.close()
+
+    if len(new_positions) < 2:
+        raise ValueError("%s does not appear to be in BIOM format!" % biom_fp)
+
+    if data_offset is not None:
+        #second pass, over the data only
+        biom_fh = _open_biom_file(biom_fp)
+        biom_fh.seek(data_offset)
+        stream = _JsonStream(biom_fh,block_size)
+        json_table['data'] = _subset_data_blocks(stream.iter_array_blocks(),\
+          json_table['matrix_type'],new_positions['rows'],\
+          new_positions['columns'])
+        biom_fh.close()
+
+    json_table['shape'] = [len(json_table['rows']),len(json_table['columns'])]
+    parse_f = BIOM_TYPES.get(json_table['type'].lower(),None)
+    if parse_f is None:
+        raise ValueError("Unknown BIOM table type: %s" % json_table['type'])
+    return parse_f(json_table)
+
+def parse_biom_axis_metadata(biom_fp,axis="observations",block_size=2**20):
+    """Return the ids and metadata along axis of a BIOM file, without its data
+
+    Returns a list of (id, metadata) tuples, in file order.  The data is
+    streamed past without being decoded.
+    """
+    if axis == 'samples':
+        axis_key = 'columns'
+    elif axis == 'observations':
+        axis_key = 'rows'
+    else:
+        raise ValueError("Unknown axis: %s" % axis)
+
+    result = None
+    biom_fh = _open_biom_file(biom_fp)
+    stream = _JsonStream(biom_fh,block_size)
+    stream.expect('{')
+    while stream.next_char() != '}':
+        key = stream.read_value()
+        stream.expect(':')
+        if key == axis_key:
+            result = [(entry['id'],entry['metadata']) for entry in stream.iter_array()]
+        elif key == 'data':
+            for block in stream.iter_array_blocks(decode=False):
+                pass
+        else:
+            stream.read_value()
+        if result is not None or stream.expect(',}') == '}':
+            break
+    biom_fh.close()
+
+    if result is None:
+        raise ValueError("%s does not appear to be in BIOM format!" % biom_fp)
+    return result
+
+def _subset_data_blocks(data_blocks,matrix_type,row_positions,col_positions):
+    """Return the BIOM data in data_blocks for the kept rows and columns
+
+    row_positions, col_positions -- the position of each row/column in the
+      subset, or -1 if it isn't kept.  None keeps all rows/columns.
+    """
+    data = []
+    if matrix_type == 'sparse':
+        for block in data_blocks:
+            entries = asarray(block,dtype=float)
+            if not len(entries):
+                continue
+            coords = entries[:,:2].astype(int)
+            keep = ones(len(entries),dtype=bool)
+            for axis_idx,positions in enumerate([row_positions,col_positions]):
+                if positions is not None:
+                    coords[:,axis_idx] = positions[coords[:,axis_idx]]
+                    keep &= coords[:,axis_idx] >= 0
+            data.extend([r,c,v] for (r,c),v in \
+              zip(coords[keep].tolist(),entries[keep][:,2].tolist()))
+    else:
+        if col_positions is not None:
+            kept_col_idxs = (col_positions >= 0).nonzero()[0]
+        row_idx = 0
+        for block in data_blocks:
+            if row_positions is not None:
+                kept = [row for i,row in enumerate(block,row_idx)\
+                  if row_positions[i] >= 0]
+                row_idx += len(block)
+                block = kept
+            if col_positions is not None and block:
+                block = asarray(block).take(kept_col_idxs,axis=1).tolist()
+            data.extend(block)
+    return data
@@ -11,62 +11,420 @@ __maintainer__ = "Greg Caporaso"
 __email__ = "gregcaporaso@gmail.com"
 __status__ = "Development"
 
-from numpy import abs,compress, dot, array, around, asarray,empty,zeros, sum as numpy_sum,sqrt,apply_along_axis
+from numpy import abs,compress, dot, array, around, asarray,empty,zeros, sum as numpy_sum,sqrt,apply_along_axis,\
+  lexsort, ones, add, arange, multiply, broadcast, isscalar
+from numpy.random import RandomState
 from biom.table import table_factory,SparseGeneTable, DenseGeneTable
 from biom.parse import parse_biom_table, get_axis_indices, direct_slice_data, direct_parse_key
+from picrust.parse import parse_biom_subset, parse_biom_axis_metadata
 from picrust.predict_traits import variance_of_weighted_mean,calc_confidence_interval_95
+from picrust.util import convert_precalc_to_biom, convert_precalc_to_biom_in_parallel,\
+  PrecalcBlockReader, parse_precalc_trait_metadata, scale_metagenomes,\
+  make_output_dir_for_file, format_biom_table, get_table_data_array,\
+  get_sparse_coordinates
+from os import path
+from os.path import join, split, splitext
+from glob import glob
+import gzip
+import re
+from json import loads
 
-def get_overlapping_ids(otu_table,genome_table,genome_table_ids="SampleIds",\
+class IdAlignment(object):
+    """Positions of the ids shared by several id sequences
+
+    Built once (e.g. from the OTU ids of an OTU table and of a genome
+    table), an alignment provides gather indices that pull the data for
+    the shared ids out of each table in the same order, without filtering,
+    sorting or otherwise copying the tables.
+
+    ids -- the shared ids, in the order of the first id sequence
+    indices -- one integer array per id sequence, holding the position of
+      each shared id in that sequence
+    """
+
+    def __init__(self,*id_sequences):
+        self.id_sequences = id_sequences
+        positions = [dict((id_,i) for i,id_ in enumerate(ids)) \
+          for ids in id_sequences]
+        self.ids = [id_ for id_ in id_sequences[0] \
+          if all(id_ in p for p in positions[1:])]
+        self.indices = [array([p[id_] for id_ in self.ids],dtype=int) \
+          for p in positions]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def is_complete(self):
+        """Return True if every id sequence contains only the shared ids"""
+        return all(len(ids) == len(self.ids) for ids in self.id_sequences)
+
+    def unshared_ids(self,sequence_idx):
+        """Return the ids of one id sequence that are not in all the others"""
+        shared_ids = set(self.ids)
+        return [id_ for id_ in self.id_sequences[sequence_idx] \
+          if id_ not in shared_ids]
+
+
+def align_otu_ids(otu_table,genome_tables,genome_table_ids="SampleIds",\
   otu_table_ids="ObservationIds"):
-    """Get the ids that overlap between the OTU and genome tables
+    """Return an IdAlignment of the OTUs shared by the OTU and genome tables
     otu_table - a BIOM Table object representing the OTU table
-    genome_table - a BIOM Table object for the genomes
+    genome_tables - a list of BIOM Table objects for the genomes (e.g. a
+      genome table and its variance table)
     genome_table_ids - specifies whether the ids of interest are SampleIds or ObservationIds
-      in the genome table.  Useful because metagenome tables are often represented with genes
-      as observations.
+      in the genome tables.
+
+    The OTU table is the first id sequence of the alignment, so shared OTUs
+    are in OTU table order.
     """
     for id_type in [genome_table_ids,otu_table_ids]:
         if id_type not in ["SampleIds","ObservationIds"]:
             raise ValueError(\
               "%s is not a valid id type. Choices are 'SampleIds' or 'ObservationIds'"%id_type)
-    overlapping_otus = list(set(getattr(otu_table,otu_table_ids)) & 
-                            set(getattr(genome_table,genome_table_ids)))
-    
-    if len(overlapping_otus) < 1:
+    alignment = IdAlignment(getattr(otu_table,otu_table_ids),\
+      *[getattr(genome_table,genome_table_ids) for genome_table in genome_tables])
+
+    if len(alignment) < 1:
         print "OTU Ids:",getattr(otu_table,otu_table_ids)
-        print "Genome Ids:",getattr(genome_table,genome_table_ids)
+        for genome_table in genome_tables:
+            print "Genome Ids:",getattr(genome_table,genome_table_ids)
         raise ValueError,\
          "No common OTUs between the otu table and the genome table, so can't predict metagenome."
-    return overlapping_otus
+    return alignment
+
+def get_overlapping_ids(otu_table,genome_table,genome_table_ids="SampleIds",\
+  otu_table_ids="ObservationIds"):
+    """Get the ids that overlap between the OTU and genome tables
+    otu_table - a BIOM Table object representing the OTU table
+    genome_table - a BIOM Table object for the genomes
+    genome_table_ids - specifies whether the ids of interest are SampleIds or ObservationIds
+      in the genome table.  Useful because metagenome tables are often represented with genes
+      as observations.
+
+    Ids are returned in OTU table order.
+    """
+    return align_otu_ids(otu_table,[genome_table],\
+      genome_table_ids=genome_table_ids,otu_table_ids=otu_table_ids).ids
+
+def get_aligned_data(table,idxs,ids="ObservationIds"):
+    """Return a 2d array with the data for table's ids at idxs as its rows
+
+    ids -- whether idxs index the ObservationIds or SampleIds of table
+    """
+    if ids == "ObservationIds":
+        return get_table_data_array(table,observation_idxs=idxs)
+    else:
+        return get_table_data_array(table,sample_idxs=idxs).T
+
+def group_identical_rows(*arrays):
+    """Group the rows that are identical in all of arrays
+
+    Closely related OTUs often inherit identical predicted genomes, so
+    collapsing them shrinks the metagenome products.  Rows are sorted by a
+    checksum (a weighted sum of each row), and only adjacent rows with
+    equal checksums are compared to find the groups.  Returns order,group_starts
+    where order lists the rows group by group and group_starts are the
+    positions in order at which each group starts (as for add.reduceat).
+    """
+    n_rows = len(arrays[0])
+    weights = RandomState(0)
+    checksums = [dot(a,weights.random_sample(a.shape[1])) for a in arrays]
+    order = lexsort(checksums)
+    same_checksum = ones(n_rows-1,dtype=bool)
+    for checksum in checksums:
+        same_checksum &= checksum[order[1:]] == checksum[order[:-1]]
+    same_as_previous = zeros(n_rows,dtype=bool)
+    for i in same_checksum.nonzero()[0]:
+        #confirm that the rows really are identical
+        row,previous_row = order[i+1],order[i]
+        for a in arrays:
+            if a[row].tostring() != a[previous_row].tostring():
+                break
+        else:
+            same_as_previous[i+1] = True
+    if not same_as_previous.any():
+        #all rows are distinct, so leave them in their original order
+        return arange(n_rows),arange(n_rows)
+    group_starts = (~same_as_previous).nonzero()[0]
+    return order,group_starts
+
+def sum_rows_by_group(data,order,group_starts):
+    """Return the sums of the rows of data in each group, one row per group
+
+    order,group_starts -- as returned by group_identical_rows
+    """
+    if len(group_starts) == len(order):
+        #all rows are distinct, and in their original order
+        return data
+    return add.reduceat(data[order],group_starts,axis=0)
 
-             
 def extract_otu_and_genome_data(otu_table,genome_table,genome_table_ids="SampleIds",\
   otu_table_ids="ObservationIds"):
-    """Return lists of otu,genome data, and overlapping genome/otu ids
+    """Return arrays of otu,genome data, and overlapping genome/otu ids
     
     otu_table -- biom Table object for the OTUs
     genome_table -- biom Table object for the genomes
+
+    Row i of the otu and genome data is the data for the i-th overlapping id.
     """
-    overlapping_otus = get_overlapping_ids(otu_table,genome_table,\
+    alignment = align_otu_ids(otu_table,[genome_table],\
       genome_table_ids=genome_table_ids,otu_table_ids=otu_table_ids)
-    # create lists to contain filtered data - we're going to need the data in 
-    # numpy arrays, so it makes sense to compute this way rather than filtering
-    # the tables
-    otu_data = []
-    genome_data = []
+    otu_idxs,genome_idxs = alignment.indices
+    otu_data = get_aligned_data(otu_table,otu_idxs,otu_table_ids)
+    genome_data = get_aligned_data(genome_table,genome_idxs,genome_table_ids)
+    return otu_data,genome_data,alignment.ids
+
+
+def determine_data_table_fp(precalc_data_dir,type_of_prediction,gg_version,\
+      user_specified_table=None,precalc_file_suffix='precalculated.tab.gz',verbose=False):
+    """Determine data table to load, allowing custom user tables or a choice of precalculated files
+   
+    precalc_data_dir -- the directory where precalculated tables of gene counts and variances are stored
+    type_of_prediction -- a string describing the type of precalculated prediction file.  
+    gg_version -- the version of greengenes the precalculated prediction was generated against
+    
+    This function assumes that precalculated files are named based on the type of prediction,
+    (KO, COG, PFAM, etc) and the greengenes version, and then end with a set suffix, which might 
+    vary between count tables and variance tables.
+    """
+    
+    if(user_specified_table is None):
+        #We assume the precalc file has a specific name (e.g. ko_13_5_precalculated.tab.gz)
+        precalc_file_name='_'.join([type_of_prediction,gg_version,\
+          precalc_file_suffix])
+        
+        input_count_table=join(precalc_data_dir,precalc_file_name)
+    else:
+        input_count_table=user_specified_table
+
+    if verbose:
+        print "Selected data table for loading: ", input_count_table
+    return input_count_table
+
+def load_data_table(data_table_fp,\
+  load_data_table_in_biom=False,suppress_subset_loading=False,ids_to_load=None,\
+  transpose=False,processes=1,functions_to_load=None,verbose=False):
+    """Load a data table, detecting gziiped files and subset loading
+    data_table_fp -- path to the input data table
     
-    # build lists of filtered data
-    for obs_id in overlapping_otus:
-        if otu_data == "SampleIds":
-           otu_data.append(otu_table.sampleData(obs_id))
+    load_data_table_in_biom -- if True, load the data table as a BIOM table rather
+    than as tab-delimited
+
+    suppress_subset_loading -- if True, load the entire table, rather than just
+    ids_of_interest
+
+    ids_to_load -- a list of OTU ids for which data should be loaded
+
+    processes -- number of processes used to parse tab-delimited tables
+
+    functions_to_load -- if provided, only load these function ids
+
+    gzipped files are detected based on the '.gz' suffix.
+    """
+    if not path.exists(data_table_fp):
+        raise IOError("File "+data_table_fp+" doesn't exist! Did you forget to download it?")
+
+    ext=path.splitext(data_table_fp)[1]
+    if (ext == '.gz'):
+        genome_table_fh = gzip.open(data_table_fp,'rb')
+    else:
+        genome_table_fh = open(data_table_fp,'U')
+
+    if load_data_table_in_biom:
+        if not suppress_subset_loading:
+            #Now we want to use the OTU table information
+            #to load only rows in the count table corresponding
+            #to relevant OTUs.  The file is streamed, so the full
+            #table is never held in memory.
+           
+            if verbose:
+                print "Loading traits for %i organisms from the trait table" %len(ids_to_load)
+
+            genome_table_fh.close()
+            genome_table = parse_biom_subset(data_table_fp,ids_to_load,\
+              axis='samples',other_ids_to_load=functions_to_load)
         else:
-            otu_data.append(otu_table.observationData(obs_id))
-        if genome_table_ids == "ObservationIds":
-           genome_data.append(genome_table.observationData(obs_id))
+            if verbose:
+                print "Loading *full* count table because --suppress_subset_loading was passed. This may result in high memory usage"
+            genome_table = parse_biom_table(genome_table_fh.read())
+            if functions_to_load is not None:
+                genome_table = filter_table_to_functions(genome_table,functions_to_load)
+    elif processes > 1:
+        genome_table = convert_precalc_to_biom_in_parallel(genome_table_fh,\
+          ids_to_load,transpose=transpose,processes=processes,\
+          functions_to_load=functions_to_load)
+    else:
+        genome_table = convert_precalc_to_biom(genome_table_fh,ids_to_load,\
+          transpose=transpose,functions_to_load=functions_to_load)
+    
+    if verbose:
+        print "Done loading trait table containing %i functions for %i organisms." %(len(genome_table.ObservationIds),len(genome_table.SampleIds))
+
+    return genome_table
+
+
+def open_precalc_blocks(data_table_fp,ids_to_load=None,processes=1,\
+    functions_to_load=None,verbose=False):
+    """Start parsing a tab-delimited data table in blocks, returning a PrecalcBlockReader
+
+    gzipped files are detected based on the '.gz' suffix.  See
+    predict_metagenomes_from_precalc_blocks.
+    """
+    if not path.exists(data_table_fp):
+        raise IOError("File "+data_table_fp+" doesn't exist! Did you forget to download it?")
+
+    if path.splitext(data_table_fp)[1] == '.gz':
+        data_table_fh = gzip.open(data_table_fp,'rb')
+    else:
+        data_table_fh = open(data_table_fp,'U')
+    if verbose:
+        print "Parsing trait table in blocks with %i processes" % processes
+    return PrecalcBlockReader(data_table_fh,ids_to_load,processes=processes,\
+      functions_to_load=functions_to_load)
+
+def expand_otu_table_fps(input_otu_tables):
+    """Return the list of OTU table filepaths given by comma-separated paths and/or globs"""
+    otu_table_fps = []
+    for entry in input_otu_tables.split(','):
+        if path.exists(entry):
+            matches = [entry]
         else:
-           genome_data.append(genome_table.sampleData(obs_id))
-    return otu_data,genome_data,overlapping_otus 
+            matches = sorted(glob(entry))
+        for otu_table_fp in matches:
+            if otu_table_fp not in otu_table_fps:
+                otu_table_fps.append(otu_table_fp)
+    return otu_table_fps
+
+def get_batch_otu_ids(otu_table_fps):
+    """Return the ids of the OTUs in any of otu_table_fps, in the order first seen
+
+    Only the OTU ids and metadata of each table are parsed, so the trait
+    table can be loaded once for all of the tables.
+    """
+    otu_ids = []
+    seen = set()
+    for otu_table_fp in otu_table_fps:
+        for otu_id,md in parse_biom_axis_metadata(otu_table_fp,'observations'):
+            if otu_id not in seen:
+                seen.add(otu_id)
+                otu_ids.append(otu_id)
+    return otu_ids
+
+def get_batch_output_fps(otu_table_fps,output_dir,accuracy_metrics_fp=None,\
+    tab_delimited=False):
+    """Return the prediction and accuracy metric filepaths of each table in a batch
+
+    Output files are named after the OTU table (e.g. study1.biom -> 
+    output_dir/study1.biom), and accuracy metrics are named after both the 
+    OTU table and the requested accuracy metrics file (e.g. nsti.tab ->
+    output_dir/study1_nsti.tab).  Returns a list of (output filepath,
+    accuracy metrics filepath) pairs.  Raises ValueError if the outputs of
+    two tables would have the same name (e.g. a/otus.biom and b/otus.biom).
+    """
+    if tab_delimited:
+        ext = '.txt'
+    else:
+        ext = '.biom'
+    output_fps = []
+    otu_table_fps_by_output = {}
+    for otu_table_fp in otu_table_fps:
+        base_name = splitext(split(otu_table_fp)[1])[0]
+        output_fp = join(output_dir,base_name+ext)
+        table_accuracy_metrics_fp = None
+        if accuracy_metrics_fp:
+            table_accuracy_metrics_fp = join(output_dir,\
+              "%s_%s" %(base_name,split(accuracy_metrics_fp)[1]))
+        for fp in (output_fp,table_accuracy_metrics_fp):
+            if fp is None:
+                continue
+            if fp in otu_table_fps_by_output:
+                raise ValueError("The predictions for %s and %s would both be written to %s. Rename one of the OTU tables." \
+                  %(otu_table_fps_by_output[fp],otu_table_fp,fp))
+            otu_table_fps_by_output[fp] = otu_table_fp
+        output_fps.append((output_fp,table_accuracy_metrics_fp))
+    return output_fps
+
+def filter_table_to_functions(genome_table,functions_to_load):
+    """Return genome_table (with functions as observations) limited to functions_to_load
+
+    Raises KeyError if any of functions_to_load are not in genome_table.
+    """
+    functions_to_load = frozenset(map(str,functions_to_load))
+    missing = functions_to_load.difference(genome_table.ObservationIds)
+    if missing:
+        raise KeyError("Function ids not found in the genome table: %s" %\
+          ', '.join(sorted(missing)[:5]))
+    return genome_table.filterObservations(\
+      lambda vals,gene_id,metadata: str(gene_id) in functions_to_load)
+
+def load_function_metadata(data_table_fp,load_data_table_in_biom=False):
+    """Return the (function id, metadata) pairs of a precalculated data table
 
+    Only the function ids and metadata are parsed, so this is much cheaper
+    than loading the table.
+    """
+    if load_data_table_in_biom:
+        return parse_biom_axis_metadata(data_table_fp,axis='observations')
+
+    if path.splitext(data_table_fp)[1] == '.gz':
+        data_table_fh = gzip.open(data_table_fp,'rb')
+    else:
+        data_table_fh = open(data_table_fp,'U')
+    result = parse_precalc_trait_metadata(data_table_fh)
+    data_table_fh.close()
+    return result
+
+def get_function_ids_in_category(function_metadata,metadata_category,category_names):
+    """Return the ids of functions annotated with any of category_names
+
+    function_metadata -- (function id, metadata) pairs, as returned by
+      load_function_metadata
+    metadata_category -- the metadata describing the functional hierarchy,
+      e.g. KEGG_Pathways
+    category_names -- names at any level of the hierarchy, e.g.
+      'Glycolysis / Gluconeogenesis' or 'Carbohydrate Metabolism'
+    """
+    category_names = set(category_names)
+    function_ids = []
+    for function_id,metadata in function_metadata:
+        if metadata is None or metadata_category not in metadata:
+            continue
+        annotations = metadata[metadata_category]
+        if isinstance(annotations,basestring):
+            annotations = [[annotations]]
+        elif annotations and isinstance(annotations[0],basestring):
+            annotations = [annotations]
+        for annotation in annotations:
+            if category_names.intersection(a.strip() for a in annotation):
+                function_ids.append(function_id)
+                break
+    return function_ids
+
+def determine_functions_to_load(data_table_fp,function_ids=None,\
+    category_names=None,metadata_category='KEGG_Pathways',\
+    load_data_table_in_biom=False):
+    """Return the function ids to load from data_table_fp, or None for all
+
+    function_ids -- function ids to load
+    category_names -- also load the functions in these categories of
+      metadata_category (see get_function_ids_in_category)
+
+    Raises ValueError if no functions are in category_names.
+    """
+    if not function_ids and not category_names:
+        return None
+
+    functions_to_load = list(function_ids or [])
+    if category_names:
+        category_function_ids = get_function_ids_in_category(\
+          load_function_metadata(data_table_fp,load_data_table_in_biom),\
+          metadata_category,category_names)
+        if not category_function_ids:
+            raise ValueError("No functions in %s are annotated with: %s" \
+              %(data_table_fp,', '.join(category_names)))
+        functions_to_load.extend(f for f in category_function_ids \
+          if f not in functions_to_load)
+    return functions_to_load
 
 def load_subset_from_biom_str(biom_str,ids_to_load,axis="samples"):
     """Load a biom table containing subset of samples or observations from a BIOM format JSON string"""
@@ -116,8 +474,15 @@ def predict_metagenomes(otu_table,genome_table,verbose=False):
     """
     
     otu_data,genome_data,overlapping_otus = extract_otu_and_genome_data(otu_table,genome_table)
+
+    # OTUs with identical predicted genomes contribute the same genome, so
+    # sum their abundances and multiply by each distinct genome only once
+    order,group_starts = group_identical_rows(genome_data)
+    otu_data = sum_rows_by_group(otu_data,order,group_starts)
+    genome_data = genome_data[order[group_starts]]
+
     # matrix multiplication to get the predicted metagenomes
-    new_data = dot(array(otu_data).T,array(genome_data)).T
+    new_data = dot(otu_data.T,genome_data).T
     
     #Round counts to nearest whole numbers
     new_data = around(new_data)
@@ -143,52 +508,38 @@ def predict_metagenome_variances(otu_table,genome_table,\
    
    Note that OTU counts are treated as constants (exactly known) rather than random variables
    for now.   If a good method for getting variance for OTU counts becomes available, this should
-   be updated to treat them as random variables as well.
+   be updated to treat them as random variables as well.  (bootstrap_metagenome_CIs estimates
+   the uncertainty due to sampling depth alone.)
    """
-    #Assume that OTUs are SampleIds in the genome table, but ObservationIds in the OTU table
-    genome_table_otu_ids="SampleIds"
-    otu_table_otu_ids="ObservationIds"
-    
-    #Find overlapping otus
-    overlapping_otus = get_overlapping_ids(otu_table,genome_table,\
-                  genome_table_ids=genome_table_otu_ids,otu_table_ids=otu_table_otu_ids)
-    #Ensure they overlap fully with variance table 
-    overlapping_otus = get_overlapping_ids(otu_table,gene_variances,\
-                  genome_table_ids=genome_table_otu_ids,otu_table_ids=otu_table_otu_ids)
-    #Filter OTU and Genome Table to contain only overlapping IDs
-    #print "overlapping_otus:",overlapping_otus
-    otu_table.filterObservations(lambda val,otu_id,metadata: otu_id in overlapping_otus)
-    genome_table.filterSamples(lambda val,otu_id,metadata: otu_id in overlapping_otus)
-    
-    #Handle missing variance data
-    #if gene_variances is None:
-    #    gene_variances = genome_table.copy()
-    #    gene_variances.transformSamples(lambda val,otu_id,metadata: val*0.0) 
-    #    #TODO: test if this is faster or slower than filling numpy.zeros followed by table
-    #    #construction
+    #OTUs are SampleIds in the genome and variance tables, but
+    #ObservationIds in the OTU table.  Genes are matched between the
+    #genome and variance tables by id, so they need not be in the same order.
+    otu_alignment = align_otu_ids(otu_table,[genome_table,gene_variances])
+    gene_alignment = IdAlignment(genome_table.ObservationIds,\
+      gene_variances.ObservationIds)
+    if not gene_alignment.is_complete():
+        raise ValueError("Variance table and genome table contain different gene ids")
+    otu_idxs,genome_otu_idxs,variance_otu_idxs = otu_alignment.indices
+    otu_data = get_aligned_data(otu_table,otu_idxs)
+    genome_data = get_aligned_data(genome_table,genome_otu_idxs,"SampleIds")
+    variance_data = get_table_data_array(gene_variances,\
+      observation_idxs=gene_alignment.indices[1],\
+      sample_idxs=variance_otu_idxs).T
 
-   
-    metagenome_data = None
-    metagenome_variance_data = None
     if verbose:
-        print "Calculating the variance of the estimated metagenome for %i OTUs." %len(overlapping_otus)
-    for otu_id in overlapping_otus:
-        otu_across_samples = otu_table.observationData(otu_id)
-        otu_across_genes = genome_table.sampleData(otu_id)
-        otu_variance_across_genes = gene_variances.sampleData(otu_id)
-        otu_contrib_to_metagenome=array([o*otu_across_genes for o in otu_across_samples])
-        var_otu_contrib_to_metagenome=\
-          array([scaled_variance(otu_variance_across_genes,o) for o in otu_across_samples])
-        
-        if metagenome_data is None:
-            metagenome_data = otu_contrib_to_metagenome
-            metagenome_variance_data = var_otu_contrib_to_metagenome
-        else:
-            metagenome_data += otu_contrib_to_metagenome
-            metagenome_variance_data = variance_of_sum(metagenome_variance_data,var_otu_contrib_to_metagenome)
+        print "Calculating the variance of the estimated metagenome for %i OTUs." %len(otu_alignment)
 
-    data_result = metagenome_data.T    
-    variance_result = metagenome_variance_data.T
+    # OTUs with identical genomes and variances are collapsed, as in
+    # predict_metagenomes.  Gene counts of different OTUs are treated as
+    # uncorrelated (r=0 in variance_of_sum), so the metagenome variance is
+    # the sum over OTUs of scaled_variance(variance,abundance), i.e. the
+    # product of the squared abundances with the variances.
+    order,group_starts = group_identical_rows(genome_data,variance_data)
+    unique_idxs = order[group_starts]
+    data_result = dot(sum_rows_by_group(otu_data,order,group_starts).T,\
+      genome_data[unique_idxs]).T
+    variance_result = dot(sum_rows_by_group(otu_data**2,order,group_starts).T,\
+      variance_data[unique_idxs]).T
     
     if verbose:
         print "Calculating metagenomic confidene intervals from variance."
@@ -228,6 +579,263 @@ def predict_metagenome_variances(otu_table,genome_table,\
       result_upper_CI_table
 
 
+def bootstrap_metagenome_CIs(otu_table,genome_table,replicates=1000,\
+    seed=None,max_values=2**24,verbose=False):
+    """Estimate 95% CIs of predicted metagenomes by bootstrapping the OTU counts
+
+    otu_table -- BIOM Table object of OTUs
+    genome_table -- BIOM Table object of predicted gene counts per OTU
+    replicates -- the number of bootstrap resamples of each sample
+    seed -- seed for the random resampling.  Each sample gets its own
+      random stream, so the results for a given seed don't depend on
+      max_values.
+    max_values -- the approximate number of values held in memory at
+      once by each of the arrays of resampled counts and predictions.
+      Percentiles need every replicate prediction of a sample, and a
+      chunk holds at least one replicate of each sample in a block, so
+      the predictions can hold up to max(max_values,replicates*n_functions)
+      values, and the resampled counts of a block of b samples up to
+      max(max_values,b*max(n_otus,n_functions)).
+
+    Each replicate draws as many OTUs from a sample (with replacement,
+    i.e. a multinomial resample of its relative abundances) as were
+    observed in it, and predicts its metagenome as predict_metagenomes
+    does.  Samples with non-integer counts (e.g. after copy number
+    normalization) are resampled at their rounded depth and scaled back to
+    their total count.  Only the sampling depth is treated as uncertain:
+    the gene counts of each OTU are taken as exact.
+
+    Samples are processed in blocks sized to hold all of their replicates
+    in max_values, and the replicates of each block are multiplied by the
+    genome table, as one stacked matrix product, in chunks.  The
+    resamples of a chunk are drawn with one multinomial call per sample
+    (drawing all of the chunk's replicates of that sample), rather than
+    as one batch across samples: each sample keeps its own random stream,
+    and the Python loop only costs one call per sample and chunk.
+    Returns the lower and upper CI (2.5th and 97.5th percentiles, rounded)
+    as SparseGeneTables.
+    """
+    otu_data,genome_data,overlapping_otus = \
+      extract_otu_and_genome_data(otu_table,genome_table)
+    order,group_starts = group_identical_rows(genome_data)
+    genome_data = genome_data[order[group_starts]]
+    n_otus,n_samples = otu_data.shape
+    n_functions = genome_data.shape[1]
+
+    totals = otu_data.sum(axis=0)
+    depths = around(totals).astype(int)
+    sample_seeds = RandomState(seed).randint(0,2**31-1,n_samples)
+    samples_per_block = max(1,min(n_samples,max_values//(replicates*n_functions)))
+    chunk_size = max(1,min(replicates,max_values//\
+      (samples_per_block*max(n_otus,n_functions))))
+
+    lower_CI = zeros((n_functions,n_samples))
+    upper_CI = zeros((n_functions,n_samples))
+    for start in range(0,n_samples,samples_per_block):
+        samples = range(start,min(start+samples_per_block,n_samples))
+        if verbose:
+            print "Bootstrapping samples %i to %i of %i" \
+              %(samples[0]+1,samples[-1]+1,n_samples)
+        random_states = [RandomState(sample_seeds[i]) for i in samples]
+        predictions = empty((replicates,n_functions,len(samples)))
+        for b_start in range(0,replicates,chunk_size):
+            b_end = min(b_start+chunk_size,replicates)
+            resampled = zeros((b_end-b_start,len(samples),n_otus))
+            for j,i in enumerate(samples):
+                if depths[i] > 0:
+                    resampled[:,j] = random_states[j].multinomial(depths[i],\
+                      otu_data[:,i]/totals[i],size=b_end-b_start)
+                    resampled[:,j] *= totals[i]/depths[i]
+            resampled = resampled.reshape(-1,n_otus)
+            grouped = sum_rows_by_group(resampled.T,order,group_starts)
+            predictions[b_start:b_end] = dot(grouped.T,genome_data).reshape(\
+              b_end-b_start,len(samples),n_functions).transpose(0,2,1)
+        predictions.sort(axis=0)
+        lower_CI[:,samples] = _percentile_of_sorted(predictions,2.5)
+        upper_CI[:,samples] = _percentile_of_sorted(predictions,97.5)
+
+    lower_CI_table,upper_CI_table = [table_from_template(around(data),\
+      otu_table.SampleIds,genome_table.ObservationIds,\
+      sample_metadata_source=otu_table,observation_metadata_source=genome_table,\
+      constructor=SparseGeneTable) for data in (lower_CI,upper_CI)]
+    return lower_CI_table,upper_CI_table
+
+def _percentile_of_sorted(sorted_data,q):
+    """Return the q-th percentile along the first axis of sorted_data
+
+    Values are interpolated between the closest ranks, as by
+    numpy.percentile, but sorted_data must already be sorted.
+    """
+    position = (len(sorted_data)-1)*q/100
+    lower = int(position)
+    upper = min(lower+1,len(sorted_data)-1)
+    fraction = position - lower
+    return sorted_data[lower]*(1-fraction) + sorted_data[upper]*fraction
+
+#the per-OTU metadata of precalculated tables already divided by marker
+#gene copy number (see write_prenormalized_precalc)
+MARKER_COPY_NUMBER_METADATA = 'MarkerCopyNumber'
+#the MarkerCopyNumber of OTUs without a copy number, whose gene counts
+#are written as zeros
+MISSING_MARKER_COPY_NUMBER = 'NA'
+
+def is_prenormalized(genome_table):
+    """Return True if genome_table was divided by marker gene copy number"""
+    sample_metadata = genome_table.SampleMetadata
+    return bool(sample_metadata) and \
+      sample_metadata[0].get(MARKER_COPY_NUMBER_METADATA) is not None
+
+def run_metagenome_prediction(otu_table,genome_table,variance_table=None,\
+    with_confidence=False,accuracy_metrics=False,normalize_by_otu=False,\
+    normalize_by_function=False,bootstrap_replicates=0,bootstrap_seed=None,\
+    normalized_otu_table=None,verbose=False):
+    """Run the predict_metagenomes.py workflow on loaded tables, returning a dict of results
+
+    otu_table -- BIOM Table object for the OTUs
+    genome_table -- BIOM Table object of predicted gene counts per OTU
+    variance_table -- BIOM Table object of gene count variances (required
+      if with_confidence is True)
+
+    The returned dict always contains a 'prediction' table.  If with_confidence
+    is True it also contains 'variances', 'upper_CI_95' and 'lower_CI_95'
+    tables, and if accuracy_metrics is True it contains 'nsti', a list of
+    (sample_id,weighted NSTI) pairs.  If bootstrap_replicates is greater
+    than zero it also contains 'bootstrap_lower_CI_95' and
+    'bootstrap_upper_CI_95' tables (see bootstrap_metagenome_CIs).
+    Normalization is applied only to the prediction itself.
+
+    If genome_table is prenormalized (divided by marker gene copy number,
+    see is_prenormalized), otu_table holds raw OTU counts and the
+    prediction is the one made from the copy number normalized OTU table
+    and the original gene counts.  The NSTI and normalize_by_otu are then
+    calculated from normalized_otu_table, the OTU table divided by the
+    same copy numbers (see normalize_by_marker_copy_number), which must
+    be provided for them.  Confidence intervals and bootstrapping are not
+    available for prenormalized tables.
+    """
+    #the OTU abundances that the NSTI and OTU sums are calculated from
+    abundance_table = otu_table
+    if is_prenormalized(genome_table):
+        if with_confidence or bootstrap_replicates:
+            raise ValueError("Confidence intervals can't be calculated from a gene count table that was divided by marker gene copy number.")
+        if (accuracy_metrics or normalize_by_otu) and normalized_otu_table is None:
+            raise ValueError("The NSTI and normalization by OTU require the OTU table normalized by marker gene copy number when the gene count table was divided by it.")
+        abundance_table = normalized_otu_table
+
+    result = {}
+    if accuracy_metrics:
+        samples,nstis = calc_nsti(abundance_table,genome_table,weighted=True)
+        result['nsti'] = zip(samples,map(float,nstis))
+
+    if with_confidence:
+        if variance_table is None:
+            raise ValueError(\
+              "Confidence intervals were requested, but no variance table was provided.")
+        #If we are calculating variance, we get the prediction as part
+        #of the process
+        if verbose:
+            print "Predicting the metagenome, metagenome variance and confidence intervals for the metagenome..."
+        result['prediction'],result['variances'],\
+          result['lower_CI_95'],result['upper_CI_95'] =\
+          predict_metagenome_variances(otu_table,genome_table,variance_table)
+    else:
+        #If we don't need confidence intervals, we can do a faster pure numpy prediction
+        if verbose:
+            print "Predicting the metagenome..."
+        result['prediction'] = predict_metagenomes(otu_table,genome_table)
+
+    if bootstrap_replicates:
+        if verbose:
+            print "Bootstrapping the OTU counts %i times for confidence intervals..." \
+              % bootstrap_replicates
+        result['bootstrap_lower_CI_95'],result['bootstrap_upper_CI_95'] = \
+          bootstrap_metagenome_CIs(otu_table,genome_table,\
+          replicates=bootstrap_replicates,seed=bootstrap_seed,verbose=verbose)
+
+    result['prediction'] = normalize_prediction(result['prediction'],\
+      abundance_table,normalize_by_otu=normalize_by_otu,\
+      normalize_by_function=normalize_by_function,verbose=verbose)
+    return result
+
+def normalize_prediction(prediction,otu_table,normalize_by_otu=False,\
+    normalize_by_function=False,verbose=False):
+    """Return prediction normalized by the OTU and/or function sums of each sample"""
+    if normalize_by_otu:
+        #normalize (e.g. divide) the abundances by the sum of the OTUs per sample
+        if verbose:
+            print "Normalizing functional abundances by sum of OTUs per sample"
+        inverse_otu_sums = [1/x for x in otu_table.sum(axis='sample')]
+        scaling_factors = dict(zip(otu_table.SampleIds,inverse_otu_sums))
+        prediction = scale_metagenomes(prediction,scaling_factors)
+
+    if normalize_by_function:
+        #normalize (e.g. divide) the abundances by the sum of the functions per sample
+        #Sum of functional abundances per sample will equal 1 (e.g. relative abundance).
+        if verbose:
+            print "Normalizing functional abundances by sum of functions per sample"
+        prediction = prediction.normObservationBySample()
+
+    return prediction
+
+def predict_metagenomes_from_precalc_blocks(otu_tables,precalc_blocks,\
+    accuracy_metrics=False,verbose=False):
+    """Predict metagenomes for otu_tables as the blocks of a precalc file are parsed
+
+    otu_tables -- a list of BIOM Table objects for the OTUs
+    precalc_blocks -- a PrecalcBlockReader for the gene count table,
+      loading (at least) the OTUs in otu_tables.  Create it before parsing
+      the OTU tables, so that the two are parsed at the same time.
+
+    The product of the OTU counts and each block of predicted genomes is
+    added to the prediction while the reader parses the next block, so
+    the full gene count table is never loaded.  Returns a list with a
+    dict of results for each OTU table, containing the 'prediction' (and
+    'nsti', if accuracy_metrics is True) as run_metagenome_prediction does.
+    """
+    n_traits = len(precalc_blocks.trait_ids)
+    otu_data,otu_idxs,sums,nsti_sums,count_sums = [],[],[],[],[]
+    for otu_table in otu_tables:
+        otu_data.append(get_table_data_array(otu_table))
+        otu_idxs.append(dict((otu_id,i) for i,otu_id in \
+          enumerate(otu_table.ObservationIds)))
+        sums.append(zeros((n_traits,len(otu_table.SampleIds))))
+        nsti_sums.append(zeros(len(otu_table.SampleIds)))
+        count_sums.append(zeros(len(otu_table.SampleIds)))
+
+    for block_num,(block_otu_ids,block_data,block_col_meta) in \
+      enumerate(precalc_blocks):
+        if verbose:
+            print "Predicting metagenomes for block %i (%i OTUs)" \
+              %(block_num,len(block_otu_ids))
+        for i in range(len(otu_tables)):
+            block_idxs = []
+            otu_rows = []
+            for block_idx,otu_id in enumerate(block_otu_ids):
+                if otu_id in otu_idxs[i]:
+                    block_idxs.append(block_idx)
+                    otu_rows.append(otu_idxs[i][otu_id])
+            if not block_idxs:
+                continue
+            counts = otu_data[i].take(otu_rows,axis=0)
+            sums[i] += dot(block_data.take(block_idxs,axis=0).T,counts)
+            if accuracy_metrics:
+                nsti = array([float(block_col_meta[idx]['NSTI']) \
+                  for idx in block_idxs])
+                nsti_sums[i] += dot(nsti,counts)
+                count_sums[i] += counts.sum(axis=0)
+
+    results = []
+    for i,otu_table in enumerate(otu_tables):
+        result = {}
+        if accuracy_metrics:
+            result['nsti'] = zip(otu_table.SampleIds,\
+              map(float,nsti_sums[i]/count_sums[i]))
+        result['prediction'] = table_factory(around(sums[i]),\
+          otu_table.SampleIds,precalc_blocks.trait_ids,otu_table.SampleMetadata,\
+          precalc_blocks.row_meta,constructor=SparseGeneTable)
+        results.append(result)
+    return results
+
 def table_from_template(new_data,sample_ids,observation_ids,\
     sample_metadata_source=None,observation_metadata_source=None,\
     constructor=SparseGeneTable,verbose=False):
@@ -348,30 +956,22 @@ def calc_nsti(otu_table,genome_table,weighted=True):
     """
 
     # identify the overlapping otus that can be used to calculate the NSTI
-    overlapping_otus = get_overlapping_ids(otu_table,genome_table)
-    total = 0.0 
-    n = 0.0
+    alignment = align_otu_ids(otu_table,[genome_table])
+    otu_idxs,genome_idxs = alignment.indices
     observation_ids = otu_table.SampleIds
-    for obs_id in overlapping_otus:
-        #print "Curr observed id:",obs_id
-        obs_id_idx = genome_table.getSampleIndex(obs_id)
-        #observatin_ids.append(genome_table.ObservationIds[obs_id_idx])
-        curr_nsti =  float(genome_table.SampleMetadata[obs_id_idx]['NSTI'])
-        #print "Current NSTI", curr_nsti
-        if weighted:
-            curr_counts = otu_table.observationData(obs_id)
-            #print "Curr counts:",curr_counts
-            total += curr_counts*curr_nsti
-            #print "total:",total
-            n += curr_counts
-            #print "n:",n
-        else:
-            total += curr_nsti
-            n += 1
-    
-    result=total/n
-    #print "result:",result
-    
+
+    # extract the NSTI of each overlapping otu once, as an array aligned
+    # with the otu rows below
+    nsti = array([float(genome_table.SampleMetadata[idx]['NSTI']) \
+      for idx in genome_idxs])
+
+    if not weighted:
+        return observation_ids,nsti.sum()/len(nsti)
+
+    counts = get_aligned_data(otu_table,otu_idxs)
+
+    #weight each otu's NSTI by its abundance in each sample
+    result = dot(nsti,counts)/counts.sum(axis=0)
     return observation_ids,result
 
 def variance_of_product(A,B,varA,varB,r=0):
@@ -382,41 +982,269 @@ def variance_of_product(A,B,varA,varB,r=0):
     variance += 2*(sqrt(varA)*sqrt(varB))*r/(A*B)
     return variance
 
-def scaled_variance(var_x,c):
+def scaled_variance(var_x,c,out=None):
     """Return the variance of a random variable X scaled by a constant c 
     
     Formula:  Var(X*c) = var(X)*(c**2)
-    
+
+    out -- optional array to write the result into
     """
-    return var_x*(c**2)
+    if out is None:
+        return var_x*(c**2)
+    return multiply(var_x,c**2,out)
 
-def variance_of_sum(varA,varB,r=0,sign_of_varB=1):
+def variance_of_sum(varA,varB,r=0,sign_of_varB=1,out=None):
+    """Return the variance of the sum of two random variables A and B
 
-    variance = varA + varB + 2*(sqrt(varA)*sqrt(varB))*r*sign_of_varB
-    return variance
+    Formula: Var(A+B) = var(A) + var(B) + 2*sqrt(var(A))*sqrt(var(B))*r
 
-   
-def sum_rows_with_variance(data_array,variance_array):    
+    r -- the correlation between A and B.  If r is 0 only the sum of the
+      variances is computed.
+    out -- optional array to write the result into (may be varA, to
+      accumulate a variance in place)
+    """
+    if out is None:
+        out = empty(broadcast(varA,varB).shape,dtype=float)
+    if isscalar(r) and r == 0:
+        add(varA,varB,out)
+        return _unwrap_scalar(out)
+
+    #variance due to correlation between A and B (calculated before
+    #the sum, as out may be varA)
+    covariance = sqrt(varA)
+    covariance *= sqrt(varB)
+    covariance *= 2*r*sign_of_varB
+    add(varA,varB,out)
+    out += covariance
+    return _unwrap_scalar(out)
+
+def _unwrap_scalar(a):
+    """Return the value of 0-d arrays (as for scalar arithmetic), or a itself"""
+    if a.ndim == 0:
+        return a[()]
+    return a
+
+def sum_rows_with_variance(data_array,variance_array,out=None):
     """Sum the rows of an array, returning sum and variance arrays
         
-    
+    The rows are treated as uncorrelated (r=0 in variance_of_sum), so the
+    variance of the sum is the sum of the variances.
+
+    out -- optional (sum,variance) arrays to write the results into
     """
     if data_array.shape != variance_array.shape:
         raise ValueError("data array and variance array must have the same shape. Instead we have data.shape:%s and variance.shape:%s"%(data_array.shape,variance_array.shape))
     
-    result_by_rows = None
-    for row in data_array:
-        if result_by_rows is None:
-            result_by_rows = row
-        else:
-            result_by_rows += row
-        last_row = row
-    variance_by_rows = None
-    for row in variance_array:
-        if variance_by_rows is None:
-            variance_by_rows = row
-        else:
-            new_variance = variance_of_sum(variance_by_rows,row)
-            variance_by_rows = new_variance
+    if out is None:
+        out = (None,None)
+    result_by_rows = numpy_sum(data_array,axis=0,out=out[0])
+    variance_by_rows = numpy_sum(variance_array,axis=0,out=out[1])
     return result_by_rows,variance_by_rows
 
+CONFIDENCE_LAYERS = ['variances','upper_CI_95','lower_CI_95']
+BOOTSTRAP_LAYERS = ['bootstrap_lower_CI_95','bootstrap_upper_CI_95']
+
+def format_layered_prediction(results,include_CI=True):
+    """Return the prediction, variance and CI tables of results as one BIOM string
+
+    results -- a dict of tables, as returned by run_metagenome_prediction
+      with with_confidence=True
+    include_CI -- if False, the confidence intervals are not stored, and
+      are derived from the prediction and variances when the file is read.
+      This is only valid if the prediction has not been normalized.
+
+    The prediction is written as a normal BIOM table, so any BIOM reader
+    can load it.  The other tables share its ids and metadata, so only
+    their values are stored, as sparse [row, column, value] lists under
+    the 'layers' key.  Bootstrap confidence intervals are stored too, if
+    results contains them.
+    """
+    prediction = results['prediction']
+    layer_names = CONFIDENCE_LAYERS if include_CI else CONFIDENCE_LAYERS[:1]
+    layer_names = layer_names + [name for name in BOOTSTRAP_LAYERS if name in results]
+    layers = []
+    for layer_name in layer_names:
+        table = results[layer_name]
+        if table.SampleIds != prediction.SampleIds or \
+          table.ObservationIds != prediction.ObservationIds:
+            raise ValueError("The %s table and the prediction have different ids" % layer_name)
+        layers.append('"%s": %s' %(layer_name,_format_layer_data(table)))
+
+    biom_str = format_biom_table(prediction)
+    return '%s, "layers": {%s}}' %(biom_str[:biom_str.rindex('}')],', '.join(layers))
+
+def _format_layer_data(table):
+    """Return the nonzero values of table as a JSON list of [row, column, value]"""
+    if table._biom_matrix_type == 'sparse':
+        rows,cols,values = get_sparse_coordinates(table._data)
+        order = lexsort((cols,rows))
+        rows,cols,values = rows[order],cols[order],values[order]
+    else:
+        data = get_table_data_array(table)
+        rows,cols = data.nonzero()
+        values = data[rows,cols]
+    return '[%s]' % ','.join(['[%d,%d,%r]' % entry for entry in \
+      zip(rows.tolist(),cols.tolist(),values.tolist()) if entry[2] != 0])
+
+def parse_layered_prediction(biom_str):
+    """Return a dict of the tables in a BIOM string from format_layered_prediction
+
+    The dict contains 'prediction', 'variances', 'upper_CI_95' and
+    'lower_CI_95' tables (with the CIs calculated from the prediction and
+    variances if they weren't stored).  A plain BIOM table is returned as
+    the 'prediction' alone.
+    """
+    json_table = loads(biom_str)
+    layers = json_table.pop('layers',{})
+    shape = json_table['shape']
+    sample_ids = [c['id'] for c in json_table['columns']]
+    observation_ids = [r['id'] for r in json_table['rows']]
+    sample_metadata = [c['metadata'] for c in json_table['columns']]
+    observation_metadata = [r['metadata'] for r in json_table['rows']]
+    if all(md is None for md in sample_metadata):
+        sample_metadata = None
+    if all(md is None for md in observation_metadata):
+        observation_metadata = None
+
+    def layer_array(entries):
+        data = zeros(shape)
+        if entries:
+            entries = asarray(entries,dtype=float)
+            data[entries[:,0].astype(int),entries[:,1].astype(int)] = entries[:,2]
+        return data
+
+    if json_table['matrix_type'] == 'dense':
+        arrays = {'prediction':asarray(json_table['data'],dtype=float).reshape(shape)}
+    else:
+        arrays = {'prediction':layer_array(json_table['data'])}
+    for layer_name,entries in layers.items():
+        arrays[str(layer_name)] = layer_array(entries)
+    if 'variances' in arrays and 'upper_CI_95' not in arrays:
+        arrays['lower_CI_95'],arrays['upper_CI_95'] = \
+          calc_confidence_interval_95(arrays['prediction'],arrays['variances'],\
+          round_CI=True,min_val=0.0,max_val=None)
+
+    #the tables share the id and metadata lists
+    results = {}
+    for name,data in arrays.items():
+        results[name] = table_factory(data,sample_ids,observation_ids,\
+          sample_metadata,observation_metadata,constructor=SparseGeneTable)
+    return results
+
+def write_prediction_results(results,output_fp,accuracy_metrics_fp=None,\
+    tab_delimited=False,layered=False,include_CI_layers=True,verbose=False):
+    """Write the results of run_metagenome_prediction to output_fp (and related files)
+
+    layered -- if True, write the prediction, variances and confidence
+      intervals to output_fp as a single BIOM file (see
+      format_layered_prediction) instead of to four files.
+    """
+    if accuracy_metrics_fp:
+        if verbose:
+            print "Writing NSTI information to file:", accuracy_metrics_fp
+        accuracy_output_fh = open(accuracy_metrics_fp,'w')
+        accuracy_output_fh.write("#Sample\tMetric\tValue\n")
+        for sample,nsti in results['nsti']:
+            line = "%s\tWeighted NSTI\t%s\n" %(sample,str(nsti))
+            accuracy_output_fh.write(line)
+        accuracy_output_fh.close()
+
+    if layered and 'variances' in results:
+        if tab_delimited:
+            raise ValueError("Layered output is only available in BIOM format")
+        if verbose:
+            print "Writing metagenome prediction, variance and confidence interval layers to output file:",output_fp
+        make_output_dir_for_file(output_fp)
+        open(output_fp,'w').write(format_layered_prediction(results,\
+          include_CI=include_CI_layers))
+        return
+
+    write_metagenome_to_file(results['prediction'],output_fp,\
+        tab_delimited,"metagenome prediction",verbose=verbose)    
+    
+    if 'variances' in results:
+        output_path,output_filename = split(output_fp)
+        base_output_filename,ext = splitext(output_filename)
+        variance_output_fp =\
+          join(output_path,"%s_variances%s" %(base_output_filename,ext))
+        upper_CI_95_output_fp =\
+          join(output_path,"%s_upper_CI_95%s" %(base_output_filename,ext))
+        lower_CI_95_output_fp =\
+          join(output_path,"%s_lower_CI_95%s" %(base_output_filename,ext))
+
+        write_metagenome_to_file(results['variances'],\
+          variance_output_fp,tab_delimited,\
+          "metagenome prediction variance",verbose=verbose)    
+
+        write_metagenome_to_file(results['upper_CI_95'],\
+          upper_CI_95_output_fp,tab_delimited,\
+          "metagenome prediction upper 95% confidence interval",\
+          verbose=verbose)    
+
+        write_metagenome_to_file(results['lower_CI_95'],\
+          lower_CI_95_output_fp,tab_delimited,\
+          "metagenome prediction lower 95% confidence interval",\
+          verbose=verbose)    
+
+    for layer_name in BOOTSTRAP_LAYERS:
+        if layer_name in results:
+            output_path,output_filename = split(output_fp)
+            base_output_filename,ext = splitext(output_filename)
+            write_metagenome_to_file(results[layer_name],\
+              join(output_path,"%s_%s%s" %(base_output_filename,layer_name,ext)),\
+              tab_delimited,"metagenome prediction %s" % layer_name.replace('_',' '),\
+              verbose=verbose)
+
+def write_metagenome_to_file(predicted_metagenome,output_fp,\
+    tab_delimited=False,verbose_filetype_message="metagenome prediction",\
+    verbose=False):
+    """Write a BIOM Table object to a file, creating the directory if needed
+    predicted_metagenome -- a BIOM table object
+    output_fp -- the filepath to write the output
+    tab_delimited -- if False, write in BIOm format, otherwise write as a tab-delimited file
+    verbose -- if True output verbose info to StdOut
+    """
+
+    if verbose:
+        print "Writing %s results to output file: %s"\
+          %(verbose_filetype_message,output_fp)
+
+    make_output_dir_for_file(output_fp)
+    if tab_delimited:
+        #peek at first observation to decide on what observeration metadata
+        #to output in tab-delimited format
+        (obs_val,obs_id,obs_metadata)=\
+          predicted_metagenome.iterObservations().next()
+
+        #see if there is a metadata field that contains the "Description" 
+        #(e.g. KEGG_Description or COG_Description)
+        h = re.compile('.*Description')
+        metadata_names=filter(h.search,obs_metadata.keys())
+        if metadata_names:
+            #use the "Description" field we found
+            metadata_name=metadata_names[0]
+        elif(obs_metadata.keys()):
+            #if no "Description" metadata then just output the first 
+            #observation metadata
+            metadata_name=(obs_metadata.keys())[0]
+        else:
+            #if no observation metadata then don't output any
+            metadata_name=None
+            
+        open(output_fp,'w').write(predicted_metagenome.delimitedSelf(\
+          header_key=metadata_name,header_value=metadata_name,metadata_formatter=biom_meta_to_string))
+    else:
+        #output in BIOM format
+        open(output_fp,'w').write(format_biom_table(predicted_metagenome))
+
+def biom_meta_to_string(metadata, replace_str=':'):
+    """ Determine which format the metadata is (e.g. str, list, or list of lists) and then convert to a string"""
+
+    #Note that since ';' and '|' are used as seperators we must replace them if they exist
+    if type(metadata) ==str or type(metadata)==unicode:
+        return metadata.replace(';',replace_str)
+    elif type(metadata) == list:
+        if type(metadata[0]) == list:
+            return "|".join(";".join([y.replace(';',replace_str).replace('|',replace_str) for y in x]) for x in metadata)
+        else:
+            return ";".join(x.replace(';',replace_str) for x in metadata)
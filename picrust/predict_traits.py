@@ -19,7 +19,8 @@ from cogent.util.option_parsing import parse_command_line_parameters, make_optio
 from numpy.ma import masked_object
 from numpy.ma import array as masked_array
 from numpy import apply_along_axis,array,around,mean,maximum as numpy_max, minimum as numpy_min,\
-  sqrt,sum,amax,amin,where, logical_not, argmin, histogram, add
+  sqrt,sum,amax,amin,where, logical_not, argmin, histogram, add,\
+  asarray, empty, broadcast, multiply, subtract, may_share_memory
 from numpy.random import normal
 from cogent.maths.stats.distribution import z_high
 from cogent.maths.stats.special import ndtri
@@ -1119,23 +1120,47 @@ def predict_traits_from_ancestors(tree,nodes_to_predict,\
         return results
 
 def calc_confidence_interval_95(predictions,variances,round_CI=True,\
-        min_val=0.0,max_val=None):
-    """Calc the 95% confidence interval given predictions and variances"""
-    stdev = sqrt(variances)
-    pred = predictions
-    CI_95 =  1.96*stdev
-    lower_95_CI = around(pred - CI_95)
-    upper_95_CI = around(pred + CI_95)
-    if round_CI:
-        lower_95_CI = around(lower_95_CI)
-        upper_95_CI = around(upper_95_CI)
+        min_val=0.0,max_val=None,out=None):
+    """Calc the 95% confidence interval given predictions and variances
+
+    out -- optional (lower,upper) arrays to write the intervals into.  No
+      other full-size temporaries are allocated, so large tables can be
+      processed in chunks by passing views of the rows.  The two arrays
+      are overwritten while predictions and variances are still being
+      read, so neither may share memory with them (or with each other);
+      a ValueError is raised if they do.
+
+    The intervals are always rounded to whole numbers (round_CI is kept
+    for backwards compatibility).
+    """
+    predictions = asarray(predictions)
+    variances = asarray(variances)
+    if out is None:
+        shape = broadcast(predictions,variances).shape
+        lower_95_CI = empty(shape,dtype=float)
+        upper_95_CI = empty(shape,dtype=float)
+    else:
+        lower_95_CI,upper_95_CI = out
+        if may_share_memory(lower_95_CI,upper_95_CI) or \
+          any(may_share_memory(interval,a) for interval in out \
+          for a in (predictions,variances)):
+            raise ValueError("The confidence interval arrays passed as out can't share memory with the predictions, the variances or each other.")
+
+    #upper_95_CI holds the half-width of the interval until it is added
+    sqrt(variances,upper_95_CI)
+    multiply(upper_95_CI,1.96,upper_95_CI)
+    subtract(predictions,upper_95_CI,lower_95_CI)
+    add(predictions,upper_95_CI,upper_95_CI)
+    around(lower_95_CI,out=lower_95_CI)
+    around(upper_95_CI,out=upper_95_CI)
+
     if min_val is not None:
-        lower_95_CI = numpy_max(min_val,lower_95_CI)
-        upper_95_CI = numpy_max(min_val,upper_95_CI)
+        numpy_max(min_val,lower_95_CI,lower_95_CI)
+        numpy_max(min_val,upper_95_CI,upper_95_CI)
 
     if max_val is not None:
-        lower_95_CI = numpy_min(max_val,lower_95_CI)
-        upper_95_CI = numpy_min(max_val,upper_95_CI)
+        numpy_min(max_val,lower_95_CI,lower_95_CI)
+        numpy_min(max_val,upper_95_CI,upper_95_CI)
     
     return lower_95_CI,upper_95_CI
 
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# File created on 18 Oct 2026
+from __future__ import division
+
+__author__ = "Greg Caporaso"
+__copyright__ = "Copyright 2011-2013, The PICRUSt Project"
+__credits__ = ["Greg Caporaso","Jesse Zaneveld","Morgan Langille"]
+__license__ = "GPL"
+__version__ = "1.0.0-dev"
+__maintainer__ = "Greg Caporaso"
+__email__ = "gregcaporaso@gmail.com"
+__status__ = "Development"
+
+import json
+from time import time
+from threading import Lock
+from urllib import urlencode
+from urllib2 import urlopen, HTTPError
+from urlparse import urlparse, parse_qs
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from biom.parse import parse_biom_table, parse_biom_table_str
+from biom.table import table_factory, DenseGeneTable, SparseGeneTable
+from picrust.predict_metagenomes import run_metagenome_prediction,\
+  is_prenormalized
+from picrust.normalize_by_copy_number import normalize_by_marker_copy_number
+from picrust.metagenome_contributions import partition_metagenome_contributions,\
+  format_contributions
+from picrust.util import format_biom_table
+
+class ServerMetrics(object):
+    """Thread-safe load and latency counters for a PredictionServer"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.start_time = time()
+        self.load_seconds = {}
+        self.active_requests = 0
+        self.requests = {}
+
+    def record_load(self,table_name,seconds):
+        """Record how long it took to load a resident table"""
+        with self._lock:
+            self.load_seconds[table_name] = seconds
+
+    def request_started(self):
+        with self._lock:
+            self.active_requests += 1
+
+    def request_finished(self,endpoint,seconds,failed=False):
+        """Record the latency (and success) of a finished request"""
+        with self._lock:
+            self.active_requests -= 1
+            stats = self.requests.setdefault(endpoint,\
+              {'count':0,'errors':0,'total_seconds':0.0,'max_seconds':0.0})
+            stats['count'] += 1
+            if failed:
+                stats['errors'] += 1
+            stats['total_seconds'] += seconds
+            stats['max_seconds'] = max(stats['max_seconds'],seconds)
+
+    def summary(self):
+        """Return a dict of the current metrics, suitable for JSON output"""
+        with self._lock:
+            requests = {}
+            for endpoint,stats in self.requests.items():
+                stats = dict(stats)
+                stats['mean_seconds'] = stats['total_seconds']/stats['count']
+                requests[endpoint] = stats
+            return {'uptime_seconds':time()-self.start_time,\
+              'load_seconds':dict(self.load_seconds),\
+              'active_requests':self.active_requests,\
+              'requests':requests}
+
+
+class PredictionRequestHandler(BaseHTTPRequestHandler):
+    """Handle prediction requests against the server's resident tables
+
+    POST /predict and POST /contributions take a BIOM format OTU table as
+    the request body, with options passed in the query string.  GET /metrics
+    returns load and latency metrics as JSON.
+    """
+
+    def log_message(self,format,*args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self,format,*args)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != '/metrics':
+            self.send_error(404,"Unknown endpoint: %s" % url.path)
+            return
+        self._send(200,json.dumps(self.server.metrics.summary()),\
+          'application/json')
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        options = dict((k,v[-1]) for k,v in parse_qs(url.query).items())
+        handlers = {'/predict':self._predict,\
+          '/contributions':self._contributions}
+        if url.path not in handlers:
+            self.send_error(404,"Unknown endpoint: %s" % url.path)
+            return
+
+        metrics = self.server.metrics
+        metrics.request_started()
+        start = time()
+        try:
+            body = self.rfile.read(int(self.headers['Content-Length']))
+            otu_table = parse_biom_table(body)
+            response,content_type = handlers[url.path](otu_table,options)
+            code = 200
+        except (ValueError,KeyError),e:
+            #Problems with the submitted table or options
+            response,content_type,code = str(e),'text/plain',400
+        except Exception,e:
+            response,content_type,code = str(e),'text/plain',500
+        #Record the request before responding, so clients never see
+        #metrics that lag behind their own requests
+        metrics.request_finished(url.path,time()-start,failed=(code != 200))
+        self._send(code,response,content_type)
+
+    def _predict(self,otu_table,options):
+        flag = lambda name: options.get(name,'0') == '1'
+        normalized_otu_table = None
+        if is_prenormalized(self.server.genome_table) and \
+          (flag('accuracy_metrics') or flag('normalize_by_otu')):
+            normalized_otu_table = normalize_by_marker_copy_number(otu_table,\
+              self.server.genome_table)
+        result = run_metagenome_prediction(otu_table,\
+          self.server.genome_table,self.server.variance_table,\
+          with_confidence=flag('with_confidence'),\
+          accuracy_metrics=flag('accuracy_metrics'),\
+          normalize_by_otu=flag('normalize_by_otu'),\
+          normalize_by_function=flag('normalize_by_function'),\
+          normalized_otu_table=normalized_otu_table)
+        for key,value in result.items():
+            if key != 'nsti':
+                result[key] = format_biom_table(value)
+        return json.dumps(result),'application/json'
+
+    def _contributions(self,otu_table,options):
+        limit_to_functions = [f for f in \
+          options.get('limit_to_function','').split(',') if f]
+        partitioned_metagenomes = partition_metagenome_contributions(\
+          otu_table,self.server.genome_table,\
+          limit_to_functions=limit_to_functions,verbose=False)
+        return format_contributions(partitioned_metagenomes),'text/plain'
+
+    def _send(self,code,body,content_type):
+        self.send_response(code)
+        self.send_header('Content-Type',content_type)
+        self.send_header('Content-Length',str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class PredictionServer(ThreadingMixIn, HTTPServer):
+    """HTTP server that keeps genome (and variance) tables resident in memory
+
+    Each request is handled in its own thread, so several OTU tables can
+    be predicted concurrently against the same precalculated tables.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self,server_address,genome_table,variance_table=None,\
+        metrics=None,verbose=False):
+        HTTPServer.__init__(self,server_address,PredictionRequestHandler)
+        self.genome_table = genome_table
+        self.variance_table = variance_table
+        self.metrics = metrics or ServerMetrics()
+        self.verbose = verbose
+
+
+def query_prediction_server(server_url,otu_table_str,endpoint='predict',\
+    **options):
+    """Send an OTU table to a running PredictionServer, returning its response
+
+    server_url -- base url of the server (e.g. http://127.0.0.1:8787)
+    otu_table_str -- a BIOM format OTU table as a JSON string
+    endpoint -- 'predict' or 'contributions'
+    options -- passed to the server in the query string.  Boolean
+      options are sent as 1 or 0.
+
+    For the 'predict' endpoint a dict of BIOM Table objects (and 'nsti'
+    if requested) is returned; for 'contributions' the tab-delimited text.
+    """
+    query = {}
+    for key,value in options.items():
+        if isinstance(value,bool):
+            value = int(value)
+        query[key] = value
+    url = "%s/%s?%s" %(server_url.rstrip('/'),endpoint,urlencode(query))
+    try:
+        response = urlopen(url,otu_table_str).read()
+    except HTTPError,e:
+        raise ValueError("Prediction server could not process request: %s" % e.read())
+
+    if endpoint != 'predict':
+        return response
+
+    result = json.loads(response)
+    for key,value in result.items():
+        if key != 'nsti':
+            result[key] = parse_predicted_table_str(value)
+    return result
+
+def parse_predicted_table_str(biom_str):
+    """Parse a predicted metagenome table sent by a PredictionServer
+
+    Tables such as the lower confidence interval may contain nothing but
+    zeros, which the sparse BIOM parser refuses to load, so these are
+    parsed as dense tables and converted back to the SparseGeneTable
+    returned by the prediction functions.
+    """
+    table = parse_biom_table_str(biom_str,constructor=DenseGeneTable)
+    return table_factory(table._data,table.SampleIds,table.ObservationIds,\
+      table.SampleMetadata,table.ObservationMetadata,constructor=SparseGeneTable)
+
+def get_prediction_server_metrics(server_url):
+    """Return the load/latency metrics of a running PredictionServer as a dict"""
+    return json.loads(urlopen("%s/metrics" % server_url.rstrip('/')).read())
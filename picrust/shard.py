@@ -0,0 +1,341 @@
+#!/usr/bin/env python
+# File created on 18 Oct 2026
+from __future__ import division
+
+__author__ = "Greg Caporaso"
+__copyright__ = "Copyright 2011-2013, The PICRUSt Project"
+__credits__ = ["Greg Caporaso","Jesse Zaneveld","Morgan Langille"]
+__license__ = "GPL"
+__version__ = "1.0.0-dev"
+__maintainer__ = "Greg Caporaso"
+__email__ = "gregcaporaso@gmail.com"
+__status__ = "Development"
+
+import json
+from datetime import datetime
+from multiprocessing import Pool
+from warnings import warn
+from os.path import join, exists, dirname, split, splitext
+from shutil import copyfileobj
+from tempfile import TemporaryFile
+from biom.parse import parse_biom_table
+from picrust.predict_metagenomes import load_data_table,\
+  run_metagenome_prediction, write_prediction_results, CONFIDENCE_LAYERS,\
+  BOOTSTRAP_LAYERS
+from picrust.util import make_output_dir, format_biom_table, file_digest
+
+MANIFEST_FILENAME = 'manifest.json'
+
+def get_shard_sample_ids(sample_ids,num_shards=None,samples_per_shard=None):
+    """Partition sample_ids into contiguous, order-preserving shards
+
+    Exactly one of num_shards or samples_per_shard must be given.  Shards
+    are as even as possible, and never empty, so fewer than num_shards
+    shards are returned if there are fewer samples than that.
+    """
+    if (num_shards is None) == (samples_per_shard is None):
+        raise ValueError("Exactly one of num_shards or samples_per_shard must be provided")
+    sample_ids = list(sample_ids)
+    if samples_per_shard is not None:
+        if samples_per_shard < 1:
+            raise ValueError("samples_per_shard must be at least 1")
+        num_shards = -(-len(sample_ids) // samples_per_shard)
+    elif num_shards < 1:
+        raise ValueError("num_shards must be at least 1")
+    num_shards = min(num_shards,len(sample_ids))
+
+    shards = []
+    start = 0
+    for i in range(num_shards):
+        #the first len % num_shards shards get one extra sample
+        end = start + len(sample_ids)//num_shards + \
+          int(i < len(sample_ids) % num_shards)
+        shards.append(sample_ids[start:end])
+        start = end
+    return shards
+
+def get_shard_id(shard_index):
+    """Return the id (and file base name) of the shard_index-th shard"""
+    return 'shard_%04d' % shard_index
+
+def split_otu_table_by_samples(otu_table_fp,output_dir,num_shards=None,\
+    samples_per_shard=None):
+    """Write the samples of an OTU table to shard OTU tables and a manifest
+
+    Every shard keeps all of the OTUs (and their metadata) of the input
+    table, so predictions for a shard are identical to the predictions
+    for the same samples in the full table.  The manifest (written to
+    output_dir/manifest.json) records the sample ids of each shard, the
+    sample order of the input table and its sha1 digest, and is returned
+    as a dict.
+    """
+    otu_table = parse_biom_table(open(otu_table_fp,'U'))
+    make_output_dir(output_dir)
+
+    shards = []
+    for i,shard_sample_ids in enumerate(get_shard_sample_ids(\
+      otu_table.SampleIds,num_shards,samples_per_shard)):
+        shard_id = get_shard_id(i)
+        in_shard = set(shard_sample_ids)
+        shard_table = otu_table.filterSamples(lambda v,id_,md: id_ in in_shard)
+        shard_fp = shard_id + '.biom'
+        open(join(output_dir,shard_fp),'w').write(format_biom_table(shard_table))
+        shards.append({'id':shard_id,'otu_table':shard_fp,\
+          'sample_ids':list(shard_sample_ids)})
+
+    manifest = {'otu_table':otu_table_fp,\
+      'otu_table_sha1':file_digest(otu_table_fp),\
+      'sample_ids':list(otu_table.SampleIds),'shards':shards}
+    f = open(join(output_dir,MANIFEST_FILENAME),'w')
+    json.dump(manifest,f,indent=1)
+    f.close()
+    return manifest
+
+def load_manifest(manifest_fp):
+    """Load a shard manifest, checking that it covers each sample exactly once
+
+    Warns if the OTU table the shards were split from has changed since
+    (the table is not checked if it no longer exists at the recorded path).
+    """
+    manifest = json.load(open(manifest_fp,'U'))
+    shard_sample_ids = []
+    for shard in manifest['shards']:
+        shard_sample_ids.extend(shard['sample_ids'])
+    if sorted(shard_sample_ids) != sorted(manifest['sample_ids']) or \
+      len(set(shard_sample_ids)) != len(shard_sample_ids):
+        raise ValueError("The shards in %s don't cover each sample exactly once" % manifest_fp)
+    otu_table_fp = manifest['otu_table']
+    if exists(otu_table_fp) and \
+      file_digest(otu_table_fp) != manifest['otu_table_sha1']:
+        warn("%s has changed since it was split into the shards in %s. Split it again with split_otu_table_by_samples.py." \
+          %(otu_table_fp,manifest_fp))
+    return manifest
+
+def get_shard_prediction_fps(prediction_dir,shard_id,accuracy_metrics_fp=None):
+    """Return the prediction filepaths written for a shard, keyed by table name
+
+    Shard predictions are expected to follow the naming of
+    predict_metagenomes.py in batch mode: prediction_dir/<shard id>.biom,
+    with _variances, _upper_CI_95 and _lower_CI_95 (and _bootstrap_*) files
+    alongside it if confidence intervals were calculated, and accuracy metrics in
+    prediction_dir/<shard id>_<accuracy metrics file name>.
+    """
+    fps = {'prediction':join(prediction_dir,shard_id + '.biom')}
+    for layer_name in CONFIDENCE_LAYERS + BOOTSTRAP_LAYERS:
+        fps[layer_name] = join(prediction_dir,"%s_%s.biom" %(shard_id,layer_name))
+    if accuracy_metrics_fp:
+        fps['nsti'] = join(prediction_dir,\
+          "%s_%s" %(shard_id,split(accuracy_metrics_fp)[1]))
+    return fps
+
+def _predict_shard(args):
+    """Predict the metagenomes of one shard (run in a worker process)"""
+    shard_otu_table_fp,output_fp,accuracy_metrics_fp,genome_table_fp,\
+      variance_table_fp,load_precalc_file_in_biom = args
+    otu_table = parse_biom_table(open(shard_otu_table_fp,'U'))
+    load = lambda fp: load_data_table(fp,\
+      load_data_table_in_biom=load_precalc_file_in_biom,\
+      ids_to_load=otu_table.ObservationIds,transpose=True)
+    genome_table = load(genome_table_fp)
+    variance_table = None
+    if variance_table_fp:
+        variance_table = load(variance_table_fp)
+    results = run_metagenome_prediction(otu_table,genome_table,variance_table,\
+      with_confidence=variance_table is not None,\
+      accuracy_metrics=bool(accuracy_metrics_fp))
+    write_prediction_results(results,output_fp,accuracy_metrics_fp)
+    return output_fp
+
+def predict_shards(manifest_fp,prediction_dir,genome_table_fp,\
+    variance_table_fp=None,accuracy_metrics_fp=None,\
+    load_precalc_file_in_biom=False,processes=1):
+    """Predict the metagenomes of each shard in a manifest with local worker processes
+
+    This stands in for running predict_metagenomes.py on each shard on a
+    separate node: each worker loads its own subset of the precalculated
+    tables and writes its results to prediction_dir under the names
+    expected by merge_shard_predictions.  Confidence intervals are
+    calculated if variance_table_fp is given.
+    """
+    manifest = load_manifest(manifest_fp)
+    shard_dir = dirname(manifest_fp)
+    make_output_dir(prediction_dir)
+    jobs = []
+    for shard in manifest['shards']:
+        fps = get_shard_prediction_fps(prediction_dir,shard['id'],\
+          accuracy_metrics_fp)
+        jobs.append((join(shard_dir,shard['otu_table']),fps['prediction'],\
+          fps.get('nsti'),genome_table_fp,variance_table_fp,\
+          load_precalc_file_in_biom))
+    if processes > 1:
+        pool = Pool(processes)
+        try:
+            return pool.map(_predict_shard,jobs)
+        finally:
+            pool.close()
+            pool.join()
+    return map(_predict_shard,jobs)
+
+def merge_shard_tables(manifest,shard_table_fps,output_fh):
+    """Stream the BIOM tables predicted for each shard into one table
+
+    manifest -- a shard manifest, as returned by load_manifest
+    shard_table_fps -- the BIOM table predicted for each shard in the
+      manifest, in the same order
+    output_fh -- open file to write the merged sparse BIOM table to
+
+    Only one shard table is held in memory at a time: its nonzero values
+    are written as soon as it is read, with their columns moved to the
+    sample order of the original OTU table.  All shard tables must have
+    the same observations (as they do when predicted against the same
+    precalculated table), and the merged table keeps their metadata.
+    Layers written by format_layered_prediction are merged too.
+    """
+    sample_ids = manifest['sample_ids']
+    sample_idxs = dict((sample_id,i) for i,sample_id in enumerate(sample_ids))
+    sample_metadata = [None]*len(sample_ids)
+    layer_fhs = {}
+    rows = None
+    have_written = False
+
+    for shard,shard_table_fp in zip(manifest['shards'],shard_table_fps):
+        table = json.load(open(shard_table_fp,'U'))
+        columns = table['columns']
+        shard_sample_ids = [c['id'] for c in columns]
+        if shard_sample_ids != shard['sample_ids']:
+            raise ValueError("%s doesn't contain the samples of %s, in order" \
+              %(shard_table_fp,shard['id']))
+
+        if rows is None:
+            rows = table['rows']
+            header = table
+            output_fh.write('{"id": %s,"format": %s,"format_url": %s,' \
+              '"type": %s,"generated_by": %s,"date": %s,' \
+              '"matrix_type": "sparse","matrix_element_type": %s,' \
+              '"shape": [%d, %d],"data": [' %(json.dumps(header['id']),\
+              json.dumps(header['format']),json.dumps(header['format_url']),\
+              json.dumps(header['type']),json.dumps(header['generated_by']),\
+              json.dumps(datetime.now().isoformat()),\
+              json.dumps(header['matrix_element_type']),\
+              len(rows),len(sample_ids)))
+            layer_names = sorted(table.get('layers',{}))
+            for layer_name in layer_names:
+                layer_fhs[layer_name] = TemporaryFile()
+        elif table['rows'] != rows:
+            raise ValueError("%s has different observations than the other shards" \
+              % shard_table_fp)
+        elif sorted(table.get('layers',{})) != layer_names:
+            raise ValueError("%s has different layers than the other shards" \
+              % shard_table_fp)
+
+        col_idxs = [sample_idxs[sample_id] for sample_id in shard_sample_ids]
+        for c,column in zip(col_idxs,columns):
+            sample_metadata[c] = column['metadata']
+
+        if table['matrix_type'] == 'dense':
+            entries = [[r,c,v] for r,row in enumerate(table['data']) \
+              for c,v in enumerate(row) if v != 0]
+        else:
+            entries = table['data']
+        formatted = _format_shard_entries(entries,col_idxs)
+        if formatted:
+            if have_written:
+                output_fh.write(',')
+            output_fh.write(formatted)
+            have_written = True
+
+        for layer_name in layer_names:
+            formatted = _format_shard_entries(table['layers'][layer_name],col_idxs)
+            layer_fh = layer_fhs[layer_name]
+            if formatted:
+                if layer_fh.tell():
+                    layer_fh.write(',')
+                layer_fh.write(formatted)
+
+    if rows is None:
+        raise ValueError("No shard tables to merge")
+
+    output_fh.write('],"rows": [')
+    output_fh.write(','.join(['{"id": %s, "metadata": %s}' \
+      %(json.dumps(row['id']),json.dumps(row['metadata'])) for row in rows]))
+    output_fh.write('],"columns": [')
+    output_fh.write(','.join(['{"id": %s, "metadata": %s}' \
+      %(json.dumps(sample_id),json.dumps(md)) for sample_id,md in \
+      zip(sample_ids,sample_metadata)]))
+    output_fh.write(']')
+    if layer_fhs:
+        output_fh.write(', "layers": {')
+        for i,layer_name in enumerate(layer_names):
+            if i:
+                output_fh.write(', ')
+            output_fh.write('%s: [' % json.dumps(layer_name))
+            layer_fh = layer_fhs[layer_name]
+            layer_fh.seek(0)
+            copyfileobj(layer_fh,output_fh)
+            layer_fh.close()
+            output_fh.write(']')
+        output_fh.write('}')
+    output_fh.write('}')
+
+def _format_shard_entries(entries,col_idxs):
+    """Return sparse [row, column, value] entries of a shard, moved to col_idxs, as JSON"""
+    return ','.join(['[%d,%d,%r]' %(r,col_idxs[c],v) for r,c,v in entries])
+
+def merge_nsti_files(manifest,shard_nsti_fps,output_fp):
+    """Merge the accuracy metrics of each shard, in the original sample order"""
+    lines = {}
+    header = None
+    for shard_nsti_fp in shard_nsti_fps:
+        f = open(shard_nsti_fp,'U')
+        header = f.readline()
+        for line in f:
+            if line.strip():
+                lines[line.split('\t')[0]] = line
+        f.close()
+    missing = [s for s in manifest['sample_ids'] if s not in lines]
+    if missing:
+        raise ValueError("No accuracy metrics for samples: %s" % ', '.join(missing))
+    f = open(output_fp,'w')
+    f.write(header)
+    for sample_id in manifest['sample_ids']:
+        f.write(lines[sample_id])
+    f.close()
+
+def merge_shard_predictions(manifest_fp,prediction_dir,output_fp,\
+    accuracy_metrics_fp=None,verbose=False):
+    """Merge the predictions of each shard in a manifest into output_fp
+
+    The shard predictions are found with get_shard_prediction_fps.  If the
+    shards have variance and confidence interval tables, they are merged
+    into the matching output_fp based files (as written by
+    predict_metagenomes.py), and if accuracy_metrics_fp is given the
+    accuracy metrics are merged into it.
+    """
+    manifest = load_manifest(manifest_fp)
+    shard_fps = [get_shard_prediction_fps(prediction_dir,shard['id'],\
+      accuracy_metrics_fp) for shard in manifest['shards']]
+
+    output_path,output_filename = split(output_fp)
+    base_output_filename,ext = splitext(output_filename)
+    output_fps = {'prediction':output_fp}
+    for layer_name in CONFIDENCE_LAYERS + BOOTSTRAP_LAYERS:
+        if exists(shard_fps[0][layer_name]):
+            output_fps[layer_name] = join(output_path,\
+              "%s_%s%s" %(base_output_filename,layer_name,ext))
+
+    for name in ['prediction'] + CONFIDENCE_LAYERS + BOOTSTRAP_LAYERS:
+        if name not in output_fps:
+            continue
+        if verbose:
+            print "Merging %i shard %s tables into: %s" \
+              %(len(shard_fps),name,output_fps[name])
+        output_fh = open(output_fps[name],'w')
+        merge_shard_tables(manifest,[fps[name] for fps in shard_fps],output_fh)
+        output_fh.close()
+
+    if accuracy_metrics_fp:
+        if verbose:
+            print "Merging shard accuracy metrics into: %s" % accuracy_metrics_fp
+        merge_nsti_files(manifest,[fps['nsti'] for fps in shard_fps],\
+          accuracy_metrics_fp)
+    return output_fps
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# File created on 18 Oct 2026
+from __future__ import division
+
+__author__ = "Greg Caporaso"
+__copyright__ = "Copyright 2011-2013, The PICRUSt Project"
+__credits__ = ["Greg Caporaso","Jesse Zaneveld","Morgan Langille"]
+__license__ = "GPL"
+__version__ = "1.0.0-dev"
+__maintainer__ = "Greg Caporaso"
+__email__ = "gregcaporaso@gmail.com"
+__status__ = "Development"
+
+import json
+from numpy import array, asarray, around, dot, zeros, arange, repeat, cumsum,\
+  bincount, searchsorted, concatenate, int64
+from picrust.util import get_sparse_coordinates
+
+class SamplePredictor(object):
+    """Predict metagenomes one sample at a time from a resident genome table
+
+    genome_table -- BIOM Table object of predicted gene counts, with
+      functions as observations and OTUs as samples (as loaded by
+      load_data_table with transpose=True)
+    accuracy_metrics -- if True, also calculate the weighted NSTI of each
+      sample, which requires NSTI values in the OTU metadata
+
+    Only the nonzero gene counts are kept, grouped by OTU (as the columns
+    of a compressed sparse column matrix), so the predictor never holds a
+    dense array of every function in every OTU, and each prediction only
+    gathers the counts of the OTUs in one sample.
+    """
+
+    def __init__(self,genome_table,accuracy_metrics=False):
+        if genome_table._biom_matrix_type == 'sparse':
+            rows,cols,values = get_sparse_coordinates(genome_table._data)
+        else:
+            data = asarray(genome_table._data,dtype=float)
+            rows,cols = data.nonzero()
+            values = data[rows,cols]
+        nsti = None
+        if accuracy_metrics:
+            nsti = [float(md['NSTI']) for md in genome_table.SampleMetadata]
+        self._index_counts(genome_table.ObservationIds,genome_table.SampleIds,\
+          rows,cols,values,accuracy_metrics,nsti)
+
+    @classmethod
+    def from_precalc_blocks(cls,reader,accuracy_metrics=False):
+        """Return a SamplePredictor for the blocks of a PrecalcBlockReader
+
+        Only the nonzero counts of each block are kept as it is parsed, so
+        the whole table is never held as a dense array.
+        """
+        otu_ids = []
+        function_idxs = []
+        otu_idxs = []
+        values = []
+        nsti = []
+        for block_otu_ids,data,col_meta in reader:
+            block_otu_idxs,block_function_idxs = data.nonzero()
+            otu_idxs.append(block_otu_idxs + len(otu_ids))
+            function_idxs.append(block_function_idxs)
+            values.append(data[block_otu_idxs,block_function_idxs])
+            otu_ids.extend(block_otu_ids)
+            if accuracy_metrics:
+                nsti.extend(float(md['NSTI']) for md in col_meta)
+        empty_idxs = [zeros(0,dtype=int64)]
+        predictor = cls.__new__(cls)
+        predictor._index_counts(reader.trait_ids,otu_ids,\
+          concatenate(function_idxs or empty_idxs),\
+          concatenate(otu_idxs or empty_idxs),\
+          concatenate(values or [zeros(0)]),accuracy_metrics,nsti)
+        return predictor
+
+    def _index_counts(self,function_ids,otu_ids,function_idxs,otu_idxs,\
+        values,accuracy_metrics,nsti):
+        """Store the nonzero counts (function_idxs,otu_idxs,values) grouped by OTU"""
+        self.function_ids = list(function_ids)
+        self.otu_ids = list(otu_ids)
+        self.accuracy_metrics = accuracy_metrics
+        self._otu_idxs = dict((otu_id,i) for i,otu_id in enumerate(otu_ids))
+        order = otu_idxs.argsort(kind='mergesort')
+        #the counts of OTU i are at _offsets[i]:_offsets[i+1]
+        self._offsets = searchsorted(otu_idxs.take(order),\
+          arange(len(self.otu_ids)+1)).astype(int64)
+        self._function_idxs = function_idxs.take(order).astype(int64)
+        self._counts = values.take(order).astype(float)
+        self._nsti = None
+        if accuracy_metrics:
+            self._nsti = array(nsti,dtype=float)
+
+    def predict(self,otu_counts):
+        """Return the predicted function counts for one sample, and its NSTI
+
+        otu_counts -- dict of OTU id to count.  OTUs with zero counts are
+          ignored.
+
+        Function counts are rounded, as by predict_metagenomes, and are in
+        the order of function_ids.  The NSTI is None unless the predictor
+        calculates accuracy metrics.  Raises ValueError if any OTU is not
+        in the genome table.
+        """
+        otu_idxs = []
+        counts = []
+        unknown_otus = []
+        for otu_id,count in otu_counts.items():
+            if not count:
+                continue
+            if otu_id not in self._otu_idxs:
+                unknown_otus.append(otu_id)
+                continue
+            otu_idxs.append(self._otu_idxs[otu_id])
+            counts.append(count)
+        if unknown_otus:
+            raise ValueError("%i OTU ids were not found in the precalculated file, e.g.: %s" \
+              %(len(unknown_otus),', '.join(unknown_otus[:5])))
+
+        counts = array(counts,dtype=float)
+        otu_idxs = array(otu_idxs,dtype=int64)
+        starts = self._offsets.take(otu_idxs)
+        lengths = self._offsets.take(otu_idxs+1) - starts
+        n_entries = lengths.sum()
+        prediction = zeros(len(self.function_ids))
+        if n_entries:
+            #positions of the nonzero counts of each of the sample's OTUs
+            entry_idxs = arange(n_entries) + \
+              repeat(starts - (cumsum(lengths) - lengths),lengths)
+            prediction += bincount(self._function_idxs.take(entry_idxs),\
+              weights=self._counts.take(entry_idxs)*repeat(counts,lengths),\
+              minlength=len(self.function_ids))
+        prediction = around(prediction)
+        nsti = None
+        if self._nsti is not None:
+            nsti = float(dot(self._nsti.take(otu_idxs),counts)/counts.sum())
+        return prediction,nsti
+
+def iter_json_samples(lines):
+    """Yield sample_id,otu_counts from JSON lines
+
+    Each non-blank line is an object with the sample's id under
+    'sample_id' and its OTU counts under 'counts', e.g.
+    {"sample_id": "S1", "counts": {"OTU1": 3, "OTU2": 1}}
+    """
+    for line in lines:
+        if not line.strip():
+            continue
+        sample = json.loads(line)
+        yield str(sample['sample_id']),sample['counts']
+
+def iter_tab_samples(lines):
+    """Yield sample_id,otu_counts from tab-delimited rows
+
+    The first line is a header of OTU ids (e.g. '#SampleID\\tOTU1\\tOTU2'),
+    and each following line holds the id of one sample and its count of
+    each OTU.
+    """
+    otu_ids = None
+    for line in lines:
+        if not line.strip():
+            continue
+        fields = line.rstrip('\n').split('\t')
+        if otu_ids is None:
+            otu_ids = fields[1:]
+            continue
+        if len(fields) != len(otu_ids) + 1:
+            raise ValueError("Expected %i OTU counts for sample %s, but found %i" \
+              %(len(otu_ids),fields[0],len(fields)-1))
+        yield fields[0],dict(zip(otu_ids,map(float,fields[1:])))
+
+def format_tab_header(function_ids,accuracy_metrics=False):
+    """Return the header line of tab-delimited streamed predictions"""
+    fields = ['#SampleID'] + list(function_ids)
+    if accuracy_metrics:
+        fields.append('NSTI')
+    return '\t'.join(fields) + '\n'
+
+def format_tab_prediction(sample_id,prediction,nsti=None):
+    """Return the predicted metagenome of one sample as a tab-delimited line"""
+    fields = [sample_id] + map(str,prediction.tolist())
+    if nsti is not None:
+        fields.append(str(nsti))
+    return '\t'.join(fields) + '\n'
+
+def format_json_prediction(sample_id,function_ids,prediction,nsti=None):
+    """Return the predicted metagenome of one sample as a JSON line
+
+    Only the functions with nonzero predicted counts are included.
+    """
+    result = {'sample_id':sample_id,'prediction':dict((function_id,value) \
+      for function_id,value in zip(function_ids,prediction.tolist()) if value)}
+    if nsti is not None:
+        result['nsti'] = nsti
+    return json.dumps(result,sort_keys=True) + '\n'
+
+def stream_predictions(predictor,lines,output_fh,input_format='tab',\
+    error_fh=None):
+    """Predict and write the metagenome of each sample read from lines
+
+    predictor -- a SamplePredictor
+    lines -- iterable of input lines, in 'json' or 'tab' input_format (see
+      iter_json_samples and iter_tab_samples)
+    output_fh -- file each prediction is written (and flushed) to as soon
+      as its sample has been read, in the same format as the input
+    error_fh -- if provided, samples that can't be predicted (e.g. because
+      they contain unknown OTUs) are reported here and skipped, rather
+      than raising a ValueError
+
+    Returns the number of samples predicted.
+    """
+    if input_format == 'json':
+        samples = iter_json_samples(lines)
+    elif input_format == 'tab':
+        samples = iter_tab_samples(lines)
+        output_fh.write(format_tab_header(predictor.function_ids,\
+          predictor.accuracy_metrics))
+        output_fh.flush()
+    else:
+        raise ValueError("Unknown input format: %s" % input_format)
+
+    n_predicted = 0
+    for sample_id,otu_counts in samples:
+        try:
+            prediction,nsti = predictor.predict(otu_counts)
+        except ValueError,e:
+            if error_fh is None:
+                raise
+            error_fh.write("Skipping sample %s: %s\n" %(sample_id,e))
+            error_fh.flush()
+            continue
+        if input_format == 'json':
+            output_fh.write(format_json_prediction(sample_id,\
+              predictor.function_ids,prediction,nsti))
+        else:
+            output_fh.write(format_tab_prediction(sample_id,prediction,nsti))
+        output_fh.flush()
+        n_predicted += 1
+    return n_predicted
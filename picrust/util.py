@@ -14,16 +14,25 @@ __status__ = "Development"
 from os.path import abspath, dirname, isdir
 from os import mkdir,makedirs
 from cogent.core.tree import PhyloNode, TreeError
-from numpy import array,asarray
+from numpy import array,asarray,zeros,empty,repeat,arange,diff,fromstring,\
+  searchsorted,int64,uint32
 from biom.table import SparseOTUTable, DenseOTUTable, SparsePathwayTable, \
   DensePathwayTable, SparseFunctionTable, DenseFunctionTable, \
   SparseOrthologTable, DenseOrthologTable, SparseGeneTable, \
   DenseGeneTable, SparseMetaboliteTable, DenseMetaboliteTable,\
-  SparseTaxonTable, DenseTaxonTable, table_factory
+  SparseTaxonTable, DenseTaxonTable, table_factory, SparseObj,\
+  list_list_to_sparseobj
+from biom import __version__ as biom_version
 from biom.parse import parse_biom_table,parse_biom_table_str, convert_biom_to_table, \
   convert_table_to_biom
 from subprocess import Popen, PIPE, STDOUT
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+from threading import Thread
+from Queue import Queue, Full
 import StringIO
+import sys
+from hashlib import sha1
 
 def make_sample_transformer(scaling_factors):
     def transform_sample(sample_value,sample_id,sample_metadata):
@@ -39,16 +48,13 @@ def scale_metagenomes(metagenome_table,scaling_factors):
     new_metagenome_table = metagenome_table.transformSamples(transform_sample_f)
     return new_metagenome_table
 
-def convert_precalc_to_biom(precalc_in, ids_to_load=None,transpose=True,md_prefix='metadata_'):
-    """Loads PICRUSTs tab-delimited version of the precalc file and outputs a BIOM object"""
-    
-    #if given a string convert to a filehandle
-    if type(precalc_in) ==str or type(precalc_in) == unicode:
-        fh = StringIO.StringIO(precalc_in)
-    else:
-        fh=precalc_in
+def parse_precalc_header(fh,md_prefix='metadata_'):
+    """Read the header of a precalc file, returning trait ids and metadata columns
 
-    #first line has to be header
+    Returns trait_ids,col_meta_locs,end_of_data where col_meta_locs maps
+    each per-OTU metadata name to its column index, and the trait data ends
+    before column end_of_data.
+    """
     header_ids=fh.readline().strip().split('\t')
     
     col_meta_locs={}
@@ -58,6 +64,67 @@ def convert_precalc_to_biom(precalc_in, ids_to_load=None,transpose=True,md_prefi
     
     end_of_data=len(header_ids)-len(col_meta_locs)
     trait_ids = header_ids[1:end_of_data]
+    return trait_ids,col_meta_locs,end_of_data
+
+def file_digest(fp,block_size=2**20):
+    """Return the sha1 hex digest of the contents of fp"""
+    digest = sha1()
+    f = open(fp,'rb')
+    block = f.read(block_size)
+    while block:
+        digest.update(block)
+        block = f.read(block_size)
+    f.close()
+    return digest.hexdigest()
+
+def select_precalc_traits(trait_ids,functions_to_load=None):
+    """Return the trait ids to load and their indices among trait_ids
+
+    Traits are kept in file order.  Raises ValueError if any of
+    functions_to_load are not in trait_ids.
+    """
+    if functions_to_load is None:
+        return trait_ids,range(len(trait_ids))
+    functions_to_load = set(map(str,functions_to_load))
+    trait_idxs = [i for i,trait_id in enumerate(trait_ids) if trait_id in functions_to_load]
+    if len(trait_idxs) != len(functions_to_load):
+        unknown = functions_to_load.difference(trait_ids)
+        raise ValueError,"One or more function ids were not found in the precalculated file!\nExample of (the {0}) unknown function ids: {1}".format(len(unknown),', '.join(list(unknown)[:5]))
+    return [trait_ids[i] for i in trait_idxs],trait_idxs
+
+def _add_precalc_trait_metadata(line,row_meta,trait_idxs,md_prefix='metadata_'):
+    """Add the per-trait metadata on a precalc metadata line to row_meta"""
+    fields = line.strip().split('\t')
+    row_id=fields[0]
+    #determine type of metadata (this may not be perfect)
+    metadata_type=determine_metadata_type(line)
+    for idx,trait_idx in enumerate(trait_idxs):
+        row_meta[idx][row_id[len(md_prefix):]]=parse_metadata_field(fields[trait_idx+1],metadata_type)
+
+def check_precalc_ids_loaded(otu_ids,ids_to_load):
+    """Raise ValueError if no OTUs were loaded, or if ids_to_load remain"""
+    if not otu_ids:
+        raise ValueError,"No OTUs match identifiers in precalculated file. PICRUSt requires an OTU table reference/closed picked against GreenGenes.\nExample of the first 5 OTU ids from your table: {0}".format(', '.join(list(ids_to_load)[:5]))
+
+    if ids_to_load:
+       raise ValueError,"One or more OTU ids were not found in the precalculated file!\nAre you using the correct --gg_version?\nExample of (the {0}) unknown OTU ids: {1}".format(len(ids_to_load),', '.join(list(ids_to_load)[:5]))
+
+def convert_precalc_to_biom(precalc_in, ids_to_load=None,transpose=True,md_prefix='metadata_',functions_to_load=None):
+    """Loads PICRUSTs tab-delimited version of the precalc file and outputs a BIOM object
+
+    If functions_to_load is provided, only the values of those traits are
+    converted and loaded.
+    """
+    
+    #if given a string convert to a filehandle
+    if type(precalc_in) ==str or type(precalc_in) == unicode:
+        fh = StringIO.StringIO(precalc_in)
+    else:
+        fh=precalc_in
+
+    #first line has to be header
+    trait_ids,col_meta_locs,end_of_data=parse_precalc_header(fh,md_prefix)
+    trait_ids,trait_idxs=select_precalc_traits(trait_ids,functions_to_load)
    
     col_meta=[]
     row_meta=[{} for i in trait_ids]
@@ -75,15 +142,14 @@ def convert_precalc_to_biom(precalc_in, ids_to_load=None,transpose=True,md_prefi
         row_id=fields[0]
         if(row_id.startswith(md_prefix)):
             #handle metadata
-            
-            #determine type of metadata (this may not be perfect)
-            metadata_type=determine_metadata_type(line)
-            for idx,trait_name in enumerate(trait_ids):
-                row_meta[idx][row_id[len(md_prefix):]]=parse_metadata_field(fields[idx+1],metadata_type)
+            _add_precalc_trait_metadata(line,row_meta,trait_idxs,md_prefix)
 
         elif load_all_ids or (row_id in set(ids_to_load)):
             otu_ids.append(row_id)
-            matching.append(map(float,fields[1:end_of_data]))
+            if functions_to_load is None:
+                matching.append(map(float,fields[1:end_of_data]))
+            else:
+                matching.append([float(fields[i+1]) for i in trait_idxs])
 
             #add metadata
             col_meta_dict={}
@@ -94,11 +160,7 @@ def convert_precalc_to_biom(precalc_in, ids_to_load=None,transpose=True,md_prefi
             if not load_all_ids:
                 ids_to_load.remove(row_id)
 
-    if not otu_ids:
-        raise ValueError,"No OTUs match identifiers in precalculated file. PICRUSt requires an OTU table reference/closed picked against GreenGenes.\nExample of the first 5 OTU ids from your table: {0}".format(', '.join(list(ids_to_load)[:5]))
-
-    if ids_to_load:
-       raise ValueError,"One or more OTU ids were not found in the precalculated file!\nAre you using the correct --gg_version?\nExample of (the {0}) unknown OTU ids: {1}".format(len(ids_to_load),', '.join(list(ids_to_load)[:5]))
+    check_precalc_ids_loaded(otu_ids,ids_to_load)
         
     #note that we transpose the data before making biom obj
     if transpose:
@@ -106,6 +168,266 @@ def convert_precalc_to_biom(precalc_in, ids_to_load=None,transpose=True,md_prefi
     else:
         return table_factory(asarray(matching),trait_ids,otu_ids,row_meta,col_meta,constructor=DenseGeneTable)
 
+def parse_precalc_trait_metadata(precalc_in,md_prefix='metadata_'):
+    """Return the ids and metadata of the traits in a precalc file
+
+    Returns a list of (trait id, metadata dict) tuples.  Only the header
+    and trait metadata lines are parsed.
+    """
+    if type(precalc_in) ==str or type(precalc_in) == unicode:
+        fh = StringIO.StringIO(precalc_in)
+    else:
+        fh=precalc_in
+
+    trait_ids,col_meta_locs,end_of_data=parse_precalc_header(fh,md_prefix)
+    row_meta=[{} for i in trait_ids]
+    for line in fh:
+        if line.startswith(md_prefix):
+            _add_precalc_trait_metadata(line,row_meta,range(len(trait_ids)),md_prefix)
+    return zip(trait_ids,row_meta)
+
+def iter_line_blocks(fh,block_size=2**22):
+    """Yield blocks of about block_size characters from fh, split between lines"""
+    while True:
+        block = fh.read(block_size)
+        if not block:
+            return
+        if not block.endswith('\n'):
+            block += fh.readline()
+        yield block
+
+def parse_precalc_block(args):
+    """Parse a line-aligned block of the body of a precalc file
+
+    args is (block,n_traits,col_meta_locs,end_of_data,ids_to_load,md_prefix,
+    trait_idxs), packed into a tuple so this can be mapped over a
+    multiprocessing.Pool.  If trait_idxs is not None only those traits are
+    returned.
+    Trait metadata lines are returned unparsed, so they can be handled in
+    file order.  Returns otu_ids,data,col_meta,metadata_lines.
+    """
+    block,n_traits,col_meta_locs,end_of_data,ids_to_load,md_prefix,trait_idxs = args
+    otu_ids=[]
+    numeric_fields=[]
+    col_meta=[]
+    metadata_lines=[]
+    n_col_meta=len(col_meta_locs)
+    for line in block.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        row_id,rest = line.split('\t',1)
+        if row_id.startswith(md_prefix):
+            metadata_lines.append(line)
+        elif ids_to_load is None or row_id in ids_to_load:
+            otu_ids.append(row_id)
+            if n_col_meta:
+                fields = rest.rsplit('\t',n_col_meta)
+                numeric_fields.append(fields[0])
+                #metadata columns follow the data columns
+                col_meta.append(dict((meta_name,fields[loc-end_of_data+1])\
+                  for meta_name,loc in col_meta_locs.items()))
+            else:
+                numeric_fields.append(rest)
+                col_meta.append({})
+
+    #convert all of the numbers in the block at once
+    if numeric_fields:
+        data = fromstring('\t'.join(numeric_fields),sep='\t')
+    else:
+        data = empty(0)
+    if data.size != len(otu_ids)*n_traits:
+        raise ValueError,"Could not parse the trait values for all OTUs in the precalculated file. Is each value numeric?"
+    data = data.reshape((len(otu_ids),n_traits))
+    if trait_idxs is not None:
+        data = data.take(trait_idxs,axis=1)
+    return otu_ids,data,col_meta,metadata_lines
+
+class PrecalcBlockReader(object):
+    """Parse the body of a tab-delimited precalc file in blocks, ahead of their use
+
+    Creating a reader parses the header and starts a background thread
+    that reads (and, for gzipped files, decompresses) line-aligned blocks
+    of about block_size characters, and hands each one to a pool of
+    processes (or, if processes is 1, a background thread) to be parsed.
+    Iterating over the reader yields otu_ids,data,col_meta for each block
+    in file order, where data has a row per OTU and a column per trait,
+    while the following blocks are read and parsed.  The parsed blocks
+    wait in a queue of at most max_blocks_ahead blocks, so memory use stays
+    bounded however slowly the blocks are consumed.
+
+    trait_ids are available as soon as the reader is created.  row_meta
+    (the per-trait metadata) and otu_ids are complete once every block
+    has been read, at which point a ValueError is raised if any of
+    ids_to_load were not found.
+    """
+
+    def __init__(self,precalc_in,ids_to_load=None,md_prefix='metadata_',\
+        processes=2,block_size=2**22,functions_to_load=None,max_blocks_ahead=None):
+        if type(precalc_in) ==str or type(precalc_in) == unicode:
+            fh = StringIO.StringIO(precalc_in)
+        else:
+            fh=precalc_in
+
+        self.md_prefix = md_prefix
+        trait_ids,col_meta_locs,end_of_data=parse_precalc_header(fh,md_prefix)
+        self.col_meta_locs = col_meta_locs
+        n_traits = len(trait_ids)
+        self.trait_ids,self.trait_idxs=select_precalc_traits(trait_ids,\
+          functions_to_load)
+        if ids_to_load:
+            self.ids_to_load=set(ids_to_load)
+        else:
+            self.ids_to_load=None
+        self.otu_ids=[]
+        self.row_meta=[{} for i in self.trait_ids]
+
+        if functions_to_load is None:
+            block_trait_idxs = None
+        else:
+            block_trait_idxs = self.trait_idxs
+        self._block_args = (n_traits,col_meta_locs,end_of_data,\
+          self.ids_to_load,md_prefix,block_trait_idxs)
+        if processes > 1:
+            self._pool = Pool(processes)
+        else:
+            self._pool = ThreadPool(1)
+        if max_blocks_ahead is None:
+            max_blocks_ahead = 2*processes
+        self._queue = Queue(max_blocks_ahead)
+        self._stopped = False
+        self._reader = Thread(target=self._read_blocks,\
+          args=(iter_line_blocks(fh,block_size),))
+        self._reader.daemon = True
+        self._reader.start()
+
+    def _queue_item(self,item):
+        """Put item on the queue once there is room, unless iteration stopped
+
+        Returns False if iteration stopped before there was room.
+        """
+        while not self._stopped:
+            try:
+                self._queue.put(item,timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def _read_blocks(self,blocks):
+        """Read blocks and queue them to be parsed (run in a background thread)
+
+        The end of the file is queued as None, and an error while reading
+        as the tuple returned by sys.exc_info().
+        """
+        try:
+            for block in blocks:
+                parsed_block = self._pool.apply_async(parse_precalc_block,\
+                  ((block,)+self._block_args,))
+                if not self._queue_item(parsed_block):
+                    return
+        except:
+            self._queue_item(sys.exc_info())
+            return
+        self._queue_item(None)
+
+    def __iter__(self):
+        try:
+            while True:
+                parsed_block = self._queue.get()
+                if parsed_block is None:
+                    break
+                if type(parsed_block) == tuple:
+                    raise parsed_block[0],parsed_block[1],parsed_block[2]
+                otu_ids,data,col_meta,metadata_lines = parsed_block.get()
+                self.otu_ids.extend(otu_ids)
+                for line in metadata_lines:
+                    _add_precalc_trait_metadata(line,self.row_meta,\
+                      self.trait_idxs,self.md_prefix)
+                yield otu_ids,data,col_meta
+        except:
+            self._stopped = True
+            self._pool.terminate()
+            raise
+        self._pool.close()
+        self._pool.join()
+
+        ids_to_load = self.ids_to_load
+        if ids_to_load is not None:
+            ids_to_load = ids_to_load.difference(self.otu_ids)
+        check_precalc_ids_loaded(self.otu_ids,ids_to_load)
+
+def convert_precalc_to_biom_in_parallel(precalc_in,ids_to_load=None,\
+    transpose=True,md_prefix='metadata_',processes=2,block_size=2**22,\
+    functions_to_load=None):
+    """Load a tab-delimited precalc file, parsing blocks of lines in parallel
+
+    Equivalent to convert_precalc_to_biom.  The (decompressed) file is split
+    into line-aligned blocks of about block_size characters, which are
+    parsed by a pool of processes with the numeric fields of each block
+    converted in a single call (see PrecalcBlockReader).  The parsed blocks
+    are then copied, in file order, into one preallocated data matrix.
+    """
+    reader = PrecalcBlockReader(precalc_in,ids_to_load,md_prefix=md_prefix,\
+      processes=processes,block_size=block_size,\
+      functions_to_load=functions_to_load)
+    parsed_blocks = list(reader)
+    otu_ids = reader.otu_ids
+    trait_ids = reader.trait_ids
+    row_meta = reader.row_meta
+    col_meta = []
+    for block_otu_ids,block_data,block_col_meta in parsed_blocks:
+        col_meta.extend(block_col_meta)
+
+    if transpose:
+        data = empty((len(trait_ids),len(otu_ids)))
+    else:
+        data = empty((len(otu_ids),len(trait_ids)))
+    start = 0
+    while parsed_blocks:
+        #free each block as soon as it has been copied
+        block_data = parsed_blocks.pop(0)[1]
+        end = start + len(block_data)
+        if transpose:
+            data[:,start:end] = block_data.T
+        else:
+            data[start:end] = block_data
+        start = end
+
+    if transpose:
+        return table_factory(data,otu_ids,trait_ids,col_meta,row_meta,constructor=DenseGeneTable)
+    else:
+        return table_factory(data,trait_ids,otu_ids,row_meta,col_meta,constructor=DenseGeneTable)
+
+class BackgroundCall(Thread):
+    """Call function(*args,**kwargs) in a background thread
+
+    result() waits for the call to finish, and returns its result or
+    re-raises the exception it raised.  Used to overlap loading tables
+    with other work.
+    """
+
+    def __init__(self,function,*args,**kwargs):
+        Thread.__init__(self)
+        self.daemon = True
+        self._call = (function,args,kwargs)
+        self._result = None
+        self._exc_info = None
+        self.start()
+
+    def run(self):
+        function,args,kwargs = self._call
+        try:
+            self._result = function(*args,**kwargs)
+        except:
+            self._exc_info = sys.exc_info()
+
+    def result(self):
+        self.join()
+        if self._exc_info:
+            raise self._exc_info[0],self._exc_info[1],self._exc_info[2]
+        return self._result
+
 
 def convert_biom_to_precalc(biom_in):
     """Converts a biom file into a PICRUSt precalculated tab-delimited file """
@@ -347,6 +669,114 @@ def format_biom_table(biom_table):
     generated_by_str = "PICRUSt " + __version__
     return biom_table.getBiomFormatJsonString(generated_by_str)
 
+def get_table_data_array(biom_table,observation_idxs=None,sample_idxs=None):
+    """Return the data of a biom-format Table object as a dense numpy array
+
+    Rows are observations and columns are samples.  Sparse tables are filled
+    from their nonzero entries, rather than one observation at a time.
+
+    observation_idxs, sample_idxs -- if provided, only these rows and/or
+      columns (without repeats) are returned, in the order given.  Only the selected part of
+      a sparse table is ever made dense.
+    """
+    if biom_table._biom_matrix_type == 'dense':
+        data = asarray(biom_table._data,dtype=float)
+        if observation_idxs is not None:
+            data = data.take(observation_idxs,axis=0)
+        if sample_idxs is not None:
+            data = data.take(sample_idxs,axis=1)
+        return data
+
+    rows,cols,values = get_sparse_coordinates(biom_table._data)
+    n_rows,n_cols = biom_table._data.shape
+    if observation_idxs is not None:
+        rows,cols,values = select_coordinates(rows,n_rows,observation_idxs,\
+          cols,values)
+        n_rows = len(observation_idxs)
+    if sample_idxs is not None:
+        cols,rows,values = select_coordinates(cols,n_cols,sample_idxs,\
+          rows,values)
+        n_cols = len(sample_idxs)
+
+    data = zeros((n_rows,n_cols))
+    data[rows,cols] = values
+    return data
+
+#biom versions whose CSMat backend get_sparse_coordinates and
+#sparse_matrix_from_coordinates read and write directly.  Other versions
+#and backends go through biom's public interface.
+CSMAT_LAYOUT_BIOM_VERSIONS = ['1.3.1']
+
+def _has_known_csmat_layout(sparse_data):
+    """Return True if sparse_data is a CSMat whose private arrays are known"""
+    return biom_version in CSMAT_LAYOUT_BIOM_VERSIONS and \
+      sparse_data.__class__.__name__ == 'CSMat'
+
+def get_sparse_coordinates(sparse_data):
+    """Return row indices, column indices and values of a sparse matrix's nonzero entries"""
+    if not _has_known_csmat_layout(sparse_data):
+        items = sparse_data.items()
+        rows = array([row for (row,col),value in items],dtype=int)
+        cols = array([col for (row,col),value in items],dtype=int)
+        values = array([value for (row,col),value in items],dtype=float)
+        return rows,cols,values
+
+    if sparse_data._order in ('csr','csc'):
+        #expand the compressed axis directly rather than building a
+        #python tuple for each nonzero entry
+        if sparse_data.hasUpdates():
+            sparse_data.absorbUpdates()
+        packed_idxs = repeat(arange(len(sparse_data._pkd_ax)-1),\
+          diff(sparse_data._pkd_ax))
+        unpacked_idxs = asarray(sparse_data._unpkd_ax,dtype=int)
+        values = asarray(sparse_data._values,dtype=float)
+        if sparse_data._order == 'csr':
+            return packed_idxs,unpacked_idxs,values
+        else:
+            return unpacked_idxs,packed_idxs,values
+    else:
+        #CSMat tables are staged as coordinate lists until first packed
+        #(e.g. straight after parsing)
+        return array(sparse_data._coo_rows,dtype=int),\
+          array(sparse_data._coo_cols,dtype=int),\
+          array(sparse_data._coo_values,dtype=float)
+
+def sparse_matrix_from_coordinates(rows,cols,values,shape):
+    """Return a biom sparse matrix holding values at (rows,cols), as returned by get_sparse_coordinates
+
+    Coordinates must not repeat.  Zero values are not stored.
+    """
+    n_rows,n_cols = shape
+    sparse_data = SparseObj(n_rows,n_cols)
+    nonzero = values != 0
+    rows,cols,values = rows[nonzero],cols[nonzero],values[nonzero]
+    if not _has_known_csmat_layout(sparse_data):
+        if len(values):
+            sparse_data = list_list_to_sparseobj(zip(rows.tolist(),\
+              cols.tolist(),values.tolist()),shape=shape)
+        return sparse_data
+
+    #pack the rows directly rather than staging each entry as a python
+    #tuple
+    positions = rows.astype(int64)*n_cols + cols
+    if (diff(positions) < 0).any():
+        order = positions.argsort()
+        rows,cols,values = rows.take(order),cols.take(order),\
+          values.take(order)
+    sparse_data._pkd_ax = searchsorted(rows,arange(n_rows+1)).astype(uint32)
+    sparse_data._unpkd_ax = cols.astype(uint32)
+    sparse_data._values = values.astype(sparse_data.dtype)
+    sparse_data._order = 'csr'
+    return sparse_data
+
+def select_coordinates(axis_idxs,axis_len,selected_idxs,other_idxs,values):
+    """Keep the coordinates on selected_idxs, renumbered by their position in selected_idxs"""
+    new_positions = zeros(axis_len,dtype=int) - 1
+    new_positions[asarray(selected_idxs,dtype=int)] = arange(len(selected_idxs))
+    axis_idxs = new_positions[axis_idxs]
+    keep = axis_idxs >= 0
+    return axis_idxs[keep],other_idxs[keep],values[keep]
+
 def make_output_dir(dirpath, strict=False):
     """Make an output directory if it doesn't exist
     
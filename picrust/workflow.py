@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+# File created on 18 Oct 2026
+from __future__ import division
+
+__author__ = "Greg Caporaso"
+__copyright__ = "Copyright 2011-2013, The PICRUSt Project"
+__credits__ = ["Greg Caporaso","Jesse Zaneveld","Morgan Langille"]
+__license__ = "GPL"
+__version__ = "1.0.0-dev"
+__maintainer__ = "Greg Caporaso"
+__email__ = "gregcaporaso@gmail.com"
+__status__ = "Development"
+
+import json
+from hashlib import sha1
+from os import makedirs, rename, stat
+from os.path import join, exists, abspath
+from biom.parse import parse_biom_table, parse_biom_table_str,\
+  parse_classic_table_to_rich_table
+from biom.table import DenseOTUTable
+from picrust.predict_metagenomes import load_data_table,\
+  run_metagenome_prediction
+from picrust.normalize_by_copy_number import normalize_by_copy_number
+from picrust.categorize_by_function import categorize_by_function,\
+  format_categorized_table
+from picrust.metagenome_contributions import partition_metagenome_contributions,\
+  format_contributions
+from picrust.prediction_server import parse_predicted_table_str
+from picrust.util import format_biom_table, file_digest
+
+def stage_key(stage,inputs,params):
+    """Return the cache key for a workflow stage
+
+    stage -- the name of the stage
+    inputs -- digests of the stage's input files and/or the keys of
+      the upstream stages it consumes
+    params -- dict of the parameters that affect the stage's output
+    """
+    description = json.dumps([stage,list(inputs),sorted(params.items())])
+    return sha1(description).hexdigest()
+
+
+DIGESTS_FILENAME = 'file_digests.json'
+
+class IntermediateCache(object):
+    """Content-addressed disk cache of workflow intermediates
+
+    Each entry is a JSON object (typically of BIOM format strings) stored
+    under the key of the stage that produced it.  If cache_dir is None
+    nothing is cached.
+    """
+
+    def __init__(self,cache_dir=None):
+        self.cache_dir = cache_dir
+        if cache_dir and not exists(cache_dir):
+            makedirs(cache_dir)
+        self._digests = {}
+        if cache_dir and exists(join(cache_dir,DIGESTS_FILENAME)):
+            self._digests = json.load(open(join(cache_dir,DIGESTS_FILENAME)))
+
+    def _entry_fp(self,key):
+        return join(self.cache_dir,key + '.json')
+
+    def _write_json(self,fp,data):
+        #write to a temporary file first so that an interrupted run never
+        #leaves a partial file behind
+        tmp_fp = fp + '.tmp'
+        f = open(tmp_fp,'w')
+        json.dump(data,f)
+        f.close()
+        rename(tmp_fp,fp)
+
+    def file_digest(self,fp):
+        """Return the sha1 hex digest of the contents of fp, hashing it only when needed
+
+        Digests are remembered (in cache_dir, if any) with the size and
+        modification time of the file, and the file is only read again
+        once either changes.
+        """
+        fp = abspath(fp)
+        stats = stat(fp)
+        signature = [stats.st_size,stats.st_mtime]
+        if fp in self._digests and self._digests[fp][:2] == signature:
+            return str(self._digests[fp][2])
+        digest = file_digest(fp)
+        self._digests[fp] = signature + [digest]
+        if self.cache_dir:
+            self._write_json(join(self.cache_dir,DIGESTS_FILENAME),self._digests)
+        return digest
+
+    def get(self,key):
+        """Return the cached entry for key, or None if it isn't cached"""
+        if not self.cache_dir or not exists(self._entry_fp(key)):
+            return None
+        return json.load(open(self._entry_fp(key)))
+
+    def put(self,key,entry):
+        """Cache entry under key"""
+        if not self.cache_dir:
+            return
+        self._write_json(self._entry_fp(key),entry)
+
+
+class _Stage(object):
+    """A lazily evaluated, cached workflow stage
+
+    compute -- function returning the stage's result
+    to_entry/from_entry -- convert the result to and from a JSON-able
+      cache entry
+    """
+
+    def __init__(self,name,key,cache,compute,to_entry,from_entry,verbose=False):
+        self.name = name
+        self.key = key
+        self.cache = cache
+        self.compute = compute
+        self.to_entry = to_entry
+        self.from_entry = from_entry
+        self.verbose = verbose
+        self.from_cache = None
+        self._result = None
+
+    def result(self):
+        if self._result is not None:
+            return self._result
+
+        entry = self.cache.get(self.key)
+        if entry is not None:
+            if self.verbose:
+                print "Using cached result for %s stage (%s)" %(self.name,self.key)
+            self.from_cache = True
+            self._result = self.from_entry(entry)
+        else:
+            if self.verbose:
+                print "Running %s stage" % self.name
+            self.from_cache = False
+            self._result = self.compute()
+            self.cache.put(self.key,self.to_entry(self._result))
+        return self._result
+
+
+def _table_to_entry(table):
+    return {'table':format_biom_table(table)}
+
+def _entry_to_table(entry):
+    return parse_biom_table_str(entry['table'])
+
+def _prediction_to_entry(results):
+    entry = {}
+    for key,value in results.items():
+        if key == 'nsti':
+            entry[key] = value
+        else:
+            entry[key] = format_biom_table(value)
+    return entry
+
+def _entry_to_prediction(entry):
+    results = {}
+    for key,value in entry.items():
+        if key == 'nsti':
+            results[key] = [(str(sample),nsti) for sample,nsti in value]
+        else:
+            results[key] = parse_predicted_table_str(value)
+    return results
+
+
+def run_picrust_workflow(otu_table_fp,copy_number_fp,genome_table_fp,\
+    variance_table_fp=None,with_confidence=False,accuracy_metrics=False,\
+    load_precalc_file_in_biom=False,input_format_classic=False,\
+    metadata_identifier='CopyNumber',categorize_levels=[],\
+    metadata_category=None,ignore=None,limit_to_functions=None,\
+    tab_delimited_categories=False,cache_dir=None,verbose=False):
+    """Normalize, predict, categorize and partition an OTU table in one process
+
+    otu_table_fp -- the OTU table, in BIOM (or with input_format_classic,
+      classic QIIME) format
+    copy_number_fp -- the precalculated marker gene copy number table
+    genome_table_fp -- the precalculated function count table
+    variance_table_fp -- the matching variance table (needed for
+      with_confidence)
+    categorize_levels -- levels of metadata_category to collapse the
+      prediction to
+    limit_to_functions -- if not None, partition the contributions of
+      each OTU to these functions (all functions if empty)
+    cache_dir -- if provided, stage results are cached here under hashes
+      of their input files and parameters, so that rerunning with changed
+      downstream options skips the unchanged upstream stages.  Each
+      input file is hashed at most once per run, and not again on later
+      runs until its size or modification time changes (see
+      IntermediateCache.file_digest).
+
+    Tables are passed between stages in memory.  Returns a dict with the
+    normalized OTU table under 'normalized', the run_metagenome_prediction
+    results under 'prediction', the collapsed tables (as strings) under
+    'categorized', keyed by level, and the contributions text under
+    'contributions'.  'cached_stages' lists the stages loaded from the cache.
+    """
+    if with_confidence and not variance_table_fp:
+        raise ValueError("A variance table is required to calculate confidence intervals")
+
+    cache = IntermediateCache(cache_dir)
+    load_params = {'load_precalc_file_in_biom':load_precalc_file_in_biom}
+
+    otu_table_cache = []
+    def load_otu_table():
+        if not otu_table_cache:
+            if verbose:
+                print "Loading OTU table: ",otu_table_fp
+            if input_format_classic:
+                otu_table = parse_classic_table_to_rich_table(\
+                  open(otu_table_fp,'U'),None,None,None,DenseOTUTable)
+            else:
+                otu_table = parse_biom_table(open(otu_table_fp,'U'))
+            otu_table_cache.append(otu_table)
+        return otu_table_cache[0]
+
+    def load_precalc(fp):
+        return load_data_table(fp,\
+          load_data_table_in_biom=load_precalc_file_in_biom,\
+          ids_to_load=load_otu_table().ObservationIds,\
+          transpose=True,verbose=verbose)
+
+    normalize_params = dict(load_params,input_format_classic=input_format_classic,\
+      metadata_identifier=metadata_identifier)
+    normalize = _Stage('normalize',\
+      stage_key('normalize',[cache.file_digest(otu_table_fp),\
+        cache.file_digest(copy_number_fp)],normalize_params),cache,\
+      lambda: normalize_by_copy_number(load_otu_table(),\
+        load_precalc(copy_number_fp),metadata_identifier),\
+      _table_to_entry,_entry_to_table,verbose)
+
+    #the genome table is needed by both prediction and contributions
+    genome_table_cache = []
+    def load_genome_table():
+        if not genome_table_cache:
+            genome_table_cache.append(load_precalc(genome_table_fp))
+        return genome_table_cache[0]
+
+    def predict():
+        variance_table = None
+        if with_confidence:
+            variance_table = load_precalc(variance_table_fp)
+        return run_metagenome_prediction(normalize.result(),\
+          load_genome_table(),variance_table,with_confidence=with_confidence,\
+          accuracy_metrics=accuracy_metrics,verbose=verbose)
+
+    predict_inputs = [normalize.key,cache.file_digest(genome_table_fp)]
+    if with_confidence:
+        predict_inputs.append(cache.file_digest(variance_table_fp))
+    predict_params = dict(load_params,with_confidence=with_confidence,\
+      accuracy_metrics=accuracy_metrics)
+    prediction = _Stage('predict',\
+      stage_key('predict',predict_inputs,predict_params),cache,predict,\
+      _prediction_to_entry,_entry_to_prediction,verbose)
+
+    stages = [normalize,prediction]
+    results = {'normalized':normalize.result(),\
+      'prediction':prediction.result(),'categorized':{}}
+
+    for level in categorize_levels:
+        categorize_params = {'metadata_category':metadata_category,\
+          'level':level,'ignore':ignore,'tab_delimited':tab_delimited_categories}
+        categorize = _Stage('categorize level %d' % level,\
+          stage_key('categorize',[prediction.key],categorize_params),cache,\
+          lambda: format_categorized_table(categorize_by_function(\
+            prediction.result()['prediction'],metadata_category,level,ignore),\
+            metadata_category,tab_delimited_categories),\
+          lambda text: {'text':text},lambda entry: str(entry['text']),verbose)
+        results['categorized'][level] = categorize.result()
+        stages.append(categorize)
+
+    if limit_to_functions is not None:
+        contributions_params = dict(load_params,\
+          limit_to_functions=list(limit_to_functions))
+        contributions = _Stage('contributions',\
+          stage_key('contributions',[normalize.key,cache.file_digest(genome_table_fp)],\
+            contributions_params),cache,\
+          lambda: format_contributions(partition_metagenome_contributions(\
+            normalize.result(),load_genome_table(),\
+            limit_to_functions=limit_to_functions,verbose=verbose)),\
+          lambda text: {'text':text},lambda entry: str(entry['text']),verbose)
+        results['contributions'] = contributions.result()
+        stages.append(contributions)
+
+    results['cached_stages'] = [s.name for s in stages if s.from_cache]
+    return results
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# File created on 18 Oct 2026
+from __future__ import division
+
+__author__ = "Greg Caporaso"
+__copyright__ = "Copyright 2011-2013, The PICRUSt Project"
+__credits__ = ["Greg Caporaso","Jesse Zaneveld","Morgan Langille"]
+__license__ = "GPL"
+__version__ = "1.0.0-dev"
+__maintainer__ = "Greg Caporaso"
+__email__ = "gregcaporaso@gmail.com"
+__status__ = "Development"
+
+
+from cogent.util.option_parsing import parse_command_line_parameters, make_option
+from os.path import join
+from picrust.function_index import build_function_index
+from picrust.predict_metagenomes import determine_data_table_fp
+from picrust.util import get_picrust_project_dir
+
+script_info = {}
+script_info['brief_description'] = "Build an index of the OTUs carrying each function in a precalculated PICRUSt table."
+script_info['script_description'] = "Predictions and contributions for a few functions normally still require parsing the whole precalculated table. This script indexes, for each function, the OTUs with nonzero counts of it and their counts. Pass the index directory to predict_metagenomes.py or metagenome_contributions.py with --function_index to load only the requested functions from it. The index only needs to be rebuilt when the precalculated table changes."
+script_info['script_usage'] = [("","Index the KO table for the newest version of GreenGenes.","%prog -o ko_13_5_index"),
+                               ("","Index a custom trait table.","%prog -c custom_trait_table.tab -o custom_trait_index")]
+script_info['output_description']= "The output directory contains the index as numpy arrays (offsets.npy, postings_otus.npy, postings_counts.npy, function_ids.npy and otu_ids.npy), the function and OTU metadata as JSON, and index.json, which records the indexed table and its sha1 digest."
+script_info['required_options'] = [
+ make_option('-o','--output_dir',type="new_dirpath",help='the output directory')
+]
+type_of_prediction_choices=['ko','cog','rfam']
+gg_version_choices=['13_5','18may2012']
+script_info['optional_options'] = [\
+    make_option('-t','--type_of_prediction',default=type_of_prediction_choices[0],type="choice",\
+                    choices=type_of_prediction_choices,\
+                    help='Type of functional predictions. Valid choices are: '+\
+                    ', '.join(type_of_prediction_choices)+\
+                    ' [default: %default]'),
+    make_option('-g','--gg_version',default=gg_version_choices[0],type="choice",\
+                    choices=gg_version_choices,\
+                    help='Version of GreenGenes that was used for OTU picking. Valid choices are: '+\
+                    ', '.join(gg_version_choices)+\
+                    ' [default: %default]'),
+    make_option('-c','--input_count_table',default=None,type="existing_filepath",help='Precalculated function predictions on per otu basis in biom format (can be gzipped). Note: using this option overrides --type_of_prediction and --gg_version. [default: %default]'),
+    make_option('--load_precalc_file_in_biom',default=False,action="store_true",help='Instead of loading the precalculated file in tab-delimited format (with otu ids as row ids and traits as columns) load the data in biom format (with otu as SampleIds and traits as ObservationIds) [default: %default]'),
+    make_option('--processes',default=1,type='int',help='number of processes used to parse tab-delimited precalculated tables [default: %default]')]
+script_info['version'] = __version__
+
+
+def main():
+    option_parser, opts, args =\
+       parse_command_line_parameters(**script_info)
+
+    data_table_fp = determine_data_table_fp(\
+      join(get_picrust_project_dir(),'picrust','data'),\
+      opts.type_of_prediction,opts.gg_version,\
+      user_specified_table=opts.input_count_table,verbose=opts.verbose)
+    n_postings = build_function_index(data_table_fp,opts.output_dir,\
+      load_data_table_in_biom=opts.load_precalc_file_in_biom,\
+      processes=opts.processes,verbose=opts.verbose)
+
+    if opts.verbose:
+        print "Indexed %i nonzero function counts from %s" %(n_postings,data_table_fp)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# File created on 18 Oct 2026
+from __future__ import division
+
+__author__ = "Daniel McDonald"
+__copyright__ = "Copyright 2011-2013, The PICRUSt Project"
+__credits__ = ["Daniel McDonald", "Morgan Langille", "Jesse Zaneveld"]
+__license__ = "GPL"
+__version__ = "1.0.0-dev"
+__maintainer__ = "Daniel McDonald"
+__email__ = "mcdonadt@colorado.edu"
+__status__ = "Development"
+
+from cogent.util.option_parsing import parse_command_line_parameters, make_option
+from os.path import join, splitext
+from picrust.categorize_by_function import write_categorized_precalc
+from picrust.predict_metagenomes import determine_data_table_fp
+from picrust.util import get_picrust_project_dir, make_output_dir_for_file
+
+script_info = {}
+script_info['brief_description'] = "Collapse a precalculated gene count table to a specified level in a hierarchy."
+script_info['script_description'] = "Often only higher levels of a functional hierarchy (e.g. KEGG Pathways at level 2 or 3) are of interest, but predict_metagenomes.py predicts the count of every gene, and categorize_by_function.py then collapses the predictions. This script instead collapses the precalculated gene counts of each OTU to the categories at the given level, once. predict_metagenomes.py then predicts the category counts directly from the much narrower derived table. As with categorize_by_function.py, a gene that is involved in several categories (a one-to-many relationship) is counted for each of them. Predictions are rounded per category rather than per gene, so they can differ slightly from collapsing gene-level predictions. Variance tables are not collapsed, so confidence intervals can not be calculated with the derived table."
+script_info['script_usage'] = [("","Collapse the KO table for the newest version of GreenGenes to KEGG Pathway level 3.","%prog -c KEGG_Pathways -l 3 -o ko_13_5_precalculated.L3.tab.gz"),
+                               ("","Collapse the COG table to COG Category levels 1 and 2 in one run. The tables are written to cog_13_5_precalculated.L1.tab.gz and cog_13_5_precalculated.L2.tab.gz.","%prog -t cog -c COG_Category -l 1,2 -o cog_13_5_precalculated.tab.gz"),
+                               ("","Collapse a custom trait table.","%prog -i custom_trait_table.tab -c KEGG_Pathways -l 2 -o custom_trait_table.L2.tab")]
+script_info['output_description']= "A tab-delimited precalculated table (gzipped if its name ends in .gz) of category counts per OTU, with the path of each category in its metadata. If several levels are passed, one table is written per level, named by inserting .L<level> before the extension of the output filepath."
+script_info['required_options'] = [
+ make_option('-o','--output_fp',type="new_filepath",help='the output precalculated table'),
+ make_option('-c','--metadata_category',type='string',help='the metadata category that describes the hierarchy (e.g. KEGG_Pathways, COG_Category, etc.)'),
+ make_option('-l','--level',type='string',help='the level in the hierarchy to collapse to. A value of 0 is not allowed, a value of 1 is the highest level, and any higher value nears the leaves of the hierarchy. Pass a comma-separated list of levels (e.g. 2,3) to collapse to each of them while reading the precalculated table once.')
+]
+type_of_prediction_choices=['ko','cog']
+gg_version_choices=['13_5','18may2012']
+script_info['optional_options'] = [\
+    make_option('-t','--type_of_prediction',default=type_of_prediction_choices[0],type="choice",\
+                    choices=type_of_prediction_choices,\
+                    help='Type of functional predictions. Valid choices are: '+\
+                    ', '.join(type_of_prediction_choices)+\
+                    ' [default: %default]'),
+    make_option('-g','--gg_version',default=gg_version_choices[0],type="choice",\
+                    choices=gg_version_choices,\
+                    help='Version of GreenGenes that was used for OTU picking. Valid choices are: '+\
+                    ', '.join(gg_version_choices)+\
+                    ' [default: %default]'),
+    make_option('-i','--input_count_table',default=None,type="existing_filepath",help='Precalculated tab-delimited function predictions on per otu basis (can be gzipped). Note: using this option overrides --type_of_prediction and --gg_version. [default: %default]'),
+    make_option('--ignore',type='string',default=None, help="Ignore the comma separated list of names. For instance, specifying --ignore=unknown,unclassified will ignore those labels while collapsing. The default is to not ignore anything. [default: %default]")]
+script_info['version'] = __version__
+
+
+def main():
+    option_parser, opts, args =\
+       parse_command_line_parameters(**script_info)
+
+    try:
+        levels = map(int,opts.level.split(','))
+    except ValueError:
+        option_parser.error("level must be an integer or a comma-separated list of integers")
+    if min(levels) <= 0:
+        option_parser.error("level must be greater than zero!")
+
+    precalc_data_dir = join(get_picrust_project_dir(),'picrust','data')
+    data_table_fp = determine_data_table_fp(precalc_data_dir,\
+      opts.type_of_prediction,opts.gg_version,\
+      user_specified_table=opts.input_count_table,verbose=opts.verbose)
+
+    if len(levels) == 1:
+        level_output_fps = [(levels[0],opts.output_fp)]
+    else:
+        #keep any .gz extension last
+        output_base,output_ext = splitext(opts.output_fp)
+        if output_ext == '.gz':
+            output_base,table_ext = splitext(output_base)
+            output_ext = table_ext + output_ext
+        level_output_fps = [(level,'%s.L%d%s' % (output_base,level,output_ext)) \
+          for level in levels]
+    make_output_dir_for_file(opts.output_fp)
+    try:
+        n_written = write_categorized_precalc(data_table_fp,\
+          opts.metadata_category,level_output_fps,opts.ignore,\
+          verbose=opts.verbose)
+    except ValueError,e:
+        option_parser.error(str(e))
+
+    if opts.verbose:
+        print "Wrote the category counts of %i OTUs to %s" \
+          %(n_written,', '.join(fp for level,fp in level_output_fps))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# File created on 18 Oct 2026
+from __future__ import division
+
+__author__ = "Greg Caporaso"
+__copyright__ = "Copyright 2011-2013, The PICRUSt Project"
+__credits__ = ["Greg Caporaso","Jesse Zaneveld","Morgan Langille"]
+__license__ = "GPL"
+__version__ = "1.0.0-dev"
+__maintainer__ = "Greg Caporaso"
+__email__ = "gregcaporaso@gmail.com"
+__status__ = "Development"
+
+
+from cogent.util.option_parsing import parse_command_line_parameters, make_option
+from picrust.shard import merge_shard_predictions
+from picrust.util import make_output_dir_for_file
+
+script_info = {}
+script_info['brief_description'] = "Merge the metagenome predictions for the shards of an OTU table."
+script_info['script_description'] = "Combines the predictions for the shards written by split_otu_table_by_samples.py into a single table, with the samples in the order of the original OTU table. The prediction for each shard must be in the predictions directory, named after the shard (e.g. shard_0000.biom), as predict_metagenomes.py names its output when given several OTU tables and an output directory. Variance, confidence interval and NSTI files for the shards are merged too. Shard tables are read one at a time, so the merge never holds more than one shard prediction in memory."
+script_info['script_usage'] = [("","Predict the metagenomes of each shard (on any number of nodes), then merge the predictions.","predict_metagenomes.py -i 'otu_shards/shard_*.biom' -o shard_predictions; %prog -m otu_shards/manifest.json -i shard_predictions -o predicted_metagenomes.biom"),
+                               ("","Also merge confidence intervals and the NSTI values written with predict_metagenomes.py -a nsti.tab.","%prog -m otu_shards/manifest.json -i shard_predictions -o predicted_metagenomes.biom -a nsti.tab")]
+script_info['output_description']= "The merged prediction, with _variances, _upper_CI_95 and _lower_CI_95 files if the shards have them, and the merged accuracy metrics if -a is passed."
+script_info['required_options'] = [
+ make_option('-m','--manifest',type='existing_filepath',help='the manifest written by split_otu_table_by_samples.py'),
+ make_option('-i','--input_dir',type='existing_dirpath',help='the directory containing the predictions for each shard'),
+ make_option('-o','--output_metagenome_table',type="new_filepath",help='the output file for the merged predicted metagenome')
+]
+script_info['optional_options'] = [\
+    make_option('-a','--accuracy_metrics',default=None,type="new_filepath",help='If provided, merge the accuracy metrics of each shard (named <shard id>_<name of this file> in the input directory) into this file [default: %default]')]
+script_info['version'] = __version__
+
+
+def main():
+    option_parser, opts, args =\
+       parse_command_line_parameters(**script_info)
+
+    make_output_dir_for_file(opts.output_metagenome_table)
+    merge_shard_predictions(opts.manifest,opts.input_dir,\
+      opts.output_metagenome_table,accuracy_metrics_fp=opts.accuracy_metrics,\
+      verbose=opts.verbose)
+
+if __name__ == "__main__":
+    main()
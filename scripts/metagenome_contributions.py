@@ -15,24 +15,30 @@ __status__ = "Development"
 
 from cogent.util.option_parsing import parse_command_line_parameters, make_option
 from biom.parse import parse_biom_table
-from picrust.predict_metagenomes import predict_metagenomes, calc_nsti
-from picrust.metagenome_contributions import partition_metagenome_contributions
-from picrust.util import make_output_dir_for_file, get_picrust_project_dir, convert_precalc_to_biom
-from os import path
+from picrust.predict_metagenomes import determine_data_table_fp, load_data_table,\
+  determine_functions_to_load
+from picrust.metagenome_contributions import iter_metagenome_contributions,\
+  write_contributions, write_columnar_contributions,\
+  write_contributions_in_parallel
+from picrust.function_index import FunctionIndex
+from picrust.util import make_output_dir_for_file, get_picrust_project_dir
 from os.path import join
-import gzip
 
 script_info = {}
 script_info['brief_description'] = "This script partitions metagenome functional contributions according to function, OTU, and sample, for a given OTU table."
 script_info['script_description'] = ""
 script_info['script_usage'] = [
 ("","Partition the predicted contribution to the  metagenomes from each organism in the given OTU table, limited to only K00001, K00002, and K00004.","%prog -i normalized_otus.biom -l K00001,K00002,K00004 -o ko_metagenome_contributions.tab"),
-("","Partition the predicted contribution to the  metagenomes from each organism in the given OTU table, limited to only COG0001 and COG0002.","%prog -i normalized_otus.biom -l COG0001,COG0002 -t cog -o cog_metagenome_contributions.tab")
+("","Partition the predicted contribution to the  metagenomes from each organism in the given OTU table, limited to only COG0001 and COG0002.","%prog -i normalized_otus.biom -l COG0001,COG0002 -t cog -o cog_metagenome_contributions.tab"),
+("","Write the contributions to all KOs to a gzip-compressed file.","%prog -i normalized_otus.biom -o ko_metagenome_contributions.tab.gz"),
+("","Output only the 5 OTUs contributing the most to each KO in each sample, summing the rest into an \"Other\" row.","%prog -i normalized_otus.biom -o ko_metagenome_top_contributions.tab --top_k 5"),
+("","Partition the contributions to all KOs using 4 processes.","%prog -i normalized_otus.biom -o ko_metagenome_contributions.tab --processes 4"),
+("","Write the contributions to all KOs to a compact columnar archive, which can be loaded with picrust.metagenome_contributions.load_columnar_contributions.","%prog -i normalized_otus.biom -o ko_metagenome_contributions.npz")
 ]
 script_info['output_description']= "Output is a tab-delimited column indicating OTU contribution to each function."
 script_info['required_options'] = [
  make_option('-i','--input_otu_table',type='existing_filepath',help='the input otu table in biom format'),
- make_option('-o','--output_fp',type="new_filepath",help='the output file for the metagenome contributions')
+ make_option('-o','--output_fp',type="new_filepath",help='the output file for the metagenome contributions. It is gzip-compressed if its name ends in .gz, and written as columns of a numpy .npz archive (with ids and taxonomy stored once, and referred to by integer codes) if its name ends in .npz')
 ]
 type_of_prediction_choices=['ko','cog','rfam']
 gg_version_choices=['13_5','18may2012']
@@ -51,7 +57,13 @@ script_info['optional_options'] = [\
     make_option('-c','--input_count_table',default=None,type="existing_filepath",help='Precalculated function predictions on per otu basis in biom format (can be gzipped). Note: using this option overrides --type_of_prediction and --gg_version. [default: %default]'),
  make_option('--suppress_subset_loading',default=False,action="store_true",help='Normally, only counts for OTUs present in the sample are loaded.  If this flag is passed, the full biom table is loaded.  This makes no difference for the analysis, but may result in faster load times (at the cost of more memory usage)'),    
     make_option('--load_precalc_file_in_biom',default=False,action="store_true",help='Instead of loading the precalculated file in tab-delimited format (with otu ids as row ids and traits as columns) load the data in biom format (with otu as SampleIds and traits as ObservationIds) [default: %default]'),
-        make_option('-l','--limit_to_function',default=None,help='If provided, only output predictions for the specified function ids.  Multiple function ids can be passed using comma delimiters.')
+        make_option('-l','--limit_to_function',default=None,help='If provided, only output predictions for the specified function ids.  Multiple function ids can be passed using comma delimiters.'),
+        make_option('--limit_to_functional_category',default=None,help='If provided, only output predictions for the functions annotated with the specified categories of --metadata_category (at any level).  Multiple categories can be passed using semicolon delimiters. [default: %default]'),
+        make_option('--metadata_category',default='KEGG_Pathways',help='the function metadata searched by --limit_to_functional_category [default: %default]'),
+        make_option('--processes',default=1,type='int',help='number of processes to divide the functions between when calculating contributions [default: %default]'),
+        make_option('--top_k',default=None,type='int',help='If provided, only output this many OTUs contributing the most to each function in each sample. The contributions of the other OTUs are summed into a row for OTU "Other" [default: %default]'),
+        make_option('--min_fraction',default=None,type='float',help='If provided, only output the OTUs contributing at least this fraction (between 0 and 1) of each function in a sample. The contributions of the other OTUs are summed into a row for OTU "Other" [default: %default]'),
+        make_option('--function_index',default=None,type='existing_dirpath',help='directory of a function index built by build_function_index.py. If provided, the gene counts are read from the index instead of the count table, and the options describing which count table to load are ignored. With --limit_to_function or --limit_to_functional_category, only the postings of the selected functions are read. A warning is printed if the count table the index was built from has changed since [default: %default]')
 ]
 script_info['version'] = __version__
 
@@ -61,6 +73,13 @@ def main():
        parse_command_line_parameters(**script_info)
     
   
+    if opts.processes < 1:
+        option_parser.error("--processes must be at least 1")
+    if opts.top_k is not None and opts.top_k < 1:
+        option_parser.error("--top_k must be at least 1")
+    if opts.min_fraction is not None and not 0 <= opts.min_fraction <= 1:
+        option_parser.error("--min_fraction must be between 0 and 1")
+
     if opts.limit_to_function:
         limit_to_functions = opts.limit_to_function.split(',')
         if opts.verbose:
@@ -74,54 +93,75 @@ def main():
     otu_table = parse_biom_table(open(opts.input_otu_table,'U'))
     ids_to_load = otu_table.ObservationIds
 
-    if(opts.input_count_table is None):
-        #precalc file has specific name (e.g. ko_13_5_precalculated.tab.gz)
-        precalc_file_name='_'.join([opts.type_of_prediction,opts.gg_version,'precalculated.tab.gz'])
-        input_count_table=join(get_picrust_project_dir(),'picrust','data',precalc_file_name)
-    else:
-        input_count_table=opts.input_count_table
-
-    if opts.verbose:
-        print "Loading trait table: ", input_count_table
-
-    ext=path.splitext(input_count_table)[1]
-
-    if opts.verbose:
-        print "Loading count table: ", input_count_table
-    
-    if (ext == '.gz'):
-        genome_table_fh = gzip.open(input_count_table,'rb')
-    else:
-        genome_table_fh = open(input_count_table,'U')
-    
-    #In the genome/trait table genomes are the samples and 
-    #genes are the observations
-
-    
-    if opts.load_precalc_file_in_biom:
-        if not opts.suppress_subset_loading:
-            #Now we want to use the OTU table information
-            #to load only rows in the count table corresponding
-            #to relevant OTUs
-           
-            if opts.verbose:
-                print "Loading traits for %i organisms from the trait table" %len(ids_to_load)
-
-            genome_table = load_subset_from_biom_str(genome_table_fh.read(),ids_to_load,axis='samples')
-        else:
-            if opts.verbose:
-                print "Loading *full* count table because --suppress_subset_loading was passed. This may result in high memory usage"
-            genome_table = parse_biom_table(genome_table_fh.read())
+    category_names = None
+    if opts.limit_to_functional_category:
+        category_names = opts.limit_to_functional_category.split(';')
+
+    if opts.function_index:
+        function_index = FunctionIndex(opts.function_index)
+        function_index.check_data_table()
+        try:
+            functions_to_load = function_index.select_functions(\
+              limit_to_functions,category_names,\
+              metadata_category=opts.metadata_category)
+        except ValueError,e:
+            option_parser.error(str(e))
+        if functions_to_load is not None:
+            limit_to_functions = functions_to_load
+        if opts.suppress_subset_loading:
+            ids_to_load = None
+        try:
+            genome_table = function_index.get_genome_table(functions_to_load,\
+              ids_to_load)
+        except ValueError,e:
+            option_parser.error(str(e))
     else:
-        genome_table = convert_precalc_to_biom(genome_table_fh,ids_to_load)
+        input_count_table = determine_data_table_fp(\
+          join(get_picrust_project_dir(),'picrust','data'),\
+          opts.type_of_prediction,opts.gg_version,\
+          user_specified_table=opts.input_count_table,verbose=opts.verbose)
+
+        try:
+            functions_to_load = determine_functions_to_load(input_count_table,\
+              function_ids=limit_to_functions,category_names=category_names,\
+              metadata_category=opts.metadata_category,\
+              load_data_table_in_biom=opts.load_precalc_file_in_biom)
+        except ValueError,e:
+            option_parser.error(str(e))
+        if functions_to_load is not None:
+            limit_to_functions = functions_to_load
+
+        #In the genome/trait table genomes are the samples and 
+        #genes are the observations.  Only the requested functions are loaded.
+        try:
+            genome_table = load_data_table(input_count_table,\
+              load_data_table_in_biom=opts.load_precalc_file_in_biom,\
+              suppress_subset_loading=opts.suppress_subset_loading,\
+              ids_to_load=ids_to_load,transpose=True,\
+              functions_to_load=functions_to_load,verbose=opts.verbose)
+        except ValueError,e:
+            option_parser.error(str(e))
     
-    partitioned_metagenomes = partition_metagenome_contributions(otu_table,genome_table,limit_to_functions=limit_to_functions)
-    output_text = "\n".join(["\t".join(map(str,i)) for i in partitioned_metagenomes])
     if opts.verbose:
         print "Writing results to output file: ",opts.output_fp
         
     make_output_dir_for_file(opts.output_fp)
-    open(opts.output_fp,'w').write(output_text)
+    #The contributions to each gene are written as soon as they are
+    #calculated, rather than building the whole output in memory
+    if opts.output_fp.endswith('.npz'):
+        write_columnar_contributions(otu_table,genome_table,opts.output_fp,\
+          limit_to_functions=limit_to_functions,top_k=opts.top_k,\
+          min_fraction=opts.min_fraction,processes=opts.processes,\
+          verbose=opts.verbose)
+    elif opts.processes > 1:
+        write_contributions_in_parallel(otu_table,genome_table,\
+          opts.output_fp,opts.processes,limit_to_functions=limit_to_functions,\
+          top_k=opts.top_k,min_fraction=opts.min_fraction,verbose=opts.verbose)
+    else:
+        gene_rows = iter_metagenome_contributions(otu_table,genome_table,\
+          limit_to_functions=limit_to_functions,top_k=opts.top_k,\
+          min_fraction=opts.min_fraction,verbose=opts.verbose)
+        write_contributions(gene_rows,opts.output_fp)
 
 if __name__ == "__main__":
     main()
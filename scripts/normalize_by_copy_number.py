@@ -14,13 +14,12 @@ __status__ = "Development"
 
 from cogent.util.option_parsing import parse_command_line_parameters, make_option
 from biom.parse import parse_biom_table, parse_classic_table_to_rich_table
-from biom.table import table_factory,DenseOTUTable
-from picrust.predict_metagenomes import transfer_observation_metadata,\
-  transfer_sample_metadata
+from biom.table import DenseOTUTable
+from picrust.normalize_by_copy_number import normalize_by_copy_number
 from os import path
 from os.path import join
-from picrust.util import get_picrust_project_dir, convert_precalc_to_biom,make_output_dir_for_file, format_biom_table
-import gzip
+from picrust.predict_metagenomes import load_data_table
+from picrust.util import get_picrust_project_dir,make_output_dir_for_file, format_biom_table
 import sys
 
 script_info = {}
@@ -85,58 +84,16 @@ def main():
     if opts.verbose:
         print "Loading trait table: ", input_count_table
 
-    ext=path.splitext(input_count_table)[1]
-    
-    if (ext == '.gz'):
-        count_table_fh = gzip.open(input_count_table,'rb')
-    else:
-        count_table_fh = open(input_count_table,'U')
-       
-    if opts.load_precalc_file_in_biom:
-        count_table = parse_biom_table(count_table_fh.read())
-    else:
-        count_table = convert_precalc_to_biom(count_table_fh,ids_to_load)
-
-    #Need to only keep data relevant to our otu list
-    ids=[]
-    for x in otu_table.iterObservations():
-        ids.append(str(x[1]))
-
-    ob_id=count_table.ObservationIds[0]
-
-    filtered_otus=[]
-    filtered_values=[]
-    for x in ids:
-        if count_table.sampleExists(x):
-            filtered_otus.append(x)
-            filtered_values.append(otu_table.observationData(x))
+    #Only the copy numbers of the OTUs in the OTU table are parsed from
+    #tab-delimited tables.  BIOM tables are loaded whole, as subset loading
+    #would reject OTUs without copy numbers rather than drop them
+    count_table = load_data_table(input_count_table,\
+      load_data_table_in_biom=opts.load_precalc_file_in_biom,\
+      suppress_subset_loading=opts.load_precalc_file_in_biom,\
+      ids_to_load=ids_to_load,transpose=True,verbose=opts.verbose)
 
-    #filtered_values = map(list,zip(*filtered_values))
-    filtered_otu_table=table_factory(filtered_values,otu_table.SampleIds,filtered_otus, constructor=DenseOTUTable)
-
-    copy_numbers_filtered={}
-    for x in filtered_otus:
-        value = count_table.getValueByIds(ob_id,x)
-        try:
-            #data can be floats so round them and make them integers
-            value = int(round(float(value)))
-            
-        except ValueError:
-            raise ValueError,\
-                  "Invalid type passed as copy number for OTU ID %s. Must be int-able." % (value)
-        if value < 1:
-            raise ValueError, "Copy numbers must be greater than or equal to 1."
-
-        copy_numbers_filtered[x]={opts.metadata_identifer:value}
-        
-    filtered_otu_table.addObservationMetadata(copy_numbers_filtered)
-            
-
-    normalized_table = filtered_otu_table.normObservationByMetadata(opts.metadata_identifer)
-    
-    #move Observation Metadata from original to filtered OTU table
-    normalized_table = transfer_observation_metadata(otu_table,normalized_table,'ObservationMetadata')
-    normalized_otu_table = transfer_sample_metadata(otu_table,normalized_table,'SampleMetadata')
+    normalized_table = normalize_by_copy_number(otu_table,count_table,\
+      opts.metadata_identifer)
 
     make_output_dir_for_file(opts.output_otu_fp)
     open(opts.output_otu_fp,'w').write(format_biom_table(normalized_table))
@@ -14,15 +14,19 @@ __status__ = "Development"
 
 from cogent.util.option_parsing import parse_command_line_parameters, make_option
 from biom.parse import parse_biom_table
-from picrust.predict_metagenomes import predict_metagenomes,predict_metagenome_variances,\
-  calc_nsti,load_subset_from_biom_str
-from picrust.util import make_output_dir_for_file,format_biom_table, convert_precalc_to_biom
-from os import path
-from os.path import split,join,splitext
-from picrust.util import get_picrust_project_dir, scale_metagenomes
+from picrust.predict_metagenomes import determine_data_table_fp,\
+  load_data_table,run_metagenome_prediction,\
+  write_prediction_results,IdAlignment,determine_functions_to_load,\
+  open_precalc_blocks,predict_metagenomes_from_precalc_blocks,normalize_prediction,\
+  is_prenormalized,MARKER_COPY_NUMBER_METADATA,expand_otu_table_fps,\
+  get_batch_otu_ids,get_batch_output_fps
+from picrust.normalize_by_copy_number import normalize_by_marker_copy_number
+from picrust.function_index import FunctionIndex
+from picrust.prediction_server import query_prediction_server
+from picrust.util import make_output_dir_for_file,format_biom_table,BackgroundCall
+from os.path import join
+from picrust.util import get_picrust_project_dir
 from picrust.predict_traits import variance_of_weighted_mean
-import gzip
-import re
 
 script_info = {}
 script_info['brief_description'] = "This script produces the actual metagenome functional predictions for a given OTU table."
@@ -35,11 +39,15 @@ script_info['script_usage'] = [("","Predict KO abundances for a given OTU table
                                ("","Output confidence intervals for each prediction.","%prog -i normalized_otus.biom -o predicted_metagenomes.biom --with_confidence"),\
                                ("","Predict metagenomes using a custom trait table in tab-delimited format.","%prog -i otu_table_for_custom_trait_table.biom -c custom_trait_table.tab -o output_metagenome_from_custom_trait_table.biom"),\
                                ("","Predict metagenomes,variances,and 95% confidence intervals for each gene category using a custom trait table in tab-delimited format.","%prog -i otu_table_for_custom_trait_table.biom --input_variance_table custom_trait_table_variances.tab -c custom_trait_table.tab -o output_metagenome_from_custom_trait_table.biom --with_confidence"),\
-                                   ("","Change the version of GG used to pick OTUs","%prog -i normalized_otus.biom -g 18may2012 -o predicted_metagenomes.biom")]
+                                   ("","Change the version of GG used to pick OTUs","%prog -i normalized_otus.biom -g 18may2012 -o predicted_metagenomes.biom"),\
+                               ("","Predict metagenomes for several OTU tables at once, loading the trait table only once. When more than one OTU table is passed (as a comma-separated list and/or glob pattern in quotes), the output is a directory with one prediction per OTU table.","%prog -i 'otu_table_for_custom_trait_table.biom,normalized_otus.biom' -c custom_trait_table.tab -o batch_predictions"),\
+                               ("","Write the prediction, variances and 95% confidence intervals to a single layered BIOM file.","%prog -i otu_table_for_custom_trait_table.biom --input_variance_table custom_trait_table_variances.tab -c custom_trait_table.tab -o output_metagenome_layers.biom --with_confidence --layered_output"),\
+                               ("","Also estimate 95% confidence intervals from 1000 bootstrap resamples of the OTU counts of each sample.","%prog -i normalized_otus.biom -o predicted_metagenomes.biom --bootstrap_replicates 1000 --bootstrap_seed 42"),\
+                               ("","Predict KEGG Pathway level 3 abundances directly, from a KO table collapsed by categorize_precalc.py.","%prog -i normalized_otus.biom -c ko_13_5_precalculated.L3.tab.gz -o predicted_metagenomes.L3.biom")]
 script_info['output_description']= "Output is a table of function counts (e.g. KEGG KOs) by sample ids."
 script_info['required_options'] = [
- make_option('-i','--input_otu_table',type='existing_filepath',help='the input otu table in biom format'),
- make_option('-o','--output_metagenome_table',type="new_filepath",help='the output file for the predicted metagenome')
+ make_option('-i','--input_otu_table',type='string',help='the input otu table in biom format. Multiple OTU tables can be passed as a comma-separated list and/or glob patterns (in quotes), in which case the trait table is loaded only once for all of them'),
+ make_option('-o','--output_metagenome_table',type="new_filepath",help='the output file for the predicted metagenome. If more than one OTU table is passed, this is instead an output directory, and each prediction is written to it named after its OTU table (with accuracy metrics, if requested, named after the OTU table and the --accuracy_metrics filename)')
 ]
 type_of_prediction_choices=['ko','cog','rfam']
 gg_version_choices=['13_5','18may2012']
@@ -63,122 +71,223 @@ script_info['optional_options'] = [\
     make_option('--load_precalc_file_in_biom',default=False,action="store_true",help='Instead of loading the precalculated file in tab-delimited format (with otu ids as row ids and traits as columns) load the data in biom format (with otu as SampleIds and traits as ObservationIds) [default: %default]'),
     make_option('--input_variance_table',default=None,type="existing_filepath",help='Precalculated table of variances corresponding to the precalculated table of function predictions.  As with the count table, these are on a per otu basis and in BIOM format (can be gzipped). Note: using this option overrides --type_of_prediction and --gg_version. [default: %default]'),
     make_option('--with_confidence',default=False,action="store_true",help='Calculate 95% confidence intervals for metagenome predictions.  By default, this uses the confidence intervals for the precalculated table of genes for greengenes OTUs.  If you pass a custom count table with -c and select this option, you must also specify a corresponding table of confidence intervals for the gene content prediction using --input_variance_table. (these are generated by running predict_traits.py with the --with_confidence option). If this flag is set, three addtional output files will be generated, named the same as the metagenome prediction output, but with .variance .upper_CI or .lower_CI appended immediately before the file extension[default: %default]'),
-  make_option('-f','--format_tab_delimited',action="store_true",default=False,help='output the predicted metagenome table in tab-delimited format [default: %default]')]
+  make_option('--prediction_server',default=None,help='url of a running prediction server (see start_prediction_server.py), e.g. http://127.0.0.1:8787. If provided, the precalculated tables held in memory by the server are used instead of loading them from disk, and the options describing which count table to load are ignored. [default: %default]'),
+  make_option('-f','--format_tab_delimited',action="store_true",default=False,help='output the predicted metagenome table in tab-delimited format [default: %default]'),
+  make_option('--processes',default=1,type='int',help='number of processes used to parse tab-delimited precalculated tables [default: %default]'),
+  make_option('-l','--limit_to_function',default=None,help='If provided, only load and predict the specified function ids.  Multiple function ids can be passed using comma delimiters. [default: %default]'),
+  make_option('--limit_to_functional_category',default=None,help='If provided, only load and predict the functions annotated with the specified categories of --metadata_category (at any level).  Multiple categories can be passed using semicolon delimiters, e.g. "Glycolysis / Gluconeogenesis;Citrate cycle (TCA cycle)". [default: %default]'),
+  make_option('--metadata_category',default='KEGG_Pathways',help='the function metadata searched by --limit_to_functional_category [default: %default]'),
+  make_option('--layered_output',default=False,action="store_true",help='With --with_confidence, write the prediction, variances and confidence intervals to a single BIOM file, storing the ids and metadata once. The file can be read by any BIOM parser as the prediction; the other values are stored under its "layers" key [default: %default]'),
+  make_option('--omit_CI_layers',default=False,action="store_true",help='With --layered_output, do not store the confidence intervals. They are calculated from the prediction and variances when the file is read. Not available with --normalize_by_otu or --normalize_by_function [default: %default]'),
+  make_option('--stream_precalc',default=False,action="store_true",help='Predict the metagenomes from blocks of the tab-delimited count table as they are parsed (by --processes processes, or a background thread), overlapping the parsing of each block with the prediction for the previous one, instead of loading the whole count table first. Not available with --with_confidence, --load_precalc_file_in_biom, --suppress_subset_loading or --prediction_server [default: %default]'),
+  make_option('--bootstrap_replicates',default=0,type='int',help='If greater than zero, also estimate 95% confidence intervals by resampling the OTU counts of each sample this many times (e.g. 1000). These reflect the uncertainty due to sequencing depth, rather than in the gene content predictions, and are written alongside the prediction with _bootstrap_lower_CI_95 and _bootstrap_upper_CI_95 appended before the file extension. Not available with --prediction_server or --stream_precalc [default: %default]'),
+  make_option('--bootstrap_seed',default=None,type='int',help='seed for the random resampling of --bootstrap_replicates, to make the confidence intervals reproducible [default: %default]'),
+  make_option('--function_index',default=None,type='existing_dirpath',help='directory of a function index built by build_function_index.py. If provided, the gene counts are read from the index instead of the count table, and the options describing which count table to load are ignored. With --limit_to_function or --limit_to_functional_category, only the postings of the selected functions are read. A warning is printed if the count table the index was built from has changed since. Not available with --with_confidence, --stream_precalc or --prediction_server [default: %default]')]
 script_info['version'] = __version__
 
 
 
 
-def determine_data_table_fp(precalc_data_dir,type_of_prediction,gg_version,\
-      user_specified_table=None,precalc_file_suffix='precalculated.tab.gz',verbose=False):
-    """Determine data table to load, allowing custom user tables or a choice of precalculated files
-   
-    precalc_data_dir -- the directory where precalculated tables of gene counts and variances are stored
-    type_of_prediction -- a string describing the type of precalculated prediction file.  
-    gg_version -- the version of greengenes the precalculated prediction was generated against
-    
-    This function assumes that precalculated files are named based on the type of prediction,
-    (KO, COG, PFAM, etc) and the greengenes version, and then end with a set suffix, which might 
-    vary between count tables and variance tables.
-    """
-    
-    if(user_specified_table is None):
-        #We assume the precalc file has a specific name (e.g. ko_13_5_precalculated.tab.gz)
-        precalc_file_name='_'.join([type_of_prediction,gg_version,\
-          precalc_file_suffix])
-        
-        input_count_table=join(precalc_data_dir,precalc_file_name)
-    else:
-        input_count_table=user_specified_table
-
-    if verbose:
-        print "Selected data table for loading: ", input_count_table
-    return input_count_table
-
-def load_data_table(data_table_fp,\
-  load_data_table_in_biom=False,suppress_subset_loading=False,ids_to_load=None,\
-  transpose=False,verbose=False):
-    """Load a data table, detecting gziiped files and subset loading
-    data_table_fp -- path to the input data table
-    
-    load_data_table_in_biom -- if True, load the data table as a BIOM table rather
-    than as tab-delimited
-
-    suppress_subset_loading -- if True, load the entire table, rather than just
-    ids_of_interest
-
-    ids_to_load -- a list of OTU ids for which data should be loaded
-
-    gzipped files are detected based on the '.gz' suffix.
-    """
-    if not path.exists(data_table_fp):
-        raise IOError("File "+data_table_fp+" doesn't exist! Did you forget to download it?")
-
-    ext=path.splitext(data_table_fp)[1]
-    if (ext == '.gz'):
-        genome_table_fh = gzip.open(data_table_fp,'rb')
-    else:
-        genome_table_fh = open(data_table_fp,'U')
-
-    if load_data_table_in_biom:
-        if not suppress_subset_loading:
-            #Now we want to use the OTU table information
-            #to load only rows in the count table corresponding
-            #to relevant OTUs
-           
-            if verbose:
-                print "Loading traits for %i organisms from the trait table" %len(ids_to_load)
-
-            genome_table = load_subset_from_biom_str(genome_table_fh.read(),ids_to_load,axis='samples')
-        else:
-            if verbose:
-                print "Loading *full* count table because --suppress_subset_loading was passed. This may result in high memory usage"
-            genome_table = parse_biom_table(genome_table_fh.read())
-    else:
-        genome_table = convert_precalc_to_biom(genome_table_fh,ids_to_load,transpose=transpose)
-    
-    if verbose:
-        print "Done loading trait table containing %i functions for %i organisms." %(len(genome_table.ObservationIds),len(genome_table.SampleIds))
-
-    return genome_table
-
-
 def main():
     option_parser, opts, args =\
        parse_command_line_parameters(**script_info)
 
-    if opts.verbose:
-        print "Loading OTU table: ",opts.input_otu_table
+    otu_table_fps = expand_otu_table_fps(opts.input_otu_table)
+    if not otu_table_fps:
+        option_parser.error("No OTU tables match: %s" % opts.input_otu_table)
+    batch_mode = len(otu_table_fps) > 1
+    if batch_mode:
+        try:
+            batch_output_fps = get_batch_output_fps(otu_table_fps,\
+              opts.output_metagenome_table,opts.accuracy_metrics,\
+              opts.format_tab_delimited)
+        except ValueError,e:
+            option_parser.error(str(e))
+
+    if opts.layered_output:
+        if not opts.with_confidence:
+            option_parser.error("--layered_output requires --with_confidence")
+        if opts.format_tab_delimited:
+            option_parser.error("--layered_output is only available in BIOM format")
+    if opts.omit_CI_layers:
+        if not opts.layered_output:
+            option_parser.error("--omit_CI_layers requires --layered_output")
+        if opts.normalize_by_otu or opts.normalize_by_function:
+            option_parser.error("--omit_CI_layers can't be used with normalized predictions, as the confidence intervals are calculated from the unnormalized prediction")
+
+    if opts.prediction_server and \
+      (opts.limit_to_function or opts.limit_to_functional_category):
+        option_parser.error("--limit_to_function and --limit_to_functional_category can't be used with --prediction_server")
+    if opts.stream_precalc and (opts.with_confidence or \
+      opts.load_precalc_file_in_biom or opts.suppress_subset_loading or \
+      opts.prediction_server):
+        option_parser.error("--stream_precalc can't be used with --with_confidence, --load_precalc_file_in_biom, --suppress_subset_loading or --prediction_server")
+
+    if opts.bootstrap_replicates < 0:
+        option_parser.error("--bootstrap_replicates can't be negative")
+    if opts.bootstrap_replicates and \
+      (opts.prediction_server or opts.stream_precalc):
+        option_parser.error("--bootstrap_replicates can't be used with --prediction_server or --stream_precalc")
+    if opts.function_index and (opts.with_confidence or \
+      opts.stream_precalc or opts.prediction_server):
+        option_parser.error("--function_index can't be used with --with_confidence, --stream_precalc or --prediction_server")
+
+    if not opts.prediction_server:
+        #Start loading the trait table(s) once, for the union of the OTUs in
+        #all tables, so that they are parsed while the OTU tables are
+        ids_to_load = get_batch_otu_ids(otu_table_fps)
+        if opts.stream_precalc:
+            genome_table_fp = get_genome_table_fp(opts)
+            precalc_blocks = open_precalc_blocks(genome_table_fp,\
+              ids_to_load,processes=opts.processes,\
+              functions_to_load=get_functions_to_load(opts,genome_table_fp),\
+              verbose=opts.verbose)
+        else:
+            loading_tables = BackgroundCall(load_genome_and_variance_tables,\
+              opts,ids_to_load)
 
-    otu_table = parse_biom_table(open(opts.input_otu_table,'U'))
-    ids_to_load = otu_table.ObservationIds
-    
-    if opts.verbose:
-        print "Done loading OTU table containing %i samples and %i OTUs." \
-          %(len(otu_table.SampleIds),len(otu_table.ObservationIds))
+    otu_tables = []
+    for otu_table_fp in otu_table_fps:
+        if opts.verbose:
+            print "Loading OTU table: ",otu_table_fp
+
+        otu_table = parse_biom_table(open(otu_table_fp,'U'))
+        otu_tables.append(otu_table)
     
+        if opts.verbose:
+            print "Done loading OTU table containing %i samples and %i OTUs." \
+              %(len(otu_table.SampleIds),len(otu_table.ObservationIds))
+
+    prenormalized = False
+    if opts.stream_precalc:
+        if MARKER_COPY_NUMBER_METADATA in precalc_blocks.col_meta_locs and \
+          (opts.accuracy_metrics or opts.normalize_by_otu):
+            option_parser.error("--accuracy_metrics and --normalize_by_otu can't be used with --stream_precalc when the count table was divided by marker gene copy number")
+        streamed_results = predict_metagenomes_from_precalc_blocks(otu_tables,\
+          precalc_blocks,accuracy_metrics=bool(opts.accuracy_metrics),\
+          verbose=opts.verbose)
+    elif not opts.prediction_server:
+        genome_table,variance_table = loading_tables.result()
+        #Count tables divided by marker gene copy number (see
+        #prenormalize_precalc.py) predict from the raw OTU tables
+        prenormalized = is_prenormalized(genome_table)
+        if prenormalized and (opts.with_confidence or opts.bootstrap_replicates):
+            option_parser.error("--with_confidence and --bootstrap_replicates can't be used when the count table was divided by marker gene copy number")
+
+    for i,(otu_table_fp,otu_table) in enumerate(zip(otu_table_fps,otu_tables)):
+        if batch_mode:
+            output_fp,accuracy_metrics_fp = batch_output_fps[i]
+        else:
+            output_fp = opts.output_metagenome_table
+            accuracy_metrics_fp = opts.accuracy_metrics
+
+        make_output_dir_for_file(output_fp)
+
+        if opts.prediction_server:
+            #The precalculated tables are already resident in the server,
+            #so we just send it the OTU table
+            if opts.verbose:
+                print "Sending OTU table to prediction server: %s" %opts.prediction_server
+            results = query_prediction_server(opts.prediction_server,\
+              format_biom_table(otu_table),with_confidence=opts.with_confidence,\
+              accuracy_metrics=bool(accuracy_metrics_fp),\
+              normalize_by_otu=opts.normalize_by_otu,\
+              normalize_by_function=opts.normalize_by_function)
+        elif opts.stream_precalc:
+            results = streamed_results[i]
+            results['prediction'] = normalize_prediction(results['prediction'],\
+              otu_table,normalize_by_otu=opts.normalize_by_otu,\
+              normalize_by_function=opts.normalize_by_function,\
+              verbose=opts.verbose)
+        else:
+            normalized_otu_table = None
+            if prenormalized and (accuracy_metrics_fp or opts.normalize_by_otu):
+                #the NSTI and OTU sums are those of the normalized OTU table
+                normalized_otu_table = normalize_by_marker_copy_number(\
+                  otu_table,genome_table)
+            results = run_metagenome_prediction(otu_table,genome_table,\
+              variance_table,with_confidence=opts.with_confidence,\
+              accuracy_metrics=bool(accuracy_metrics_fp),\
+              normalize_by_otu=opts.normalize_by_otu,\
+              normalize_by_function=opts.normalize_by_function,\
+              bootstrap_replicates=opts.bootstrap_replicates,\
+              bootstrap_seed=opts.bootstrap_seed,\
+              normalized_otu_table=normalized_otu_table,verbose=opts.verbose)
+
+        write_prediction_results(results,output_fp,accuracy_metrics_fp,\
+          opts.format_tab_delimited,layered=opts.layered_output,\
+          include_CI_layers=not opts.omit_CI_layers,verbose=opts.verbose)
+
+
+def get_genome_table_fp(opts):
+    """Return the path of the gene count table to predict from"""
     #Hardcoded loaction of the precalculated datasets for PICRUSt,
     #relative to the project directory
     precalc_data_dir=join(get_picrust_project_dir(),'picrust','data')
 
     # Load a table of gene counts by OTUs.
     #This can be either user-specified or precalculated
-    genome_table_fp = determine_data_table_fp(precalc_data_dir,\
+    return determine_data_table_fp(precalc_data_dir,\
       opts.type_of_prediction,opts.gg_version,\
       user_specified_table=opts.input_count_table,verbose=opts.verbose)
 
+def get_functions_to_load(opts,genome_table_fp,function_index=None):
+    """Return the function ids selected by the options (None for all functions)
+
+    If function_index (a FunctionIndex) is provided, categories are looked
+    up in its function metadata instead of in genome_table_fp.
+    """
+    function_ids = category_names = None
+    if opts.limit_to_function:
+        function_ids = opts.limit_to_function.split(',')
+    if opts.limit_to_functional_category:
+        category_names = opts.limit_to_functional_category.split(';')
+    if function_index is not None:
+        functions_to_load = function_index.select_functions(function_ids,\
+          category_names,metadata_category=opts.metadata_category)
+    else:
+        functions_to_load = determine_functions_to_load(genome_table_fp,\
+          function_ids=function_ids,category_names=category_names,\
+          metadata_category=opts.metadata_category,\
+          load_data_table_in_biom=opts.load_precalc_file_in_biom)
+    if opts.verbose and functions_to_load is not None:
+        print "Limiting predictions to %i functions" % len(functions_to_load)
+    return functions_to_load
+
+def load_genome_table_from_index(opts,ids_to_load):
+    """Load the gene count table for ids_to_load from opts.function_index"""
+    function_index = FunctionIndex(opts.function_index)
+    function_index.check_data_table()
     if opts.verbose:
-        print "Loading gene count data from file: %s" %genome_table_fp
-    
-    genome_table= load_data_table(genome_table_fp,\
-      load_data_table_in_biom=opts.load_precalc_file_in_biom,\
-      suppress_subset_loading=opts.suppress_subset_loading,\
-      ids_to_load=ids_to_load,verbose=opts.verbose,transpose=True)
-  
+        print "Loading gene count data from function index: %s (of %s)" \
+          %(opts.function_index,function_index.info['data_table'])
+    functions_to_load = get_functions_to_load(opts,None,function_index)
+    if opts.suppress_subset_loading:
+        ids_to_load = None
+    genome_table = function_index.get_genome_table(functions_to_load,\
+      ids_to_load)
     if opts.verbose:
-        print "Loaded %i genes across %i OTUs from gene count table" \
+        print "Loaded %i genes across %i OTUs from function index" \
           %(len(genome_table.ObservationIds),len(genome_table.SampleIds))
+    return genome_table
+
+def load_genome_and_variance_tables(opts,ids_to_load):
+    """Load the gene count table (and variance table, if needed) for ids_to_load
+
+    Returns genome_table,variance_table.  variance_table is None
+    unless opts.with_confidence is set.
+    """
+    if opts.function_index:
+        return load_genome_table_from_index(opts,ids_to_load),None
+
+    precalc_data_dir=join(get_picrust_project_dir(),'picrust','data')
+    genome_table_fp = get_genome_table_fp(opts)
+
+    if opts.verbose:
+        print "Loading gene count data from file: %s" %genome_table_fp
     
+    functions_to_load = get_functions_to_load(opts,genome_table_fp)
+
     if opts.with_confidence:
         if opts.input_variance_table:
             variance_table_fp = opts.input_variance_table
@@ -191,170 +300,51 @@ def main():
         if opts.verbose:
             print "Loading variance information from table: %s" \
             %variance_table_fp
-        
-        variance_table= load_data_table(variance_table_fp,\
+
+        #parse the variance table while the gene count table is parsed
+        loading_variance_table = BackgroundCall(load_data_table,\
+          variance_table_fp,\
           load_data_table_in_biom=opts.load_precalc_file_in_biom,\
           suppress_subset_loading=opts.suppress_subset_loading,\
-          ids_to_load=ids_to_load,transpose=True)
-        
-        if opts.verbose:
-            print "Loaded %i genes across %i OTUs from variance table" \
-              %(len(variance_table.ObservationIds),len(variance_table.SampleIds))
-        #Raise an error if the genome table and variance table differ
-        #in the genomes they contain.
-        #better to find out now than have something obscure happen latter on
-        if opts.verbose:
-            print "Checking that genome table and variance table are consistent"
-        try:
-            assert set(variance_table.ObservationIds) == set(genome_table.ObservationIds) 
-        except AssertionError,e:
-            for var_id in variance_table.ObservationIds:
-                if var_id not in genome_table.ObservationIds:
-                    print "Variance table ObsId %s not in genome_table ObsIds" %var_id
-            raise AssertionError("Variance table and genome table contain different gene ids")
-        try:
-            assert set(variance_table.SampleIds) == set(genome_table.SampleIds)
-        except AssertionError,e:
-            for var_id in variance_table.SampleIds:
-                if var_id not in genome_table.SampleIds:
-                    print "Variance table SampleId %s not in genome_table SampleIds" %var_id
-            raise AssertionError("Variance table and genome table contain different OTU ids")
-
-        #sort the ObservationIds and SampleIds to be in the same order
-        variance_table=variance_table.sortObservationOrder(genome_table.ObservationIds)
-        variance_table=variance_table.sortSampleOrder(genome_table.SampleIds)
-
-    make_output_dir_for_file(opts.output_metagenome_table)
-
-    if opts.accuracy_metrics:
-        # Calculate accuracy metrics
-        weighted_nsti = calc_nsti(otu_table,genome_table,weighted=True)
-        samples= weighted_nsti[0]
-        nstis = list(weighted_nsti[1])
-        samples_and_nstis = zip(samples,nstis)
-        if opts.verbose:
-            print "Writing NSTI information to file:", opts.accuracy_metrics
-        accuracy_output_fh = open(opts.accuracy_metrics,'w')
-        accuracy_output_fh.write("#Sample\tMetric\tValue\n")
-        for sample,nsti in samples_and_nstis:
-            line = "%s\tWeighted NSTI\t%s\n" %(sample,str(nsti))
-            accuracy_output_fh.write(line)
+          ids_to_load=ids_to_load,processes=opts.processes,\
+          functions_to_load=functions_to_load,transpose=True)
 
-    if opts.with_confidence:
-        #If we are calculating variance, we get the prediction as part
-        #of the process
-        
-        if opts.verbose:
-            print "Predicting the metagenome, metagenome variance and confidence intervals for the metagenome..."
-        
-        predicted_metagenomes,predicted_metagenome_variances,\
-        predicted_metagenomes_lower_CI_95,predicted_metagenomes_upper_CI_95=\
-          predict_metagenome_variances(otu_table,genome_table,variance_table)
-    else:
-        #If we don't need confidence intervals, we can do a faster pure numpy prediction
-        
-        if opts.verbose:
-            print "Predicting the metagenome..."
-        predicted_metagenomes = predict_metagenomes(otu_table,genome_table)
-
-    if opts.normalize_by_otu:
-        #normalize (e.g. divide) the abundances by the sum of the OTUs per sample
-        if opts.verbose:
-            print "Normalizing functional abundances by sum of OTUs per sample"
-        inverse_otu_sums = [1/x for x in otu_table.sum(axis='sample')] 
-        scaling_factors = dict(zip(otu_table.SampleIds,inverse_otu_sums))
-        predicted_metagenomes = scale_metagenomes(predicted_metagenomes,scaling_factors)
-
-    if opts.normalize_by_function:
-        #normalize (e.g. divide) the abundances by the sum of the functions per sample
-        #Sum of functional abundances per sample will equal 1 (e.g. relative abundance).
-        if opts.verbose:
-            print "Normalizing functional abundances by sum of functions per sample"
-        predicted_metagenomes = predicted_metagenomes.normObservationBySample()
-        
+    genome_table= load_data_table(genome_table_fp,\
+      load_data_table_in_biom=opts.load_precalc_file_in_biom,\
+      suppress_subset_loading=opts.suppress_subset_loading,\
+      ids_to_load=ids_to_load,processes=opts.processes,\
+      functions_to_load=functions_to_load,verbose=opts.verbose,\
+      transpose=True)
+  
+    if opts.verbose:
+        print "Loaded %i genes across %i OTUs from gene count table" \
+          %(len(genome_table.ObservationIds),len(genome_table.SampleIds))
+    
+    if not opts.with_confidence:
+        return genome_table,None
 
-    write_metagenome_to_file(predicted_metagenomes,opts.output_metagenome_table,\
-        opts.format_tab_delimited,"metagenome prediction",verbose=opts.verbose)    
+    variance_table = loading_variance_table.result()
     
-    if opts.with_confidence:
-        output_path,output_filename = split(opts.output_metagenome_table)
-        base_output_filename,ext = splitext(output_filename)
-        variance_output_fp =\
-          join(output_path,"%s_variances%s" %(base_output_filename,ext))
-        upper_CI_95_output_fp =\
-          join(output_path,"%s_upper_CI_95%s" %(base_output_filename,ext))
-        lower_CI_95_output_fp =\
-          join(output_path,"%s_lower_CI_95%s" %(base_output_filename,ext))
-
-        write_metagenome_to_file(predicted_metagenome_variances,\
-          variance_output_fp,opts.format_tab_delimited,\
-          "metagenome prediction variance",verbose=opts.verbose)    
-
-        write_metagenome_to_file(predicted_metagenomes_upper_CI_95,\
-          upper_CI_95_output_fp,opts.format_tab_delimited,\
-          "metagenome prediction upper 95% confidence interval",\
-          verbose=opts.verbose)    
-
-        write_metagenome_to_file(predicted_metagenomes_lower_CI_95,\
-          lower_CI_95_output_fp,opts.format_tab_delimited,\
-          "metagenome prediction lower 95% confidence interval",\
-          verbose=opts.verbose)    
-
-
-
-def write_metagenome_to_file(predicted_metagenome,output_fp,\
-    tab_delimited=False,verbose_filetype_message="metagenome prediction",\
-    verbose=False):
-    """Write a BIOM Table object to a file, creating the directory if needed
-    predicted_metagenome -- a BIOM table object
-    output_fp -- the filepath to write the output
-    tab_delimited -- if False, write in BIOm format, otherwise write as a tab-delimited file
-    verbose -- if True output verbose info to StdOut
-    """
+    if opts.verbose:
+        print "Loaded %i genes across %i OTUs from variance table" \
+          %(len(variance_table.ObservationIds),len(variance_table.SampleIds))
+    #Raise an error if the genome table and variance table differ
+    #in the genomes they contain.
+    #better to find out now than have something obscure happen latter on
+    if opts.verbose:
+        print "Checking that genome table and variance table are consistent"
+    for ids,id_type in [('ObservationIds','gene'),('SampleIds','OTU')]:
+        alignment = IdAlignment(getattr(variance_table,ids),\
+          getattr(genome_table,ids))
+        if not alignment.is_complete():
+            for var_id in alignment.unshared_ids(0):
+                print "Variance table %s %s not in genome_table %s" %(ids,var_id,ids)
+            raise AssertionError("Variance table and genome table contain different %s ids" % id_type)
+
+    #Genes and OTUs are matched between the tables by id during prediction,
+    #so the tables don't need to be sorted into the same order
+    return genome_table,variance_table
 
-    if verbose:
-        print "Writing %s results to output file: %s"\
-          %(verbose_filetype_message,output_fp)
-
-    make_output_dir_for_file(output_fp)
-    if tab_delimited:
-        #peek at first observation to decide on what observeration metadata
-        #to output in tab-delimited format
-        (obs_val,obs_id,obs_metadata)=\
-          predicted_metagenome.iterObservations().next()
-
-        #see if there is a metadata field that contains the "Description" 
-        #(e.g. KEGG_Description or COG_Description)
-        h = re.compile('.*Description')
-        metadata_names=filter(h.search,obs_metadata.keys())
-        if metadata_names:
-            #use the "Description" field we found
-            metadata_name=metadata_names[0]
-        elif(obs_metadata.keys()):
-            #if no "Description" metadata then just output the first 
-            #observation metadata
-            metadata_name=(obs_metadata.keys())[0]
-        else:
-            #if no observation metadata then don't output any
-            metadata_name=None
-            
-        open(output_fp,'w').write(predicted_metagenome.delimitedSelf(\
-          header_key=metadata_name,header_value=metadata_name,metadata_formatter=biom_meta_to_string))
-    else:
-        #output in BIOM format
-        open(output_fp,'w').write(format_biom_table(predicted_metagenome))
-
-def biom_meta_to_string(metadata, replace_str=':'):
-    """ Determine which format the metadata is (e.g. str, list, or list of lists) and then convert to a string"""
-
-    #Note that since ';' and '|' are used as seperators we must replace them if they exist
-    if type(metadata) ==str or type(metadata)==unicode:
-        return metadata.replace(';',replace_str)
-    elif type(metadata) == list:
-        if type(metadata[0]) == list:
-            return "|".join(";".join([y.replace(';',replace_str).replace('|',replace_str) for y in x]) for x in metadata)
-        else:
-            return ";".join(x.replace(';',replace_str) for x in metadata)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# File created on 18 Oct 2026
+from __future__ import division
+
+__author__ = "Greg Caporaso"
+__copyright__ = "Copyright 2011-2013, The PICRUSt Project"
+__credits__ = ["Greg Caporaso","Morgan Langille"]
+__license__ = "GPL"
+__version__ = "1.0.0-dev"
+__maintainer__ = "Greg Caporaso"
+__email__ = "gregcaporaso@gmail.com"
+__status__ = "Development"
+
+
+from cogent.util.option_parsing import parse_command_line_parameters, make_option
+from os.path import join
+from picrust.normalize_by_copy_number import write_prenormalized_precalc
+from picrust.predict_metagenomes import determine_data_table_fp, load_data_table
+from picrust.util import get_picrust_project_dir, make_output_dir_for_file
+
+script_info = {}
+script_info['brief_description'] = "Divide a precalculated gene count table by marker gene copy number."
+script_info['script_description'] = "Predicting metagenomes normally takes two passes over the OTU table: normalize_by_copy_number.py divides the OTU counts by marker gene copy number, and predict_metagenomes.py multiplies the normalized counts by the gene counts of each OTU. This script instead divides the precalculated gene counts of each OTU by its copy number, once. predict_metagenomes.py then predicts from raw (not normalized) OTU tables with the derived table, with the same results as normalizing first. OTUs without a copy number are kept in the derived table with zero gene counts, since normalize_by_copy_number.py drops them from the normalized OTU table."
+script_info['script_usage'] = [("","Divide the KO table for the newest version of GreenGenes by 16S copy number.","%prog -o ko_13_5_per_16S_copy.tab.gz"),
+                               ("","Divide a custom trait table by the copy numbers of a custom marker gene table.","%prog -i custom_trait_table.tab -c custom_16S_table.tab -o custom_trait_table_per_16S_copy.tab")]
+script_info['output_description']= "A tab-delimited precalculated table (gzipped if its name ends in .gz) of gene counts per marker gene copy, with the copy number of each OTU (or NA, for OTUs without one) in its MarkerCopyNumber metadata column."
+script_info['required_options'] = [
+ make_option('-o','--output_fp',type="new_filepath",help='the output precalculated table')
+]
+type_of_prediction_choices=['ko','cog','rfam']
+gg_version_choices=['13_5','18may2012']
+script_info['optional_options'] = [\
+    make_option('-t','--type_of_prediction',default=type_of_prediction_choices[0],type="choice",\
+                    choices=type_of_prediction_choices,\
+                    help='Type of functional predictions. Valid choices are: '+\
+                    ', '.join(type_of_prediction_choices)+\
+                    ' [default: %default]'),
+    make_option('-g','--gg_version',default=gg_version_choices[0],type="choice",\
+                    choices=gg_version_choices,\
+                    help='Version of GreenGenes that was used for OTU picking. Valid choices are: '+\
+                    ', '.join(gg_version_choices)+\
+                    ' [default: %default]'),
+    make_option('-i','--input_count_table',default=None,type="existing_filepath",help='Precalculated tab-delimited function predictions on per otu basis (can be gzipped). Note: using this option overrides --type_of_prediction. [default: %default]'),
+    make_option('-c','--input_copy_number_table',default=None,type="existing_filepath",help='Precalculated tab-delimited marker gene copy number predictions on per otu basis (can be gzipped). Note: using this option overrides --gg_version for the copy numbers. [default: %default]')]
+script_info['version'] = __version__
+
+
+def main():
+    option_parser, opts, args =\
+       parse_command_line_parameters(**script_info)
+
+    precalc_data_dir = join(get_picrust_project_dir(),'picrust','data')
+    data_table_fp = determine_data_table_fp(precalc_data_dir,\
+      opts.type_of_prediction,opts.gg_version,\
+      user_specified_table=opts.input_count_table,verbose=opts.verbose)
+    copy_number_table_fp = determine_data_table_fp(precalc_data_dir,\
+      '16S',opts.gg_version,user_specified_table=opts.input_copy_number_table,\
+      verbose=opts.verbose)
+
+    count_table = load_data_table(copy_number_table_fp,\
+      suppress_subset_loading=True,transpose=True,verbose=opts.verbose)
+    make_output_dir_for_file(opts.output_fp)
+    try:
+        n_written = write_prenormalized_precalc(data_table_fp,count_table,\
+          opts.output_fp,verbose=opts.verbose)
+    except ValueError,e:
+        option_parser.error(str(e))
+
+    if opts.verbose:
+        print "Wrote the gene counts per marker gene copy of %i OTUs to %s" \
+          %(n_written,opts.output_fp)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# File created on 18 Oct 2026
+from __future__ import division
+
+__author__ = "Greg Caporaso"
+__copyright__ = "Copyright 2011-2013, The PICRUSt Project"
+__credits__ = ["Greg Caporaso","Jesse Zaneveld","Morgan Langille"]
+__license__ = "GPL"
+__version__ = "1.0.0-dev"
+__maintainer__ = "Greg Caporaso"
+__email__ = "gregcaporaso@gmail.com"
+__status__ = "Development"
+
+
+from cogent.util.option_parsing import parse_command_line_parameters, make_option
+from os.path import join
+from picrust.predict_metagenomes import determine_data_table_fp,\
+  write_prediction_results
+from picrust.workflow import run_picrust_workflow
+from picrust.util import get_picrust_project_dir, make_output_dir, format_biom_table
+
+script_info = {}
+script_info['brief_description'] = "Run copy number normalization, metagenome prediction, categorization and contribution partitioning in a single process."
+script_info['script_description'] = "This script runs the steps performed by normalize_by_copy_number.py, predict_metagenomes.py, categorize_by_function.py and (optionally) metagenome_contributions.py without writing and re-parsing the intermediate tables. If --cache_dir is passed, the result of each step is cached under a hash of its input files and parameters, so rerunning with different downstream options (e.g. another categorization level) reuses the unchanged upstream steps."
+script_info['script_usage'] = [("","Normalize and predict KO metagenomes for an OTU table picked against the newest version of GreenGenes, and collapse the predictions to KEGG Pathway levels 2 and 3.","%prog -i closed_picked_otus.biom -o picrust_out -m KEGG_Pathways -l 2,3"),
+                               ("","Use custom trait tables and a cache directory, also partitioning the contributions of each OTU to K00001 and K00002.","%prog -i otu_table_for_custom_trait_table.biom --input_copy_number_table 16S_copy_numbers.tab -c custom_trait_table.tab -o picrust_out --limit_to_function K00001,K00002 --cache_dir picrust_cache")]
+script_info['output_description']= "Output files are written to the output directory: normalized_otus.biom, metagenome_predictions.biom (with _variances, _upper_CI_95 and _lower_CI_95 files if --with_confidence is passed), nsti.tab (if --accuracy_metrics is passed), metagenome_predictions.L<level>.biom (or .txt) for each categorization level, and metagenome_contributions.tab (if --limit_to_function is passed)."
+script_info['required_options'] = [
+ make_option('-i','--input_otu_table',type='existing_filepath',help='the input otu table in biom format'),
+ make_option('-o','--output_dir',type="new_dirpath",help='the output directory')
+]
+type_of_prediction_choices=['ko','cog','rfam']
+gg_version_choices=['13_5','18may2012']
+script_info['optional_options'] = [\
+    make_option('-t','--type_of_prediction',default=type_of_prediction_choices[0],type="choice",\
+                    choices=type_of_prediction_choices,\
+                    help='Type of functional predictions. Valid choices are: '+\
+                    ', '.join(type_of_prediction_choices)+\
+                    ' [default: %default]'),
+    make_option('-g','--gg_version',default=gg_version_choices[0],type="choice",\
+                    choices=gg_version_choices,\
+                    help='Version of GreenGenes that was used for OTU picking. Valid choices are: '+\
+                    ', '.join(gg_version_choices)+\
+                    ' [default: %default]'),
+    make_option('-c','--input_count_table',default=None,type="existing_filepath",help='Precalculated function predictions on per otu basis in biom format (can be gzipped). Note: using this option overrides --type_of_prediction and --gg_version. [default: %default]'),
+    make_option('--input_copy_number_table',default=None,type="existing_filepath",help='Precalculated marker gene copy number predictions on per otu basis (can be gzipped). Note: using this option overrides --gg_version for the normalization step. [default: %default]'),
+    make_option('--input_variance_table',default=None,type="existing_filepath",help='Precalculated table of variances corresponding to the precalculated table of function predictions. [default: %default]'),
+    make_option('--load_precalc_file_in_biom',default=False,action="store_true",help='Instead of loading the precalculated files in tab-delimited format (with otu ids as row ids and traits as columns) load the data in biom format (with otu as SampleIds and traits as ObservationIds) [default: %default]'),
+    make_option('-f','--input_format_classic', action="store_true", default=False,\
+                 help='input otu table (--input_otu_table) is in classic Qiime format [default: %default]'),
+    make_option('--with_confidence',default=False,action="store_true",help='Calculate 95% confidence intervals for the predicted metagenomes [default: %default]'),
+    make_option('-a','--accuracy_metrics',default=False,action="store_true",help='Also calculate the weighted Nearest Sequenced Taxon Index (NSTI) of each sample [default: %default]'),
+    make_option('-m','--metadata_category',default=None,help='the metadata category that describes the function hierarchy (e.g. KEGG_Pathways, COG_Category) used to collapse the predictions [default: %default]'),
+    make_option('-l','--levels',default=None,help='comma-separated levels in the hierarchy to collapse the predictions to. Requires --metadata_category [default: %default]'),
+    make_option('--ignore',type='string',default=None, help="Ignore the comma separated list of names while collapsing [default: %default]"),
+    make_option('--format_tab_delimited',action="store_true",default=False,help='output the collapsed tables in tab-delimited format [default: %default]'),
+    make_option('--limit_to_function',default=None,help='If provided, also partition the contributions of each OTU to the specified function ids.  Multiple function ids can be passed using comma delimiters. [default: %default]'),
+    make_option('--cache_dir',default=None,type="new_dirpath",help='directory in which to cache intermediate results between runs [default: %default]')
+]
+script_info['version'] = __version__
+
+
+def main():
+    option_parser, opts, args =\
+       parse_command_line_parameters(**script_info)
+
+    if opts.levels:
+        if not opts.metadata_category:
+            option_parser.error("--levels requires --metadata_category")
+        try:
+            levels = map(int,opts.levels.split(','))
+        except ValueError:
+            option_parser.error("--levels must be a comma-separated list of integers")
+        if min(levels) <= 0:
+            option_parser.error("level must be greater than zero!")
+    else:
+        levels = []
+
+    if opts.limit_to_function:
+        limit_to_functions = opts.limit_to_function.split(',')
+    else:
+        limit_to_functions = None
+
+    precalc_data_dir=join(get_picrust_project_dir(),'picrust','data')
+    genome_table_fp = determine_data_table_fp(precalc_data_dir,\
+      opts.type_of_prediction,opts.gg_version,\
+      user_specified_table=opts.input_count_table,verbose=opts.verbose)
+    copy_number_fp = determine_data_table_fp(precalc_data_dir,'16S',\
+      opts.gg_version,user_specified_table=opts.input_copy_number_table,\
+      verbose=opts.verbose)
+
+    variance_table_fp = None
+    if opts.with_confidence:
+        if opts.input_variance_table:
+            variance_table_fp = opts.input_variance_table
+        else:
+            variance_table_fp = determine_data_table_fp(precalc_data_dir,\
+              opts.type_of_prediction,opts.gg_version,\
+              precalc_file_suffix='precalculated_variances.tab.gz',\
+              user_specified_table=opts.input_count_table)
+
+    results = run_picrust_workflow(opts.input_otu_table,copy_number_fp,\
+      genome_table_fp,variance_table_fp=variance_table_fp,\
+      with_confidence=opts.with_confidence,\
+      accuracy_metrics=opts.accuracy_metrics,\
+      load_precalc_file_in_biom=opts.load_precalc_file_in_biom,\
+      input_format_classic=opts.input_format_classic,\
+      categorize_levels=levels,metadata_category=opts.metadata_category,\
+      ignore=opts.ignore,limit_to_functions=limit_to_functions,\
+      tab_delimited_categories=opts.format_tab_delimited,\
+      cache_dir=opts.cache_dir,verbose=opts.verbose)
+
+    if opts.verbose and results['cached_stages']:
+        print "Reused cached results for:",', '.join(results['cached_stages'])
+
+    make_output_dir(opts.output_dir)
+    open(join(opts.output_dir,'normalized_otus.biom'),'w').write(\
+      format_biom_table(results['normalized']))
+
+    accuracy_metrics_fp = None
+    if opts.accuracy_metrics:
+        accuracy_metrics_fp = join(opts.output_dir,'nsti.tab')
+    write_prediction_results(results['prediction'],\
+      join(opts.output_dir,'metagenome_predictions.biom'),\
+      accuracy_metrics_fp,verbose=opts.verbose)
+
+    if opts.format_tab_delimited:
+        ext = 'txt'
+    else:
+        ext = 'biom'
+    for level,table_str in results['categorized'].items():
+        open(join(opts.output_dir,'metagenome_predictions.L%d.%s' %(level,ext)),\
+          'w').write(table_str)
+
+    if 'contributions' in results:
+        open(join(opts.output_dir,'metagenome_contributions.tab'),'w').write(\
+          results['contributions'])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# File created on 18 Oct 2026
+from __future__ import division
+
+__author__ = "Greg Caporaso"
+__copyright__ = "Copyright 2011-2013, The PICRUSt Project"
+__credits__ = ["Greg Caporaso","Jesse Zaneveld","Morgan Langille"]
+__license__ = "GPL"
+__version__ = "1.0.0-dev"
+__maintainer__ = "Greg Caporaso"
+__email__ = "gregcaporaso@gmail.com"
+__status__ = "Development"
+
+
+from cogent.util.option_parsing import parse_command_line_parameters, make_option
+from picrust.shard import split_otu_table_by_samples, MANIFEST_FILENAME
+
+script_info = {}
+script_info['brief_description'] = "Split an OTU table into sample shards for distributed metagenome prediction."
+script_info['script_description'] = "Metagenome predictions for each sample only depend on that sample, so large OTU tables can be predicted on several nodes at once. This script splits the samples of an OTU table into contiguous shards (each keeping all of the OTUs) and writes a manifest describing them. Run predict_metagenomes.py on each shard, writing the predictions for every shard to the same directory, then use merge_shard_predictions.py with the manifest to combine them into the table predict_metagenomes.py would have written for the full OTU table."
+script_info['script_usage'] = [("","Split an OTU table into 10 shards.","%prog -i closed_picked_otus.biom -o otu_shards -n 10"),
+                               ("","Split an OTU table into shards of at most 500 samples.","%prog -i closed_picked_otus.biom -o otu_shards -s 500")]
+script_info['output_description']= "The output directory contains one BIOM OTU table per shard (shard_0000.biom, shard_0001.biom, ...) and %s, which lists the samples in each shard." % MANIFEST_FILENAME
+script_info['required_options'] = [
+ make_option('-i','--input_otu_table',type='existing_filepath',help='the input otu table in biom format'),
+ make_option('-o','--output_dir',type="new_dirpath",help='the output directory')
+]
+script_info['optional_options'] = [\
+    make_option('-n','--num_shards',default=None,type='int',help='the number of shards to split the samples into [default: %default]'),
+    make_option('-s','--samples_per_shard',default=None,type='int',help='the maximum number of samples in each shard (alternative to --num_shards) [default: %default]')]
+script_info['version'] = __version__
+
+
+def main():
+    option_parser, opts, args =\
+       parse_command_line_parameters(**script_info)
+
+    if (opts.num_shards is None) == (opts.samples_per_shard is None):
+        option_parser.error("Exactly one of --num_shards or --samples_per_shard must be passed")
+
+    manifest = split_otu_table_by_samples(opts.input_otu_table,opts.output_dir,\
+      num_shards=opts.num_shards,samples_per_shard=opts.samples_per_shard)
+
+    if opts.verbose:
+        print "Split %i samples into %i shards" \
+          %(len(manifest['sample_ids']),len(manifest['shards']))
+
+if __name__ == "__main__":
+    main()
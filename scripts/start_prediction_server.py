@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# File created on 18 Oct 2026
+from __future__ import division
+
+__author__ = "Greg Caporaso"
+__copyright__ = "Copyright 2011-2013, The PICRUSt Project"
+__credits__ = ["Greg Caporaso","Jesse Zaneveld","Morgan Langille"]
+__license__ = "GPL"
+__version__ = "1.0.0-dev"
+__maintainer__ = "Greg Caporaso"
+__email__ = "gregcaporaso@gmail.com"
+__status__ = "Development"
+
+
+from cogent.util.option_parsing import parse_command_line_parameters, make_option
+from os.path import join
+from time import time
+from picrust.predict_metagenomes import determine_data_table_fp,load_data_table
+from picrust.prediction_server import PredictionServer, ServerMetrics
+from picrust.util import get_picrust_project_dir
+
+script_info = {}
+script_info['brief_description'] = "Start a local server that keeps precalculated PICRUSt tables in memory for repeated metagenome predictions."
+script_info['script_description'] = "Loading the precalculated gene count tables dominates the run time of predict_metagenomes.py. This script loads the full count table (and optionally the variance table) once and then serves predictions over HTTP on localhost until it is stopped. Pass --prediction_server to predict_metagenomes.py to use it. Load and latency metrics are available at /metrics."
+script_info['script_usage'] = [("","Serve KO predictions for OTU tables picked against the newest version of GreenGenes on port 8787.","%prog"),
+                               ("","Serve predictions and confidence intervals from a custom trait table.","%prog -c custom_trait_table.tab --input_variance_table custom_trait_table_variances.tab --with_confidence -p 8788")]
+script_info['output_description']= "No output files are written. The server runs until interrupted."
+script_info['required_options'] = []
+type_of_prediction_choices=['ko','cog','rfam']
+gg_version_choices=['13_5','18may2012']
+script_info['optional_options'] = [\
+    make_option('-t','--type_of_prediction',default=type_of_prediction_choices[0],type="choice",\
+                    choices=type_of_prediction_choices,\
+                    help='Type of functional predictions. Valid choices are: '+\
+                    ', '.join(type_of_prediction_choices)+\
+                    ' [default: %default]'),
+    make_option('-g','--gg_version',default=gg_version_choices[0],type="choice",\
+                    choices=gg_version_choices,\
+                    help='Version of GreenGenes that was used for OTU picking. Valid choices are: '+\
+                    ', '.join(gg_version_choices)+\
+                    ' [default: %default]'),
+    make_option('-c','--input_count_table',default=None,type="existing_filepath",help='Precalculated function predictions on per otu basis in biom format (can be gzipped). Note: using this option overrides --type_of_prediction and --gg_version. [default: %default]'),
+    make_option('--load_precalc_file_in_biom',default=False,action="store_true",help='Instead of loading the precalculated file in tab-delimited format (with otu ids as row ids and traits as columns) load the data in biom format (with otu as SampleIds and traits as ObservationIds) [default: %default]'),
+    make_option('--input_variance_table',default=None,type="existing_filepath",help='Precalculated table of variances corresponding to the precalculated table of function predictions. [default: %default]'),
+    make_option('--with_confidence',default=False,action="store_true",help='Also keep the variance table resident so that clients can request 95% confidence intervals [default: %default]'),
+    make_option('--host',default='127.0.0.1',help='the address to listen on. Only change this if you understand the security implications of serving on a public interface [default: %default]'),
+    make_option('-p','--port',default=8787,type='int',help='the port to listen on [default: %default]'),
+    make_option('--processes',default=1,type='int',help='number of processes used to parse tab-delimited precalculated tables [default: %default]')]
+script_info['version'] = __version__
+
+
+def main():
+    option_parser, opts, args =\
+       parse_command_line_parameters(**script_info)
+
+    precalc_data_dir=join(get_picrust_project_dir(),'picrust','data')
+    metrics = ServerMetrics()
+
+    genome_table_fp = determine_data_table_fp(precalc_data_dir,\
+      opts.type_of_prediction,opts.gg_version,\
+      user_specified_table=opts.input_count_table,verbose=opts.verbose)
+    start = time()
+    genome_table = load_data_table(genome_table_fp,\
+      load_data_table_in_biom=opts.load_precalc_file_in_biom,\
+      suppress_subset_loading=True,transpose=True,\
+      processes=opts.processes,verbose=opts.verbose)
+    metrics.record_load('genome_table',time()-start)
+
+    variance_table = None
+    if opts.with_confidence:
+        if opts.input_variance_table:
+            variance_table_fp = opts.input_variance_table
+        else:
+            variance_table_fp = determine_data_table_fp(precalc_data_dir,\
+              opts.type_of_prediction,opts.gg_version,\
+              precalc_file_suffix='precalculated_variances.tab.gz',\
+              user_specified_table=opts.input_count_table)
+        start = time()
+        variance_table = load_data_table(variance_table_fp,\
+          load_data_table_in_biom=opts.load_precalc_file_in_biom,\
+          suppress_subset_loading=True,transpose=True,\
+          processes=opts.processes,verbose=opts.verbose)
+        metrics.record_load('variance_table',time()-start)
+
+    server = PredictionServer((opts.host,opts.port),genome_table,\
+      variance_table=variance_table,metrics=metrics,verbose=opts.verbose)
+    print "Serving predictions for %i functions across %i OTUs on http://%s:%i" \
+      %(len(genome_table.ObservationIds),len(genome_table.SampleIds),\
+      opts.host,server.server_address[1])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# File created on 18 Oct 2026
+from __future__ import division
+
+__author__ = "Greg Caporaso"
+__copyright__ = "Copyright 2011-2013, The PICRUSt Project"
+__credits__ = ["Greg Caporaso","Jesse Zaneveld","Morgan Langille"]
+__license__ = "GPL"
+__version__ = "1.0.0-dev"
+__maintainer__ = "Greg Caporaso"
+__email__ = "gregcaporaso@gmail.com"
+__status__ = "Development"
+
+
+import sys
+from cogent.util.option_parsing import parse_command_line_parameters, make_option
+from os.path import join
+from picrust.predict_metagenomes import determine_data_table_fp,\
+  load_data_table,determine_functions_to_load,open_precalc_blocks
+from picrust.streaming import SamplePredictor, stream_predictions
+from picrust.util import get_picrust_project_dir
+
+script_info = {}
+script_info['brief_description'] = "Predict metagenomes for samples read one at a time from standard input."
+script_info['script_description'] = "For pipelines that produce OTU counts continuously, one sample at a time. The precalculated count table is loaded once and kept in memory, and each sample read from standard input is predicted and written to standard output (and flushed) as soon as it is read, so there is no need to assemble a BIOM OTU table first. Samples are read as JSON lines (e.g. {\"sample_id\": \"S1\", \"counts\": {\"OTU1\": 3, \"OTU2\": 1}}) or as tab-delimited rows following a header line of OTU ids (e.g. '#SampleID<tab>OTU1<tab>OTU2'), and predictions are written in the same format. Samples containing OTUs that are not in the precalculated table are reported on standard error and skipped."
+script_info['script_usage'] = [("","Predict KO abundances for JSON lines produced by another program.","sample_counts_producer | %prog -f json > predicted_metagenomes.jsonl"),
+                               ("","Predict metagenomes and NSTI values for tab-delimited rows using a custom trait table.","cat sample_rows.tab | %prog -c custom_trait_table.tab -a > predicted_metagenomes.tab")]
+script_info['output_description']= "One line per sample is written to standard output: a tab-delimited row of function counts (after a header line of function ids), or a JSON object with the nonzero function counts under 'prediction'."
+script_info['required_options'] = []
+type_of_prediction_choices=['ko','cog','rfam']
+gg_version_choices=['13_5','18may2012']
+input_format_choices=['tab','json']
+script_info['optional_options'] = [\
+    make_option('-t','--type_of_prediction',default=type_of_prediction_choices[0],type="choice",\
+                    choices=type_of_prediction_choices,\
+                    help='Type of functional predictions. Valid choices are: '+\
+                    ', '.join(type_of_prediction_choices)+\
+                    ' [default: %default]'),
+    make_option('-g','--gg_version',default=gg_version_choices[0],type="choice",\
+                    choices=gg_version_choices,\
+                    help='Version of GreenGenes that was used for OTU picking. Valid choices are: '+\
+                    ', '.join(gg_version_choices)+\
+                    ' [default: %default]'),
+    make_option('-c','--input_count_table',default=None,type="existing_filepath",help='Precalculated function predictions on per otu basis in biom format (can be gzipped). Note: using this option overrides --type_of_prediction and --gg_version. [default: %default]'),
+    make_option('--load_precalc_file_in_biom',default=False,action="store_true",help='Instead of loading the precalculated file in tab-delimited format (with otu ids as row ids and traits as columns) load the data in biom format (with otu as SampleIds and traits as ObservationIds) [default: %default]'),
+    make_option('-f','--input_format',default=input_format_choices[0],type="choice",\
+                    choices=input_format_choices,\
+                    help='Format of the samples read from standard input (predictions are written in the same format). Valid choices are: '+\
+                    ', '.join(input_format_choices)+\
+                    ' [default: %default]'),
+    make_option('-a','--accuracy_metrics',default=False,action="store_true",help='Also calculate the weighted Nearest Sequenced Taxon Index (NSTI) of each sample [default: %default]'),
+    make_option('-l','--limit_to_function',default=None,help='If provided, only load and predict the specified function ids.  Multiple function ids can be passed using comma delimiters. [default: %default]'),
+    make_option('--processes',default=1,type='int',help='number of processes used to parse tab-delimited precalculated tables [default: %default]')]
+script_info['version'] = __version__
+
+
+def main():
+    option_parser, opts, args =\
+       parse_command_line_parameters(**script_info)
+
+    precalc_data_dir=join(get_picrust_project_dir(),'picrust','data')
+    genome_table_fp = determine_data_table_fp(precalc_data_dir,\
+      opts.type_of_prediction,opts.gg_version,\
+      user_specified_table=opts.input_count_table,verbose=opts.verbose)
+
+    function_ids = None
+    if opts.limit_to_function:
+        function_ids = opts.limit_to_function.split(',')
+    functions_to_load = determine_functions_to_load(genome_table_fp,\
+      function_ids=function_ids,\
+      load_data_table_in_biom=opts.load_precalc_file_in_biom)
+
+    #The samples aren't known in advance, so load the table for all OTUs
+    if opts.load_precalc_file_in_biom:
+        genome_table = load_data_table(genome_table_fp,\
+          load_data_table_in_biom=True,suppress_subset_loading=True,\
+          transpose=True,functions_to_load=functions_to_load,\
+          verbose=opts.verbose)
+        predictor = SamplePredictor(genome_table,\
+          accuracy_metrics=opts.accuracy_metrics)
+        del genome_table
+    else:
+        #keep only the nonzero counts of each block, rather than loading
+        #the whole (mostly zero) table as a dense array
+        reader = open_precalc_blocks(genome_table_fp,\
+          processes=opts.processes,functions_to_load=functions_to_load)
+        predictor = SamplePredictor.from_precalc_blocks(reader,\
+          accuracy_metrics=opts.accuracy_metrics)
+    if opts.verbose:
+        sys.stderr.write("Ready to predict %i functions across %i OTUs\n" \
+          %(len(predictor.function_ids),len(predictor.otu_ids)))
+
+    #read line by line, rather than with the file iterator's read-ahead
+    #buffer, so each sample is predicted as soon as its line arrives
+    lines = iter(sys.stdin.readline,'')
+    n_predicted = stream_predictions(predictor,lines,sys.stdout,\
+      input_format=opts.input_format,error_fh=sys.stderr)
+    if opts.verbose:
+        sys.stderr.write("Predicted metagenomes for %i samples\n" % n_predicted)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# File created on 18 Oct 2026
+from __future__ import division
+
+__author__ = "Daniel McDonald"
+__copyright__ = "Copyright 2011-2013, The PICRUSt Project"
+__credits__ = ["Daniel McDonald", "Morgan Langille", "Jesse Zaneveld"]
+__license__ = "GPL"
+__version__ = "1.0.0-dev"
+__maintainer__ = "Daniel McDonald"
+__email__ = "mcdonadt@colorado.edu"
+__status__ = "Development"
+
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from numpy import array
+from cogent.util.unit_test import TestCase, main
+from biom.table import table_factory, SparseGeneTable, DenseGeneTable,\
+  TableException
+from picrust.categorize_by_function import categorize_by_function,\
+  categorize_by_function_levels, compile_category_aggregation,\
+  make_collapse_f, write_categorized_precalc
+from picrust.predict_metagenomes import load_data_table
+from picrust.util import get_table_data_array
+
+class CategorizeByFunctionTests(TestCase):
+    """ Tests of categorize_by_function """
+
+    def setUp(self):
+        self.data = array([[1.0,2.0],[3.0,0.0],[0.0,5.0],[7.0,1.0]])
+        self.metadata = [{'KEGG_Pathways':[['A','x'],['B','y']]},\
+          {'KEGG_Pathways':[['A','x'],['A','z']]},\
+          {'KEGG_Pathways':[['B'],['B','y']]},\
+          {'KEGG_Pathways':[['unclassified','u']]}]
+        self.table = table_factory(self.data,['S1','S2'],\
+          ['K1','K2','K3','K4'],None,self.metadata,\
+          constructor=SparseGeneTable)
+
+    def test_compile_category_aggregation(self):
+        """ compile_category_aggregation lists an entry for each time an observation is in a category"""
+        category_ids,category_metadata,categories,observations = \
+          compile_category_aggregation(self.metadata,'KEGG_Pathways',2)
+        self.assertEqual(category_ids,['u','x','y','z'])
+        self.assertEqual(category_metadata,[{'KEGG_Pathways':['unclassified','u']},\
+          {'KEGG_Pathways':['A','x']},{'KEGG_Pathways':['B','y']},\
+          {'KEGG_Pathways':['A','z']}])
+        #K3's first path doesn't reach level 2, so none of its paths count
+        self.assertEqual(categories.tolist(),[1,2,1,3,0])
+        self.assertEqual(observations.tolist(),[0,0,1,1,3])
+
+    def test_categorize_by_function(self):
+        """ categorize_by_function counts observations once per path into each category"""
+        obs = categorize_by_function(self.table,'KEGG_Pathways',1)
+        self.assertEqual(obs.ObservationIds,('A','B','unclassified'))
+        self.assertEqual(obs.SampleIds,('S1','S2'))
+        self.assertFloatEqual(get_table_data_array(obs),\
+          [[7.0,2.0],[1.0,12.0],[7.0,1.0]])
+        self.assertEqual(obs.ObservationMetadata[1],{'KEGG_Pathways':['B']})
+        self.assertEqual(obs._biom_matrix_type,'sparse')
+
+        obs = categorize_by_function(self.table,'KEGG_Pathways',1,\
+          ignore='unclassified')
+        self.assertEqual(obs.ObservationIds,('A','B'))
+
+        self.assertRaises(ValueError,categorize_by_function,self.table,\
+          'KEGG_Pathways',0)
+        self.assertRaises(TableException,categorize_by_function,self.table,\
+          'KEGG_Pathways',3)
+
+    def test_categorize_by_function_levels(self):
+        """ categorize_by_function_levels matches collapsing the table to each level"""
+        dense_table = table_factory(self.data,['S1','S2'],\
+          ['K1','K2','K3','K4'],None,self.metadata,constructor=DenseGeneTable)
+        for table in (self.table,dense_table):
+            results = categorize_by_function_levels(table,'KEGG_Pathways',\
+              [2,1],ignore='u')
+            for level,obs in zip([2,1],results):
+                exp = table.collapseObservationsByMetadata(\
+                  make_collapse_f('KEGG_Pathways',level,'u'),one_to_many=True,\
+                  norm=False,one_to_many_md_key='KEGG_Pathways')
+                self.assertEqual(obs.ObservationIds,exp.ObservationIds)
+                self.assertEqual(obs.ObservationMetadata,exp.ObservationMetadata)
+                self.assertEqual(obs.__class__,exp.__class__)
+                self.assertFloatEqual(get_table_data_array(obs),\
+                  get_table_data_array(exp))
+            self.assertEqual(results[0].ObservationIds,('x','y','z'))
+
+    def test_write_categorized_precalc(self):
+        """ write_categorized_precalc writes precalc tables collapsed as by categorize_by_function"""
+        tmp_dir = mkdtemp(prefix='picrust_categorize_tests')
+        try:
+            data_table_fp = join(tmp_dir,'precalc.tab')
+            open(data_table_fp,'w').write(precalc1)
+            level_output_fps = [(1,join(tmp_dir,'precalc.L1.tab')),\
+              (2,join(tmp_dir,'precalc.L2.tab.gz'))]
+            n_written = write_categorized_precalc(data_table_fp,\
+              'KEGG_Pathways',level_output_fps)
+            self.assertEqual(n_written,3)
+
+            genome_table = load_data_table(data_table_fp,\
+              suppress_subset_loading=True,transpose=True)
+            for level,output_fp in level_output_fps:
+                obs = load_data_table(output_fp,suppress_subset_loading=True,\
+                  transpose=True)
+                exp = categorize_by_function(genome_table,'KEGG_Pathways',level)
+                self.assertEqual(obs.ObservationIds,exp.ObservationIds)
+                self.assertEqual(obs.SampleIds,('OTU1','OTU2','OTU3'))
+                self.assertEqual(obs.SampleMetadata,exp.SampleMetadata)
+                self.assertFloatEqual(get_table_data_array(obs),\
+                  get_table_data_array(exp))
+            self.assertEqual(get_table_data_array(obs).tolist(),\
+              [[1.5,1.0,3.0],[1.5,1.0,3.0],[0.0,2.0,0.0]])
+            self.assertEqual(obs.ObservationMetadata[2],\
+              {'KEGG_Pathways':['Genetic','Replication']})
+
+            self.assertRaises(ValueError,write_categorized_precalc,\
+              data_table_fp,'COG_Category',[(1,join(tmp_dir,'cog.tab'))])
+        finally:
+            rmtree(tmp_dir)
+
+precalc1 = """#OTU_IDs\tK1\tK2\tK3\tmetadata_NSTI
+OTU1\t1.5\t0.0\t0.0\t0.1
+OTU2\t0.0\t1.0\t2.0\t0.2
+metadata_KEGG_Pathways\tMetabolism;Glycolysis|Metabolism;Citrate cycle\tMetabolism;Glycolysis|Metabolism;Citrate cycle\tGenetic;Replication
+OTU3\t0.0\t3.0\t0.0\t0.3
+"""
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# File created on 18 Oct 2026
+from __future__ import division
+
+__author__ = "Greg Caporaso"
+__copyright__ = "Copyright 2011-2013, The PICRUSt Project"
+__credits__ = ["Greg Caporaso"]
+__license__ = "GPL"
+__version__ = "1.0.0-dev"
+__maintainer__ = "Greg Caporaso"
+__email__ = "gregcaporaso@gmail.com"
+__status__ = "Development"
+
+from os import remove
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from warnings import catch_warnings, simplefilter
+from cogent.util.unit_test import TestCase, main
+from picrust.function_index import build_function_index, FunctionIndex
+from picrust.predict_metagenomes import load_data_table
+
+class FunctionIndexTests(TestCase):
+    """ Tests of the function to OTU index over precalculated tables """
+
+    def setUp(self):
+        self.tmp_dir = mkdtemp(prefix='picrust_function_index_tests')
+        self.data_table_fp = join(self.tmp_dir,'genome_table1.tab')
+        open(self.data_table_fp,'w').write(genome_table1)
+        self.index_dir = join(self.tmp_dir,'index')
+        self.n_postings = build_function_index(self.data_table_fp,\
+          self.index_dir)
+        self.index = FunctionIndex(self.index_dir)
+
+    def tearDown(self):
+        rmtree(self.tmp_dir)
+
+    def test_build_function_index(self):
+        """ build_function_index indexes the nonzero counts of each function"""
+        self.assertEqual(self.n_postings,8)
+        self.assertEqual(self.index.function_ids,['K00001','K00002','K00003'])
+        self.assertEqual(self.index.otu_ids,['A','B','C','D'])
+        self.assertEqual(self.index.info['data_table'],self.data_table_fp)
+        self.assertEqual(self.index.info['n_postings'],8)
+        self.assertRaises(IOError,FunctionIndex,self.tmp_dir)
+
+    def test_lookup(self):
+        """ lookup and postings return the OTUs with a function, in file order"""
+        self.assertEqual(self.index.lookup('K00001'),\
+          [('A',1.0),('B',1.0),('C',2.0)])
+        self.assertEqual(self.index.lookup('K00003'),[('B',3.0),('C',1.0)])
+        otu_idxs,counts = self.index.postings('K00002')
+        self.assertEqual(otu_idxs.tolist(),[0,2,3])
+        self.assertEqual(counts.tolist(),[2.0,1.0,5.0])
+        self.assertRaises(KeyError,self.index.lookup,'K99999')
+
+    def test_check_data_table(self):
+        """ check_data_table warns if the indexed table changed"""
+        with catch_warnings(record=True) as w:
+            simplefilter('always')
+            self.assertTrue(self.index.check_data_table())
+            open(self.data_table_fp,'a').write('\n')
+            self.assertFalse(self.index.check_data_table())
+            self.assertEqual(len(w),1)
+            self.assertTrue('has changed' in str(w[0].message))
+            #a table that was moved can't be checked
+            remove(self.data_table_fp)
+            self.assertTrue(self.index.check_data_table())
+            self.assertEqual(len(w),1)
+
+    def test_select_functions(self):
+        """ select_functions finds functions by id and category"""
+        self.assertEqual(self.index.select_functions(),None)
+        self.assertEqual(self.index.select_functions(['K00003'],\
+          ['Glycolysis']),['K00003','K00001'])
+        self.assertEqual(self.index.select_functions(\
+          category_names=['Metabolism']),['K00001','K00003'])
+        self.assertRaises(ValueError,self.index.select_functions,\
+          category_names=['Motility'])
+
+    def test_get_genome_table(self):
+        """ get_genome_table matches the table loaded from the precalculated file"""
+        for functions_to_load,ids_to_load in [(None,None),\
+          (['K00003','K00001'],None),(None,['D','A']),(['K00002'],['B','C'])]:
+            exp = load_data_table(self.data_table_fp,\
+              ids_to_load=ids_to_load,functions_to_load=functions_to_load,\
+              transpose=True)
+            obs = self.index.get_genome_table(functions_to_load,ids_to_load)
+            self.assertEqual(obs,exp)
+        self.assertRaises(ValueError,self.index.get_genome_table,\
+          ['K00001','K99999'])
+        self.assertRaises(ValueError,self.index.get_genome_table,\
+          None,['A','E'])
+
+
+genome_table1 = """#OTU_IDs\tK00001\tK00002\tK00003\tmetadata_NSTI
+metadata_KEGG_Pathways\tMetabolism;Carbohydrate Metabolism;Glycolysis\tGenetic Information Processing;Replication and Repair;DNA replication\tMetabolism;Energy Metabolism;Oxidative phosphorylation
+A\t1.0\t2.0\t0.0\t0.0
+B\t1.0\t0.0\t3.0\t0.1
+C\t2.0\t1.0\t1.0\t0.2
+D\t0.0\t5.0\t0.0\t0.3
+"""
+
+if __name__ == "__main__":
+    main()
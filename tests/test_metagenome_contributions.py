@@ -12,10 +12,18 @@ __email__ = "zaneveld@gmail.com"
 __status__ = "Development"
  
 
+from numpy import array
 from cogent.util.unit_test import TestCase, main
 from biom.parse import parse_biom_table_str
 from biom.table import DenseTable
-from picrust.metagenome_contributions import partition_metagenome_contributions
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+import gzip
+from picrust.metagenome_contributions import partition_metagenome_contributions,\
+  iter_metagenome_contributions,write_contributions,format_contributions,\
+  write_columnar_contributions,load_columnar_contributions,CONTRIBUTIONS_HEADER,\
+  select_top_contributions,write_contributions_in_parallel
 from picrust.predict_metagenomes import predict_metagenomes,\
   calc_nsti,get_overlapping_ids, extract_otu_and_genome_data
 
@@ -30,7 +38,10 @@ class PartitionMetagenomeTests(TestCase):
         self.predicted_metagenome_table1 = parse_biom_table_str(predicted_metagenome_table1)
         self.predicted_gene_partition_table = predicted_gene_partition_table
         self.predicted_gene_partition_table_with_taxonomy = predicted_gene_partition_table_with_taxonomy
+        self.tmp_dir = mkdtemp(prefix='picrust_contributions_tests')
 
+    def tearDown(self):
+        rmtree(self.tmp_dir)
 
     def test_partition_metagenome_contributions_with_taxonomy(self):
         obs = partition_metagenome_contributions(self.otu_table_with_taxonomy,self.genome_table1)
@@ -116,6 +127,127 @@ class PartitionMetagenomeTests(TestCase):
         #Having validated that this looks OK, just compare to hand-checked result
         self.assertEqual(obs_text,exp_text)
        
+    def test_partition_metagenome_contributions_keeps_zero_rows(self):
+        """partition_metagenome_contributions lists every gene, sample and OTU if remove_zero_rows is False"""
+        obs = partition_metagenome_contributions(self.otu_table1,\
+          self.genome_table1,remove_zero_rows=False,verbose=False)
+        self.assertEqual(len(obs),1+3*4*3)
+        self.assertEqual([row[:3] for row in obs[1:4]],[['f1','Sample1','GG_OTU_1'],\
+          ['f1','Sample1','GG_OTU_2'],['f1','Sample1','GG_OTU_3']])
+        self.assertEqual(obs[3][3:8],[2.0,0.0,0.0,0.0,0.0])
+        exp = partition_metagenome_contributions(self.otu_table1,\
+          self.genome_table1,verbose=False)
+        self.assertEqual([row for row in obs[1:] if row[5]],exp[1:])
+
+    def test_iter_metagenome_contributions(self):
+        """iter_metagenome_contributions yields the rows of each gene in turn"""
+        obs = list(iter_metagenome_contributions(self.otu_table_with_taxonomy,\
+          self.genome_table1,verbose=False))
+        self.assertEqual([set(row[0] for row in rows) for rows in obs],\
+          [set(['f1']),set(['f2']),set(['f3'])])
+        exp = partition_metagenome_contributions(self.otu_table_with_taxonomy,\
+          self.genome_table1,verbose=False)
+        self.assertEqual(obs[0]+obs[1]+obs[2],exp[1:])
+
+    def test_write_contributions(self):
+        """write_contributions writes the formatted contributions, gzipped if requested"""
+        exp = format_contributions(partition_metagenome_contributions(\
+          self.otu_table_with_taxonomy,self.genome_table1,verbose=False))
+        for fn,open_f in [('contributions.tab',open),\
+          ('contributions.tab.gz',gzip.open)]:
+            fp = join(self.tmp_dir,fn)
+            n_rows = write_contributions(iter_metagenome_contributions(\
+              self.otu_table_with_taxonomy,self.genome_table1,verbose=False),fp)
+            self.assertEqual(n_rows,14)
+            self.assertEqual(open_f(fp).read(),exp)
+
+    def test_write_contributions_in_parallel(self):
+        """write_contributions_in_parallel writes the same output as write_contributions"""
+        for kwargs in [{},{'top_k':1},{'limit_to_functions':['f3','f1']}]:
+            exp_fp = join(self.tmp_dir,'exp.tab')
+            exp_rows = write_contributions(iter_metagenome_contributions(\
+              self.otu_table_with_taxonomy,self.genome_table1,verbose=False,\
+              **kwargs),exp_fp)
+            for fn,processes in [('obs.tab',2),('obs.tab.gz',3)]:
+                obs_fp = join(self.tmp_dir,fn)
+                self.assertEqual(write_contributions_in_parallel(\
+                  self.otu_table_with_taxonomy,self.genome_table1,obs_fp,\
+                  processes,verbose=False,**kwargs),exp_rows)
+                open_f = gzip.open if fn.endswith('.gz') else open
+                self.assertEqual(open_f(obs_fp).read(),open(exp_fp).read())
+
+        exp_fp = join(self.tmp_dir,'exp.npz')
+        obs_fp = join(self.tmp_dir,'obs.npz')
+        write_columnar_contributions(self.otu_table_with_taxonomy,\
+          self.genome_table1,exp_fp,verbose=False)
+        write_columnar_contributions(self.otu_table_with_taxonomy,\
+          self.genome_table1,obs_fp,processes=2,verbose=False)
+        exp = load_columnar_contributions(exp_fp)
+        obs = load_columnar_contributions(obs_fp)
+        for column in CONTRIBUTIONS_HEADER:
+            self.assertEqual(obs[column].tolist(),exp[column].tolist())
+
+    def test_columnar_contributions(self):
+        """write_columnar_contributions round-trips through load_columnar_contributions"""
+        fp = join(self.tmp_dir,'contributions.npz')
+        self.assertEqual(write_columnar_contributions(self.otu_table_with_taxonomy,\
+          self.genome_table1,fp,verbose=False),14)
+        obs = load_columnar_contributions(fp)
+        exp = partition_metagenome_contributions(self.otu_table_with_taxonomy,\
+          self.genome_table1,verbose=False)
+        self.assertEqual(sorted(obs),sorted(CONTRIBUTIONS_HEADER))
+        self.assertEqual(zip(*[obs[column].tolist() for column in \
+          CONTRIBUTIONS_HEADER]),map(tuple,exp[1:]))
+
+    def test_load_columnar_contributions_filters(self):
+        """load_columnar_contributions loads only the requested columns and rows"""
+        fp = join(self.tmp_dir,'contributions.npz')
+        write_columnar_contributions(self.otu_table1,self.genome_table1,fp,\
+          verbose=False)
+        obs = load_columnar_contributions(fp,columns=['OTU',\
+          'CountContributedByOTU','Kingdom'],genes=['f1'],samples=['Sample4','x'])
+        self.assertEqual(sorted(obs),['CountContributedByOTU','Kingdom','OTU'])
+        self.assertEqual(obs['OTU'].tolist(),['GG_OTU_1','GG_OTU_2','GG_OTU_3'])
+        self.assertEqual(obs['CountContributedByOTU'].tolist(),[5.0,6.0,8.0])
+        #OTUs without taxonomy have empty taxonomy columns
+        self.assertEqual(obs['Kingdom'].tolist(),['','',''])
+        self.assertEqual(len(load_columnar_contributions(fp,columns=['Gene'],\
+          otus=['GG_OTU_3'])['Gene']),4)
+        self.assertRaises(ValueError,load_columnar_contributions,fp,['Genes'])
+
+    def test_partition_metagenome_contributions_top_k(self):
+        """partition_metagenome_contributions sums all but the top_k contributors into an Other row"""
+        obs = partition_metagenome_contributions(self.otu_table_with_taxonomy,\
+          self.genome_table1,top_k=1,verbose=False)
+        f1_sample4 = [row for row in obs[1:] if row[:2] == ['f1','Sample4']]
+        self.assertEqual([row[2] for row in f1_sample4],['GG_OTU_3','Other'])
+        #GG_OTU_1 (5 copies from 5 organisms) and GG_OTU_2 (6 from 2)
+        self.assertFloatEqual(f1_sample4[1][3:8],[11/7,7.0,11.0,11/19,11/45])
+        self.assertEqual(f1_sample4[1][8:],[])
+        #samples with a single contributor are unchanged
+        exp = partition_metagenome_contributions(self.otu_table_with_taxonomy,\
+          self.genome_table1,verbose=False)
+        self.assertEqual([row for row in obs if row[0] == 'f2'],\
+          [row for row in exp if row[0] == 'f2'])
+
+        obs = partition_metagenome_contributions(self.otu_table1,\
+          self.genome_table1,min_fraction=0.35,verbose=False)
+        self.assertEqual([row[2] for row in obs[1:] if row[:2] == ['f1','Sample4']],\
+          ['GG_OTU_3','Other'])
+        self.assertEqual([row[2] for row in obs[1:] if row[:2] == ['f1','Sample2']],\
+          ['GG_OTU_1','GG_OTU_2'])
+
+    def test_select_top_contributions(self):
+        """select_top_contributions keeps the top_k contributions of each sample, with ties broken by position"""
+        sample_idxs = array([0,0,0,1,1,2])
+        counts = array([1.0,3.0,3.0,2.0,5.0,4.0])
+        percents = array([1/7,3/7,3/7,2/7,5/7,1.0])
+        self.assertEqual(select_top_contributions(sample_idxs,counts,\
+          percents,top_k=1).tolist(),[False,True,False,False,True,True])
+        self.assertEqual(select_top_contributions(sample_idxs,counts,\
+          percents,top_k=2,min_fraction=0.3).tolist(),\
+          [False,True,True,False,True,True])
+
 otu_table1 = """{"rows": [{"id": "GG_OTU_1", "metadata": null}, {"id": "GG_OTU_2", "metadata": null}, {"id": "GG_OTU_3", "metadata": null}], "format": "Biological Observation Matrix v0.9", "data": [[0, 0, 1.0], [0, 1, 2.0], [0, 2, 3.0], [0, 3, 5.0], [1, 0, 5.0], [1, 1, 1.0], [1, 3, 2.0], [2, 2, 1.0], [2, 3, 4.0]], "columns": [{"id": "Sample1", "metadata": null}, {"id": "Sample2", "metadata": null}, {"id": "Sample3", "metadata": null}, {"id": "Sample4", "metadata": null}], "generated_by": "QIIME 1.4.0-dev, svn revision 2753", "matrix_type": "sparse", "shape": [3, 4], "format_url": "http://www.qiime.org/svn_documentation/documentation/biom_format.html", "date": "2012-02-22T20:50:05.024661", "type": "OTU table", "id": null, "matrix_element_type": "float"}"""
 
 otu_table_with_taxonomy = """{"rows": [{"id": "GG_OTU_1", "metadata": {"taxonomy": ["k__1", " p__", " c__", " o__", " f__", " g__", " s__"]}}, {"id": "GG_OTU_2", "metadata": {"taxonomy": ["k__2", " p__", " c__", " o__", " f__", " g__", " s__"]}}, {"id": "GG_OTU_3", "metadata": {"taxonomy": ["k__3", " p__", " c__", " o__", " f__", " g__", " s__"]}}], "format": "Biological Observation Matrix v0.9", "data": [[0, 0, 1.0], [0, 1, 2.0], [0, 2, 3.0], [0, 3, 5.0], [1, 0, 5.0], [1, 1, 1.0], [1, 3, 2.0], [2, 2, 1.0], [2, 3, 4.0]], "columns": [{"id": "Sample1", "metadata": null}, {"id": "Sample2", "metadata": null}, {"id": "Sample3", "metadata": null}, {"id": "Sample4", "metadata": null}], "generated_by": "QIIME 1.4.0-dev, svn revision 2753", "matrix_type": "sparse", "shape": [3, 4], "format_url": "http://www.qiime.org/svn_documentation/documentation/biom_format.html", "date": "2012-02-22T20:50:05.024661", "type": "OTU table", "id": null, "matrix_element_type": "float"}"""
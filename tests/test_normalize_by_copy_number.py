@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# File created on 18 Oct 2026
+from __future__ import division
+
+__author__ = "Greg Caporaso"
+__copyright__ = "Copyright 2011-2013, The PICRUSt Project"
+__credits__ = ["Greg Caporaso","Morgan Langille"]
+__license__ = "GPL"
+__version__ = "1.0.0-dev"
+__maintainer__ = "Greg Caporaso"
+__email__ = "gregcaporaso@gmail.com"
+__status__ = "Development"
+
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from cogent.util.unit_test import TestCase, main
+from biom.parse import parse_biom_table_str
+from picrust.normalize_by_copy_number import normalize_by_copy_number,\
+  normalize_by_marker_copy_number, write_prenormalized_precalc
+from picrust.predict_metagenomes import run_metagenome_prediction,\
+  load_data_table, is_prenormalized
+from picrust.util import convert_precalc_to_biom, get_table_data_array
+
+class NormalizeByCopyNumberTests(TestCase):
+    """ Tests of normalize_by_copy_number """
+
+    def setUp(self):
+        self.otu_table1 = parse_biom_table_str(otu_table1)
+        self.copy_numbers1 = convert_precalc_to_biom(copy_number_table1)
+        self.tmp_dir = mkdtemp(prefix='picrust_normalize_tests')
+
+    def tearDown(self):
+        rmtree(self.tmp_dir)
+
+    def test_normalize_by_copy_number(self):
+        """ normalize_by_copy_number divides each OTU's counts by its rounded copy number"""
+        obs = normalize_by_copy_number(self.otu_table1,self.copy_numbers1)
+        self.assertEqual(obs.ObservationIds,('A','B','C'))
+        self.assertEqual(obs.SampleIds,('S1','S2','S3'))
+        self.assertFloatEqual(get_table_data_array(obs),\
+          [[4.0,0.0,1.0],[0.0,1.0,2.0],[0.75,0.0,0.0]])
+        self.assertEqual(obs._biom_matrix_type,'sparse')
+        self.assertEqual(obs.SampleMetadata[1]['Site'],'skin')
+        self.assertEqual([md['CopyNumber'] for md in obs.ObservationMetadata],\
+          [1,3,4])
+        self.assertEqual(obs.ObservationMetadata[1]['taxonomy'],\
+          ['k__Bacteria','p__Firmicutes'])
+        #the OTU table is unchanged
+        self.assertFloatEqual(get_table_data_array(self.otu_table1),\
+          [[4.0,0.0,1.0],[0.0,3.0,6.0],[3.0,0.0,0.0],[1.0,1.0,1.0]])
+
+    def test_normalize_by_copy_number_dense(self):
+        """ normalize_by_copy_number gives the same result for dense OTU tables"""
+        dense_otu_table = parse_biom_table_str(otu_table1.replace(\
+          '"matrix_type": "sparse"','"matrix_type": "dense"').replace(\
+          '[[0, 0, 4.0], [0, 2, 1.0], [1, 1, 3.0], [1, 2, 6.0], [2, 0, 3.0], [3, 0, 1.0], [3, 1, 1.0], [3, 2, 1.0]]',\
+          '[[4.0, 0.0, 1.0], [0.0, 3.0, 6.0], [3.0, 0.0, 0.0], [1.0, 1.0, 1.0]]'))
+        exp = normalize_by_copy_number(self.otu_table1,self.copy_numbers1,\
+          'Copies')
+        obs = normalize_by_copy_number(dense_otu_table,self.copy_numbers1,\
+          'Copies')
+        self.assertEqual(obs._biom_matrix_type,'dense')
+        self.assertEqual(obs.delimitedSelf(),exp.delimitedSelf())
+        self.assertEqual(obs.ObservationMetadata,exp.ObservationMetadata)
+
+    def test_normalize_by_copy_number_invalid(self):
+        """ normalize_by_copy_number rejects copy numbers that round to less than 1"""
+        copy_numbers = convert_precalc_to_biom(\
+          copy_number_table1.replace('B\t3.0','B\t0.4'))
+        self.assertRaises(ValueError,normalize_by_copy_number,\
+          self.otu_table1,copy_numbers)
+        copy_numbers = convert_precalc_to_biom(\
+          copy_number_table1.replace('B\t3.0','B\tnan'))
+        self.assertRaises(ValueError,normalize_by_copy_number,\
+          self.otu_table1,copy_numbers)
+
+    def test_write_prenormalized_precalc(self):
+        """ write_prenormalized_precalc divides each OTU's gene counts by its copy number"""
+        genome_table_fp = join(self.tmp_dir,'genome_table1.tab')
+        open(genome_table_fp,'w').write(genome_table1)
+        output_fp = join(self.tmp_dir,'prenormalized.tab.gz')
+        self.assertEqual(write_prenormalized_precalc(genome_table_fp,\
+          self.copy_numbers1,output_fp,block_size=40),4)
+        obs = load_data_table(output_fp,transpose=True)
+        self.assertTrue(is_prenormalized(obs))
+        #E has no copy number, so is kept with zero counts
+        self.assertEqual(obs.SampleIds,('A','B','C','E'))
+        self.assertFloatEqual(get_table_data_array(obs),\
+          [[1.0,1/3,0.5,0.0],[2.0,0.0,0.25,0.0],[0.0,1.0,0.25,0.0]])
+        self.assertEqual([(md['NSTI'],md['MarkerCopyNumber']) for md in \
+          obs.SampleMetadata],[('0.0','1'),('0.1','3'),('0.2','4'),\
+          ('0.3','NA')])
+        self.assertEqual(obs.ObservationMetadata,\
+          load_data_table(genome_table_fp,transpose=True).ObservationMetadata)
+        #tables can only be divided once
+        self.assertRaises(ValueError,write_prenormalized_precalc,output_fp,\
+          self.copy_numbers1,join(self.tmp_dir,'twice.tab'))
+
+    def test_prediction_from_prenormalized_precalc(self):
+        """ predictions from raw OTU counts and a prenormalized table match normalizing first"""
+        genome_table_fp = join(self.tmp_dir,'genome_table1.tab')
+        open(genome_table_fp,'w').write(genome_table1)
+        prenormalized_fp = join(self.tmp_dir,'prenormalized.tab')
+        write_prenormalized_precalc(genome_table_fp,self.copy_numbers1,\
+          prenormalized_fp)
+        genome_table = load_data_table(genome_table_fp,transpose=True)
+        prenormalized_table = load_data_table(prenormalized_fp,transpose=True)
+        otu_table = self.otu_table1.filterObservations(\
+          lambda values,otu_id,md: otu_id != 'D')
+
+        normalized_otu_table = normalize_by_copy_number(otu_table,\
+          self.copy_numbers1)
+        exp = run_metagenome_prediction(normalized_otu_table,genome_table,\
+          accuracy_metrics=True,normalize_by_otu=True)
+        obs = run_metagenome_prediction(otu_table,prenormalized_table,\
+          accuracy_metrics=True,normalize_by_otu=True,\
+          normalized_otu_table=normalize_by_marker_copy_number(otu_table,\
+          prenormalized_table))
+        self.assertEqual(obs['prediction'].delimitedSelf(),\
+          exp['prediction'].delimitedSelf())
+        self.assertEqual(obs['nsti'],exp['nsti'])
+
+        #OTUs without a copy number are dropped by normalize_by_copy_number,
+        #and add nothing to predictions from the prenormalized table
+        otu_table_with_E = parse_biom_table_str(otu_table1.replace(\
+          '"id": "D"','"id": "E"'))
+        normalized_otu_table = normalize_by_copy_number(otu_table_with_E,\
+          self.copy_numbers1)
+        self.assertEqual(normalized_otu_table.ObservationIds,('A','B','C'))
+        exp = run_metagenome_prediction(normalized_otu_table,genome_table,\
+          accuracy_metrics=True,normalize_by_otu=True)
+        obs = run_metagenome_prediction(otu_table_with_E,prenormalized_table,\
+          accuracy_metrics=True,normalize_by_otu=True,\
+          normalized_otu_table=normalize_by_marker_copy_number(\
+          otu_table_with_E,prenormalized_table))
+        self.assertEqual(obs['prediction'].delimitedSelf(),\
+          exp['prediction'].delimitedSelf())
+        self.assertEqual(obs['nsti'],exp['nsti'])
+        self.assertEqual(normalize_by_marker_copy_number(otu_table_with_E,\
+          prenormalized_table).ObservationIds,('A','B','C'))
+
+        self.assertRaises(ValueError,run_metagenome_prediction,otu_table,\
+          prenormalized_table,accuracy_metrics=True)
+        self.assertRaises(ValueError,run_metagenome_prediction,otu_table,\
+          prenormalized_table,bootstrap_replicates=10)
+
+
+otu_table1 = """{"rows": [{"id": "A", "metadata": {"taxonomy": ["k__Bacteria", "p__Proteobacteria"]}}, {"id": "B", "metadata": {"taxonomy": ["k__Bacteria", "p__Firmicutes"]}}, {"id": "C", "metadata": {"taxonomy": ["k__Bacteria", "p__Firmicutes"]}}, {"id": "D", "metadata": {"taxonomy": ["k__Archaea"]}}], "format": "Biological Observation Matrix 1.0.0", "data": [[0, 0, 4.0], [0, 2, 1.0], [1, 1, 3.0], [1, 2, 6.0], [2, 0, 3.0], [3, 0, 1.0], [3, 1, 1.0], [3, 2, 1.0]], "columns": [{"id": "S1", "metadata": {"Site": "gut"}}, {"id": "S2", "metadata": {"Site": "skin"}}, {"id": "S3", "metadata": {"Site": "gut"}}], "generated_by": "QIIME 1.4.0-dev", "matrix_type": "sparse", "shape": [4, 3], "format_url": "http://biom-format.org", "date": "2012-02-22T20:50:05.024661", "type": "OTU table", "id": null, "matrix_element_type": "float"}"""
+
+copy_number_table1 = """#OTU_IDs\t16S_rRNA_Count
+A\t1
+B\t3.0
+C\t3.5
+"""
+
+genome_table1 = """#OTU_IDs\tK00001\tK00002\tK00003\tmetadata_NSTI
+metadata_KEGG_Pathways\tMetabolism;Carbohydrate Metabolism;Glycolysis\tGenetic Information Processing;Replication and Repair;DNA replication\tMetabolism;Energy Metabolism;Oxidative phosphorylation
+A\t1.0\t2.0\t0.0\t0.0
+B\t1.0\t0.0\t3.0\t0.1
+C\t2.0\t1.0\t1.0\t0.2
+E\t5.0\t5.0\t5.0\t0.3
+"""
+
+if __name__ == "__main__":
+    main()
@@ -12,8 +12,15 @@ __email__ = "gregcaporaso@gmail.com"
 __status__ = "Development"
  
 
+import gzip
+from numpy import array
 from cogent.util.unit_test import TestCase, main
-from picrust.parse import extract_ids_from_table, parse_asr_confidence_output
+from cogent.app.util import get_tmp_filename
+from cogent.util.misc import remove_files
+from biom.table import table_factory, SparseGeneTable, DenseGeneTable
+from picrust.parse import extract_ids_from_table, parse_asr_confidence_output,\
+  parse_biom_subset, parse_biom_axis_metadata
+from picrust.predict_metagenomes import load_subset_from_biom_str
 
 class ParseTests(TestCase):
     """ """
@@ -23,6 +30,101 @@ class ParseTests(TestCase):
         self.counts_f1 = counts_f1.split('\n')
         self.counts_bad1 = counts_bad1.split('\n')
         self.counts_bad2 = counts_bad2.split('\n')
+        self.files_to_remove = []
+
+    def tearDown(self):
+        remove_files(self.files_to_remove)
+
+    def _write_biom_file(self,biom_str,suffix='.biom'):
+        fp = get_tmp_filename(prefix='ParseTests',suffix=suffix)
+        if suffix.endswith('.gz'):
+            f = gzip.open(fp,'wb')
+        else:
+            f = open(fp,'w')
+        f.write(biom_str)
+        f.close()
+        self.files_to_remove.append(fp)
+        return fp
+
+    def _make_genome_table(self,constructor):
+        data = array([[0,2,0,1,0],[1,0,0,0,3],[0,0,0,0,0],[4,1,0,2,1]])
+        otu_ids = ['OTU%d' % i for i in range(5)]
+        gene_ids = ['K0000%d' % i for i in range(4)]
+        return table_factory(data,otu_ids,gene_ids,\
+          [{'NSTI':i/10} for i in range(5)],\
+          [{'KEGG_Pathways':[['A','B%d' % i]]} for i in range(4)],\
+          constructor=constructor).getBiomFormatJsonString('test')
+
+    def test_parse_biom_subset(self):
+        """parse_biom_subset streams the requested samples from a BIOM file"""
+        for constructor in [SparseGeneTable,DenseGeneTable]:
+            biom_str = self._make_genome_table(constructor)
+            ids = ['OTU3','OTU0','OTU4']
+            exp = load_subset_from_biom_str(biom_str,ids,axis='samples')
+            for suffix in ['.biom','.biom.gz']:
+                fp = self._write_biom_file(biom_str,suffix)
+                #small blocks force the stream to refill mid-value
+                for block_size in [5,64,2**20]:
+                    obs = parse_biom_subset(fp,ids,block_size=block_size)
+                    self.assertEqual(obs,exp)
+                    self.assertEqual(obs.SampleIds,('OTU0','OTU3','OTU4'))
+                    self.assertEqual(obs.SampleMetadata,exp.SampleMetadata)
+                    self.assertEqual(type(obs),constructor)
+
+    def test_parse_biom_subset_observations(self):
+        """parse_biom_subset streams the requested observations from a BIOM file"""
+        for constructor in [SparseGeneTable,DenseGeneTable]:
+            biom_str = self._make_genome_table(constructor)
+            fp = self._write_biom_file(biom_str)
+            ids = ['K00003','K00001']
+            exp = load_subset_from_biom_str(biom_str,ids,axis='observations')
+            obs = parse_biom_subset(fp,ids,axis='observations',block_size=7)
+            self.assertEqual(obs,exp)
+            self.assertEqual(obs.ObservationIds,('K00001','K00003'))
+            self.assertEqual(obs.ObservationMetadata,exp.ObservationMetadata)
+
+    def test_parse_biom_subset_other_axis(self):
+        """parse_biom_subset can also subset the other axis"""
+        for constructor in [SparseGeneTable,DenseGeneTable]:
+            biom_str = self._make_genome_table(constructor)
+            fp = self._write_biom_file(biom_str)
+            exp = load_subset_from_biom_str(biom_str,['OTU1','OTU3'],axis='samples')
+            exp = exp.filterObservations(lambda v,id_,md: id_ in ['K00000','K00003'])
+            obs = parse_biom_subset(fp,['OTU3','OTU1'],block_size=5,\
+              other_ids_to_load=['K00003','K00000'])
+            self.assertEqual(obs,exp)
+            self.assertEqual(obs.ObservationIds,('K00000','K00003'))
+            self.assertEqual(obs.ObservationMetadata,exp.ObservationMetadata)
+            self.assertRaises(KeyError,parse_biom_subset,fp,['OTU1'],\
+              other_ids_to_load=['K00009'])
+
+    def test_parse_biom_axis_metadata(self):
+        """parse_biom_axis_metadata returns ids and metadata without the data"""
+        fp = self._write_biom_file(self._make_genome_table(SparseGeneTable),'.biom.gz')
+        obs = parse_biom_axis_metadata(fp,block_size=5)
+        self.assertEqual([id_ for id_,md in obs],['K00000','K00001','K00002','K00003'])
+        self.assertEqual(obs[2][1],{'KEGG_Pathways':[['A','B2']]})
+        obs = parse_biom_axis_metadata(fp,axis='samples')
+        self.assertEqual(obs[1],('OTU1',{'NSTI':0.1}))
+
+    def test_parse_biom_subset_metadata_first(self):
+        """parse_biom_subset handles files with the ids before the data"""
+        biom_str = self._make_genome_table(SparseGeneTable)
+        data_start = biom_str.index('"data":')
+        rows_start = biom_str.index('"rows":')
+        #move the rows and columns in front of the data
+        reordered = biom_str[:data_start] + biom_str[rows_start:-1] + ',' +\
+          biom_str[data_start:rows_start].rstrip(', ') + '}'
+        fp = self._write_biom_file(reordered)
+        ids = ['OTU1','OTU4']
+        exp = load_subset_from_biom_str(biom_str,ids,axis='samples')
+        self.assertEqual(parse_biom_subset(fp,ids,block_size=5),exp)
+
+    def test_parse_biom_subset_errors(self):
+        """parse_biom_subset raises errors on missing ids and unknown axes"""
+        fp = self._write_biom_file(self._make_genome_table(SparseGeneTable))
+        self.assertRaises(KeyError,parse_biom_subset,fp,['OTU1','OTU9'])
+        self.assertRaises(ValueError,parse_biom_subset,fp,['OTU1'],axis='x')
     
     def test_extract_ids_from_table_qiime_legacy_otu_table(self):
         """extract_ids_from_table extracts ids from a legacy QIIME 1.3 OTU table
@@ -11,7 +11,12 @@ __maintainer__ = "Greg Caporaso"
 __email__ = "gregcaporaso@gmail.com"
 __status__ = "Development"
  
-from numpy import array
+from os import mkdir
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from numpy import array, percentile, sort
+from numpy.random import RandomState
 from cogent.util.unit_test import TestCase, main
 from biom.parse import parse_biom_table_str, get_axis_indices,\
   direct_slice_data
@@ -22,7 +27,14 @@ from picrust.predict_metagenomes import predict_metagenomes,\
   transfer_observation_metadata,transfer_metadata,\
   load_subset_from_biom_str,yield_subset_biom_str,\
   predict_metagenome_variances,variance_of_sum,variance_of_product,\
-  sum_rows_with_variance
+  sum_rows_with_variance,IdAlignment,align_otu_ids,\
+  get_function_ids_in_category,filter_table_to_functions,\
+  group_identical_rows,sum_rows_by_group,run_metagenome_prediction,\
+  format_layered_prediction,parse_layered_prediction,\
+  predict_metagenomes_from_precalc_blocks,normalize_prediction,\
+  bootstrap_metagenome_CIs,_percentile_of_sorted,expand_otu_table_fps,\
+  get_batch_otu_ids,get_batch_output_fps,load_data_table
+from picrust.util import PrecalcBlockReader
 
 class PredictMetagenomeTests(TestCase):
     """ """
@@ -33,6 +45,7 @@ class PredictMetagenomeTests(TestCase):
         self.otu_table1_with_metadata = parse_biom_table_str(otu_table1_with_metadata)
         self.genome_table1 = parse_biom_table_str(genome_table1)
         self.genome_table1_with_metadata = parse_biom_table_str(genome_table1_with_metadata)
+        self.genome_table1_with_nsti = parse_biom_table_str(genome_table1_with_nsti)
         self.genome_table2 = parse_biom_table_str(genome_table2)
         self.predicted_metagenome_table1 = parse_biom_table_str(predicted_metagenome_table1)
         self.predicted_metagenome_table1_with_metadata = parse_biom_table_str(predicted_metagenome_table1_with_metadata)
@@ -59,6 +72,56 @@ class PredictMetagenomeTests(TestCase):
         actual = predict_metagenomes(self.otu_table1,self.genome_table1)
         self.assertEqual(actual.delimitedSelf(),self.predicted_metagenome_table1.delimitedSelf())
 
+    def test_predict_metagenomes_from_precalc_blocks(self):
+        """ predict_metagenomes_from_precalc_blocks matches predict_metagenomes and calc_nsti """
+        #genome_table1_with_nsti in tab-delimited format
+        precalc = '#OTU_IDs\tf1\tf2\tf3\tmetadata_NSTI\n' + \
+          'GG_OTU_1\t1.0\t0.0\t0.0\t0.1\nGG_OTU_3\t2.0\t1.0\t0.0\t0.2\n' + \
+          'GG_OTU_2\t3.0\t0.0\t1.0\t0.5\n'
+        otu_tables = [self.otu_table1_with_metadata,\
+          self.otu_table1.filterObservations(lambda v,id_,md: id_ != 'GG_OTU_3')]
+        for processes in [1,2]:
+            #small blocks put each OTU in its own block
+            blocks = PrecalcBlockReader(precalc,['GG_OTU_1','GG_OTU_2','GG_OTU_3'],\
+              processes=processes,block_size=5)
+            obs = predict_metagenomes_from_precalc_blocks(otu_tables,blocks,\
+              accuracy_metrics=True)
+            self.assertEqual(len(obs),2)
+            for otu_table,results in zip(otu_tables,obs):
+                exp = predict_metagenomes(otu_table,self.genome_table1_with_nsti)
+                self.assertEqual(results['prediction'].delimitedSelf(),\
+                  exp.delimitedSelf())
+                self.assertEqual(results['prediction'].SampleMetadata,\
+                  otu_table.SampleMetadata)
+                sample_ids,nsti = calc_nsti(otu_table,self.genome_table1_with_nsti)
+                self.assertEqual([s for s,n in results['nsti']],list(sample_ids))
+                self.assertFloatEqual([n for s,n in results['nsti']],nsti)
+
+    def test_normalize_prediction(self):
+        """ normalize_prediction divides by the OTU or function sums of each sample """
+        prediction = self.predicted_metagenome_table1
+        obs = normalize_prediction(prediction,self.otu_table1,normalize_by_otu=True)
+        #Sample1 contains 6 OTUs
+        self.assertFloatEqual(obs.sampleData('Sample1'),[16/6,0.0,5/6])
+        obs = normalize_prediction(prediction,self.otu_table1,\
+          normalize_by_function=True)
+        self.assertFloatEqual(obs.sampleData('Sample1'),[16/21,0.0,5/21])
+        self.assertEqual(normalize_prediction(prediction,self.otu_table1),prediction)
+
+    def test_calc_nsti(self):
+        """ calc_nsti weights the NSTI of each OTU by its abundance in each sample """
+        sample_ids,obs = calc_nsti(self.otu_table1,self.genome_table1_with_nsti)
+        self.assertEqual(sample_ids,self.otu_table1.SampleIds)
+        #e.g. Sample1 contains 1 GG_OTU_1 (NSTI 0.1) and 5 GG_OTU_2 (NSTI 0.5)
+        exp = [2.6/6,0.7/3,0.5/4,2.3/11]
+        self.assertFloatEqual(obs,exp)
+
+    def test_calc_nsti_unweighted(self):
+        """ calc_nsti returns the mean NSTI of the OTUs when weighted is False """
+        sample_ids,obs = calc_nsti(self.otu_table1,self.genome_table1_with_nsti,\
+          weighted=False)
+        self.assertFloatEqual(obs,0.8/3)
+
     def test_predict_metagenomes_value_error(self):
         """ predict_metagenomes raises ValueError when no overlapping otu ids """
         self.assertRaises(ValueError,predict_metagenomes,self.otu_table1,self.genome_table2)
@@ -85,6 +148,31 @@ class PredictMetagenomeTests(TestCase):
         self.assertEqual(obs_lower_CI_95.delimitedSelf(),curr_exp_metagenome_table.delimitedSelf())
         self.assertEqual(obs_upper_CI_95.delimitedSelf(),curr_exp_metagenome_table.delimitedSelf())
 
+    def test_layered_prediction(self):
+        """ format_layered_prediction round-trips through parse_layered_prediction"""
+        results = run_metagenome_prediction(self.otu_table1_with_metadata,\
+          self.genome_table1_with_metadata,self.variance_table1_var_by_gene,\
+          with_confidence=True)
+        for include_CI in [True,False]:
+            biom_str = format_layered_prediction(results,include_CI=include_CI)
+            obs = parse_layered_prediction(biom_str)
+            self.assertEqualItems(obs.keys(),\
+              ['prediction','variances','upper_CI_95','lower_CI_95'])
+            for name,table in obs.items():
+                self.assertEqual(table,results[name])
+                self.assertEqual(map(dict,table.ObservationMetadata),\
+                  map(dict,results[name].ObservationMetadata))
+            #the prediction is a plain BIOM table
+            self.assertEqual(parse_biom_table_str(biom_str),results['prediction'])
+
+        self.assertEqual(parse_layered_prediction(\
+          results['prediction'].getBiomFormatJsonString('test')).keys(),\
+          ['prediction'])
+
+        results['variances'] = self.predicted_metagenome_table1_zero_variance.sortObservationOrder(\
+          ['f3','f2','f1'])
+        self.assertRaises(ValueError,format_layered_prediction,results)
+
     def test_predict_metagenome_variances_propagates_variance_in_gene_categories(self):
         """ predict_metagenomes correctly propagates the rank order of gene family variance"""
         curr_otu_table = self.otu_table1
@@ -122,6 +210,151 @@ class PredictMetagenomeTests(TestCase):
         self.assertEqual(obs_upper_CI_95.delimitedSelf(),curr_exp_upper_CI_95.delimitedSelf()) 
         self.assertEqual(obs_lower_CI_95.delimitedSelf(),curr_exp_lower_CI_95.delimitedSelf()) 
     
+    def test_predict_metagenome_variances_matches_variance_table_by_id(self):
+        """ predict_metagenome_variances doesn't require the variance table to be sorted like the genome table"""
+        unsorted_variance_table = self.variance_table1_one_gene_one_otu.\
+          sortObservationOrder(['f3','f1','f2']).\
+          sortSampleOrder(['GG_OTU_2','GG_OTU_1','GG_OTU_3'])
+        obs_prediction,obs_variances,obs_lower_CI_95,obs_upper_CI_95 =\
+          predict_metagenome_variances(self.otu_table1,self.genome_table1,\
+          gene_variances=unsorted_variance_table)
+        self.assertEqual(obs_variances,\
+          self.predicted_metagenome_variance_table1_one_gene_one_otu)
+        self.assertEqual(obs_upper_CI_95.delimitedSelf(),\
+          self.predicted_metagenome_table1_one_gene_one_otu_upper_CI.delimitedSelf())
+
+    def test_predict_metagenome_variances_value_error(self):
+        """ predict_metagenome_variances raises ValueError if the variance table has different genes"""
+        variance_table = self.variance_table1_one_gene_one_otu.filterObservations(\
+          lambda val,gene_id,metadata: gene_id != 'f2')
+        self.assertRaises(ValueError,predict_metagenome_variances,\
+          self.otu_table1,self.genome_table1,variance_table)
+
+    def test_bootstrap_metagenome_CIs(self):
+        """ bootstrap_metagenome_CIs brackets the prediction, reproducibly for a seed"""
+        lower,upper = bootstrap_metagenome_CIs(self.otu_table1,\
+          self.genome_table1,replicates=200,seed=42)
+        prediction = predict_metagenomes(self.otu_table1,self.genome_table1)
+        self.assertEqual(lower.SampleIds,prediction.SampleIds)
+        self.assertEqual(lower.ObservationIds,prediction.ObservationIds)
+        for sample_id in prediction.SampleIds:
+            predicted = prediction.sampleData(sample_id)
+            self.assertTrue((lower.sampleData(sample_id) <= predicted).all())
+            self.assertTrue((upper.sampleData(sample_id) >= predicted).all())
+
+        #each sample has its own random stream, so the blocking of samples
+        #and replicates doesn't change the results
+        lower2,upper2 = bootstrap_metagenome_CIs(self.otu_table1,\
+          self.genome_table1,replicates=200,seed=42,max_values=1)
+        self.assertEqual(lower2,lower)
+        self.assertEqual(upper2,upper)
+
+    def test_bootstrap_metagenome_CIs_zero_sample(self):
+        """ bootstrap_metagenome_CIs returns zero CIs for empty samples"""
+        otu_table = self.otu_table1.transformSamples(lambda v,id_,md: v*0 \
+          if id_ == self.otu_table1.SampleIds[0] else v)
+        lower,upper = bootstrap_metagenome_CIs(otu_table,self.genome_table1,\
+          replicates=10,seed=0)
+        sample_id = otu_table.SampleIds[0]
+        self.assertEqual(lower.sampleData(sample_id).sum(),0)
+        self.assertEqual(upper.sampleData(sample_id).sum(),0)
+
+    def test_percentile_of_sorted(self):
+        """ _percentile_of_sorted matches numpy.percentile along the first axis"""
+        data = sort(RandomState(0).random_sample((11,3,2)),axis=0)
+        for q in [0,2.5,50,97.5,100]:
+            self.assertFloatEqual(_percentile_of_sorted(data,q),\
+              array([[percentile(data[:,i,j],q) for j in range(2)] \
+              for i in range(3)]))
+
+    def test_run_metagenome_prediction_bootstrap(self):
+        """ run_metagenome_prediction includes bootstrap CIs if requested"""
+        results = run_metagenome_prediction(self.otu_table1,self.genome_table1,\
+          bootstrap_replicates=50,bootstrap_seed=1)
+        self.assertEqual(sorted(results),['bootstrap_lower_CI_95',\
+          'bootstrap_upper_CI_95','prediction'])
+        self.assertEqual(results['bootstrap_lower_CI_95'],\
+          bootstrap_metagenome_CIs(self.otu_table1,self.genome_table1,\
+          replicates=50,seed=1)[0])
+
+    def test_id_alignment(self):
+        """ IdAlignment maps the shared ids to their positions in each id sequence"""
+        alignment = IdAlignment(['a','b','c','d'],['d','x','b','a'],['b','a','d'])
+        self.assertEqual(alignment.ids,['a','b','d'])
+        self.assertEqual(len(alignment),3)
+        self.assertEqual([list(idxs) for idxs in alignment.indices],\
+          [[0,1,3],[3,2,0],[1,0,2]])
+        self.assertFalse(alignment.is_complete())
+        self.assertEqual(alignment.unshared_ids(0),['c'])
+        self.assertEqual(alignment.unshared_ids(1),['x'])
+        self.assertEqual(alignment.unshared_ids(2),[])
+        self.assertTrue(IdAlignment(['a','b'],['b','a']).is_complete())
+
+    def test_align_otu_ids(self):
+        """ align_otu_ids aligns OTUs in OTU table order, and raises ValueError if there are none"""
+        alignment = align_otu_ids(self.otu_table1,[self.genome_table1])
+        self.assertEqual(alignment.ids,['GG_OTU_1','GG_OTU_2','GG_OTU_3'])
+        self.assertEqual([list(idxs) for idxs in alignment.indices],\
+          [[0,1,2],[0,2,1]])
+        self.assertRaises(ValueError,align_otu_ids,self.otu_table1,\
+          [self.genome_table2])
+
+    def test_get_function_ids_in_category(self):
+        """ get_function_ids_in_category finds functions by name at any level"""
+        function_metadata = [('K1',{'KEGG_Pathways':[['Metabolism','Glycolysis']]}),\
+          ('K2',{'KEGG_Pathways':[['Metabolism','TCA cycle'],['Cellular Processes','Motility']]}),\
+          ('K3',{'KEGG_Pathways':['Genetic Information Processing','Replication']}),\
+          ('K4',{'KEGG_Pathways':'Motility'}),('K5',{}),('K6',None)]
+        self.assertEqual(get_function_ids_in_category(function_metadata,\
+          'KEGG_Pathways',['Glycolysis']),['K1'])
+        self.assertEqual(get_function_ids_in_category(function_metadata,\
+          'KEGG_Pathways',['Motility','Replication']),['K2','K3','K4'])
+        self.assertEqual(get_function_ids_in_category(function_metadata,\
+          'KEGG_Pathways',['Metabolism']),['K1','K2'])
+        self.assertEqual(get_function_ids_in_category(function_metadata,\
+          'COG_Category',['Metabolism']),[])
+
+    def test_filter_table_to_functions(self):
+        """ filter_table_to_functions keeps only the requested functions"""
+        obs = filter_table_to_functions(self.genome_table1,['f3','f1'])
+        self.assertEqual(obs.ObservationIds,('f1','f3'))
+        self.assertEqual(obs.SampleIds,self.genome_table1.SampleIds)
+        self.assertRaises(KeyError,filter_table_to_functions,\
+          self.genome_table1,['f1','bogus'])
+
+    def test_group_identical_rows(self):
+        """ group_identical_rows groups rows identical in all arrays"""
+        genomes = array([[1.,0.,2.],[0.,1.,1.],[1.,0.,2.],[1.,0.,2.],[0.,1.,1.]])
+        variances = array([[0.,0.,1.],[1.,1.,1.],[0.,0.,1.],[0.,0.,2.],[1.,1.,1.]])
+        abundances = array([[1.,2.],[3.,4.],[5.,6.],[7.,8.],[9.,10.]])
+
+        order,group_starts = group_identical_rows(genomes)
+        self.assertEqual(len(group_starts),2)
+        groups = [sorted(order[start:end]) for start,end in \
+          zip(group_starts,list(group_starts[1:])+[len(order)])]
+        self.assertEqualItems(groups,[[0,2,3],[1,4]])
+        self.assertEqualItems(sum_rows_by_group(abundances,order,group_starts).tolist(),\
+          [[13.,16.],[12.,14.]])
+
+        order,group_starts = group_identical_rows(genomes,variances)
+        self.assertEqual(len(group_starts),3)
+        self.assertEqualItems(sum_rows_by_group(abundances,order,group_starts).tolist(),\
+          [[6.,8.],[12.,14.],[7.,8.]])
+
+        #distinct rows are left alone
+        order,group_starts = group_identical_rows(variances[:2])
+        self.assertEqual(list(order),[0,1])
+        self.assertEqual(sum_rows_by_group(abundances[:2],order,group_starts),\
+          abundances[:2])
+
+    def test_extract_otu_and_genome_data(self):
+        """ extract_otu_and_genome_data returns aligned rows of otu and genome data"""
+        otu_data,genome_data,ids = extract_otu_and_genome_data(self.otu_table1,\
+          self.genome_table1)
+        self.assertEqual(ids,['GG_OTU_1','GG_OTU_2','GG_OTU_3'])
+        self.assertFloatEqual(otu_data,[[1,2,3,5],[5,1,0,2],[0,0,1,4]])
+        self.assertFloatEqual(genome_data,[[1,0,0],[3,0,1],[2,1,0]])
+
     def test_predict_metagenomes_keeps_observation_metadata(self):
         """predict_metagenomes preserves Observation metadata in genome and otu table"""
         
@@ -249,6 +482,17 @@ class PredictMetagenomeTests(TestCase):
         expected_var = array([expected_var1,expected_var1,0.0])
         self.assertFloatEqual(observed_var,expected_var)
     
+    def test_variance_of_sum_out(self):
+        """variance_of_sum can accumulate variances in place"""
+        var1 = array([10000.0,10000.0,0.0])
+        var2 = array([11000.0,11000.0,0.0])
+        result = variance_of_sum(var1,var2,0.5,out=var1)
+        self.assertTrue(result is var1)
+        self.assertFloatEqual(var1,[31488.088481701518,31488.088481701518,0.0])
+        #r=0 is just the sum of the variances
+        self.assertFloatEqual(variance_of_sum(var2,var2),[22000.0,22000.0,0.0])
+        self.assertFloatEqual(variance_of_sum(1.0,2.0),3.0)
+
     def test_sum_rows_with_variance(self):
         """sum_rows_with_variance sums the rows of a numpy array while accounting for variance"""
         data_array = array([[0,0],[0,1.0]])
@@ -260,6 +504,12 @@ class PredictMetagenomeTests(TestCase):
         self.assertFloatEqual(obs_data_array,exp_data_array)
         self.assertFloatEqual(obs_variance_array,exp_variance_array)
 
+        out = (array([-1.0,-1.0]),array([-1.0,-1.0]))
+        result = sum_rows_with_variance(data_array,variance_array,out=out)
+        self.assertTrue(result[0] is out[0] and result[1] is out[1])
+        self.assertFloatEqual(out[0],exp_data_array)
+        self.assertFloatEqual(out[1],exp_variance_array)
+
     def test_variance_of_product_functions_as_expected_with_valid_input(self):
         """variance_of_product functions as expected given two values and two variances"""
         varA = 100.0
@@ -314,6 +564,67 @@ class PredictMetagenomeTests(TestCase):
    
 
     
+class BatchPredictionTests(TestCase):
+    """ Tests of predicting the metagenomes of several OTU tables at once """
+
+    def setUp(self):
+        self.tmp_dir = mkdtemp(prefix='picrust_batch_tests')
+        for dir_name in ('a','b'):
+            mkdir(join(self.tmp_dir,dir_name))
+        self.otus_a_fp = join(self.tmp_dir,'a','otus.biom')
+        self.study2_fp = join(self.tmp_dir,'a','study2.biom')
+        self.otus_b_fp = join(self.tmp_dir,'b','otus.biom')
+        open(self.otus_a_fp,'w').write(otu_table1.replace('GG_OTU_3','GG_OTU_4'))
+        open(self.study2_fp,'w').write(otu_table1)
+        open(self.otus_b_fp,'w').write(otu_table1)
+        self.precalc_fp = join(self.tmp_dir,'precalc.tab')
+        open(self.precalc_fp,'w').write(batch_precalc)
+
+    def tearDown(self):
+        rmtree(self.tmp_dir)
+
+    def test_expand_otu_table_fps(self):
+        """ expand_otu_table_fps expands comma-separated paths and globs, without repeats"""
+        self.assertEqual(expand_otu_table_fps(self.otus_b_fp),[self.otus_b_fp])
+        self.assertEqual(expand_otu_table_fps(','.join([self.otus_b_fp,\
+          join(self.tmp_dir,'a','*.biom'),self.otus_b_fp])),\
+          [self.otus_b_fp,self.otus_a_fp,self.study2_fp])
+        self.assertEqual(expand_otu_table_fps(join(self.tmp_dir,'c','*.biom')),[])
+
+    def test_get_batch_otu_ids(self):
+        """ get_batch_otu_ids loads the trait table once for the union of the OTUs"""
+        otu_table_fps = [self.otus_a_fp,self.study2_fp]
+        ids_to_load = get_batch_otu_ids(otu_table_fps)
+        self.assertEqual(ids_to_load,['GG_OTU_1','GG_OTU_2','GG_OTU_4','GG_OTU_3'])
+        genome_table = load_data_table(self.precalc_fp,ids_to_load=ids_to_load,\
+          transpose=True)
+        self.assertEqual(genome_table.SampleIds,\
+          ('GG_OTU_1','GG_OTU_2','GG_OTU_3','GG_OTU_4'))
+        #each table gets the prediction it would get from its own load
+        for otu_table_fp in otu_table_fps:
+            otu_table = parse_biom_table_str(open(otu_table_fp).read())
+            own_genome_table = load_data_table(self.precalc_fp,\
+              ids_to_load=otu_table.ObservationIds,transpose=True)
+            self.assertEqual(\
+              predict_metagenomes(otu_table,genome_table).delimitedSelf(),\
+              predict_metagenomes(otu_table,own_genome_table).delimitedSelf())
+
+    def test_get_batch_output_fps(self):
+        """ get_batch_output_fps names outputs after their OTU tables"""
+        self.assertEqual(get_batch_output_fps([self.otus_a_fp,self.study2_fp],\
+          'out'),[('out/otus.biom',None),('out/study2.biom',None)])
+        self.assertEqual(get_batch_output_fps([self.otus_a_fp],'out',\
+          'metrics/nsti.tab',tab_delimited=True),\
+          [('out/otus.txt','out/otus_nsti.tab')])
+
+    def test_get_batch_output_fps_collision(self):
+        """ get_batch_output_fps raises ValueError rather than overwriting a prediction"""
+        self.assertRaises(ValueError,get_batch_output_fps,\
+          [self.otus_a_fp,self.otus_b_fp],'out')
+        #a table named like another table's accuracy metrics
+        self.assertRaises(ValueError,get_batch_output_fps,\
+          ['otus.biom','otus_nsti.biom'],'out','nsti.biom')
+
 otu_table1 = """{"rows": [{"id": "GG_OTU_1", "metadata": null}, {"id": "GG_OTU_2", "metadata": null}, {"id": "GG_OTU_3", "metadata": null}], "format": "Biological Observation Matrix v0.9", "data": [[0, 0, 1.0], [0, 1, 2.0], [0, 2, 3.0], [0, 3, 5.0], [1, 0, 5.0], [1, 1, 1.0], [1, 3, 2.0], [2, 2, 1.0], [2, 3, 4.0]], "columns": [{"id": "Sample1", "metadata": null}, {"id": "Sample2", "metadata": null}, {"id": "Sample3", "metadata": null}, {"id": "Sample4", "metadata": null}], "generated_by": "QIIME 1.4.0-dev, svn revision 2753", "matrix_type": "sparse", "shape": [3, 4], "format_url": "http://www.qiime.org/svn_documentation/documentation/biom_format.html", "date": "2012-02-22T20:50:05.024661", "type": "OTU table", "id": null, "matrix_element_type": "float"}"""
 
 otu_table1_with_metadata = """{"rows": [{"id": "GG_OTU_1", "metadata": null}, {"id": "GG_OTU_2", "metadata": null}, {"id": "GG_OTU_3", "metadata": null}], "format": "Biological Observation Matrix v0.9", "data": [[0, 0, 1.0], [0, 1, 2.0], [0, 2, 3.0], [0, 3, 5.0], [1, 0, 5.0], [1, 1, 1.0], [1, 3, 2.0], [2, 2, 1.0], [2, 3, 4.0]], "columns": [{"id": "Sample1", "metadata": {"pH":7.0}}, {"id": "Sample2", "metadata": {"pH":8.0}}, {"id": "Sample3", "metadata": {"pH":7.0}}, {"id": "Sample4", "metadata": null}],"generated_by": "QIIME 1.4.0-dev, svn revision 2753", "matrix_type": "sparse", "shape": [3, 4], "format_url": "http://www.qiime.org/svn_documentation/documentation/biom_format.html", "date": "2012-02-22T20:50:05.024661", "type": "OTU table", "id": null, "matrix_element_type": "float"}"""
@@ -333,6 +644,8 @@ variance_table1_one_gene_one_otu = """{"rows": [{"id": "f1", "metadata": null},
 
 genome_table1_with_metadata = """{"rows": [{"id": "f1", "metadata": {"KEGG_description":"ko00100    Steroid biosynthesis"}}, {"id": "f2", "metadata": {"KEGG_description":"ko00195   Photosynthesis"}}, {"id": "f3", "metadata": {"KEGG_description":"ko00232    Caffeine metabolism"}}], "format": "Biological Observation Matrix v0.9", "data": [[0, 0, 1.0], [0, 1, 2.0], [0, 2, 3.0], [1, 1, 1.0], [2, 2, 1.0]], "columns": [{"id": "GG_OTU_1", "metadata": {"confidence": 0.665,"taxonomy": ["Root", "k__Bacteria", "p__Firmicutes", "c__Clostridia", "o__Clostridiales", "f__Lachnospiraceae"]}}, {"id": "GG_OTU_3", "metadata": {"confidence": 1.0,"taxonomy": ["Root", "k__Bacteria", "p__Firmicutes", "c__Clostridia", "o__Clostridiales", "f__Lachnospiraceae"]}}, {"id": "GG_OTU_2", "metadata":{"confidence": 0.98,"taxonomy": ["Root", "k__Bacteria"]}}], "generated_by": "QIIME 1.4.0-dev, svn revision 2753", "matrix_type": "sparse", "shape": [3, 3], "format_url": "http://www.qiime.org/svn_documentation/documentation/biom_format.html", "date": "2012-02-22T20:49:58.258296", "type": "OTU table", "id": null, "matrix_element_type": "float"}"""
 
+genome_table1_with_nsti = """{"rows": [{"id": "f1", "metadata": null}, {"id": "f2", "metadata": null}, {"id": "f3", "metadata": null}], "format": "Biological Observation Matrix v0.9", "data": [[0, 0, 1.0], [0, 1, 2.0], [0, 2, 3.0], [1, 1, 1.0], [2, 2, 1.0]], "columns": [{"id": "GG_OTU_1", "metadata": {"NSTI": "0.1"}}, {"id": "GG_OTU_3", "metadata": {"NSTI": "0.2"}}, {"id": "GG_OTU_2", "metadata": {"NSTI": "0.5"}}], "generated_by": "QIIME 1.4.0-dev, svn revision 2753", "matrix_type": "sparse", "shape": [3, 3], "format_url": "http://www.qiime.org/svn_documentation/documentation/biom_format.html", "date": "2012-02-22T20:49:58.258296", "type": "OTU table", "id": null, "matrix_element_type": "float"}"""
+
 genome_table2 = """{"rows": [{"id": "f1", "metadata": null}, {"id": "f2", "metadata": null}, {"id": "f3", "metadata": null}], "format": "Biological Observation Matrix v0.9", "data": [[0, 0, 1.0], [0, 1, 2.0], [0, 2, 3.0], [1, 1, 1.0], [2, 2, 1.0]], "columns": [{"id": "GG_OTU_21", "metadata": null}, {"id": "GG_OTU_23", "metadata": null}, {"id": "GG_OTU_22", "metadata": null}], "generated_by": "QIIME 1.4.0-dev, svn revision 2753", "matrix_type": "sparse", "shape": [3, 3], "format_url": "http://www.qiime.org/svn_documentation/documentation/biom_format.html", "date": "2012-02-22T20:49:58.258296", "type": "OTU table", "id": null, "matrix_element_type": "float"}"""
 
 predicted_metagenome_table1 = """{"rows": [{"id": "f1", "metadata": null}, {"id": "f2", "metadata": null}, {"id": "f3", "metadata": null}], "format": "Biological Observation Matrix v0.9", "data": [[0, 0, 16.0], [0, 1, 5.0], [0, 2, 5.0], [0, 3, 19.0], [1, 2, 1.0], [1, 3, 4.0], [2, 0, 5.0], [2, 1, 1.0], [2, 3, 2.0]], "columns": [{"id": "Sample1", "metadata": null}, {"id": "Sample2", "metadata": null}, {"id": "Sample3", "metadata": null}, {"id": "Sample4", "metadata": null}], "generated_by": "QIIME 1.4.0-dev, svn revision 2753", "matrix_type": "sparse", "shape": [3, 4], "format_url": "http://www.qiime.org/svn_documentation/documentation/biom_format.html", "date": "2012-02-22T16:01:30.837052", "type": "OTU table", "id": null, "matrix_element_type": "float"}"""
@@ -348,5 +661,13 @@ predicted_metagenome_table1_zero_variance = """{"rows": [{"id": "f1", "metadata"
 
 predicted_metagenome_table1_with_metadata = """{"rows": [{"id": "f1", "metadata": {"KEGG_description":"ko00100    Steroid biosynthesis"}}, {"id": "f2", "metadata": {"KEGG_description":"ko00195   Photosynthesis"}}, {"id": "f3", "metadata": {"KEGG_description":"ko00232    Caffeine metabolism"}}], "format": "Biological Observation Matrix v0.9","data": [[0, 0, 16.0], [0, 1, 5.0], [0, 2, 5.0], [0, 3, 19.0], [1, 2, 1.0], [1, 3, 4.0], [2, 0, 5.0], [2, 1, 1.0], [2, 3, 2.0]], "columns": [{"id": "Sample1", "metadata": {"pH":7.0}}, {"id": "Sample2", "metadata": {"pH":8.0}}, {"id": "Sample3", "metadata": {"pH":7.0}}, {"id": "Sample4", "metadata": null}], "generated_by": "QIIME 1.4.0-dev, svn revision 2753", "matrix_type": "sparse", "shape": [3, 4], "format_url": "http://www.qiime.org/svn_documentation/documentation/biom_format.html", "date": "2012-02-22T16:01:30.837052", "type": "OTU table", "id": null, "matrix_element_type": "float"}"""
 
+batch_precalc = """#OTU_IDs\tf1\tf2\tf3
+GG_OTU_1\t1.0\t0.0\t0.0
+GG_OTU_2\t3.0\t0.0\t1.0
+GG_OTU_3\t2.0\t1.0\t0.0
+GG_OTU_4\t0.0\t2.0\t2.0
+GG_OTU_5\t5.0\t5.0\t5.0
+"""
+
 if __name__ == "__main__":
     main()
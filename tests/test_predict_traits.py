@@ -30,7 +30,8 @@ from picrust.predict_traits  import assign_traits_to_tree,\
   variance_of_weighted_mean,fit_normal_to_confidence_interval,\
   get_most_recent_reconstructed_ancestor,\
   normal_product_monte_carlo, get_bounds_from_histogram,\
-  get_nn_by_tree_descent,get_brownian_motion_param_from_confidence_intervals
+  get_nn_by_tree_descent,get_brownian_motion_param_from_confidence_intervals,\
+  calc_confidence_interval_95
 
 
 """
@@ -942,6 +943,39 @@ class TestPredictTraits(TestCase):
 
 
     
+    def test_calc_confidence_interval_95(self):
+        """calc_confidence_interval_95 calculates rounded, clipped intervals"""
+        predictions = array([[10.0,1.0],[0.0,100.0]])
+        variances = array([[4.0,25.0],[1.0,0.0]])
+        #10 +/- 3.92, 1 +/- 9.8, 0 +/- 1.96 and 100 +/- 0
+        exp_lower = [[6.0,0.0],[0.0,100.0]]
+        exp_upper = [[14.0,11.0],[2.0,100.0]]
+        lower,upper = calc_confidence_interval_95(predictions,variances)
+        self.assertEqual(lower,exp_lower)
+        self.assertEqual(upper,exp_upper)
+
+        lower,upper = calc_confidence_interval_95(predictions,variances,\
+          min_val=None,max_val=12.0)
+        self.assertEqual(lower,[[6.0,-9.0],[-2.0,12.0]])
+        self.assertEqual(upper,[[12.0,11.0],[2.0,12.0]])
+
+        #results can be written into existing arrays, e.g. row by row
+        out = (array([[-1.0,-1.0],[-1.0,-1.0]]),array([[-1.0,-1.0],[-1.0,-1.0]]))
+        for i in range(2):
+            result = calc_confidence_interval_95(predictions[i],variances[i],\
+              out=(out[0][i],out[1][i]))
+            self.assertTrue(result[0].base is out[0])
+        self.assertEqual(out[0],exp_lower)
+        self.assertEqual(out[1],exp_upper)
+
+        #writing over the inputs would corrupt the intervals
+        self.assertRaises(ValueError,calc_confidence_interval_95,predictions,\
+          variances,out=(out[0],predictions))
+        self.assertRaises(ValueError,calc_confidence_interval_95,predictions,\
+          variances,out=(variances[0],out[1][0]))
+        self.assertRaises(ValueError,calc_confidence_interval_95,predictions,\
+          variances,out=(out[0],out[0]))
+
     def test_get_brownian_motion_param_from_confidence_intervals(self):
         """Get brownian motion parameters from confidence intervals"""
         #TODO: Ensure this works with arrays of brownian motions
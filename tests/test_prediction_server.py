@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# File created on 18 Oct 2026
+from __future__ import division
+
+__author__ = "Greg Caporaso"
+__copyright__ = "Copyright 2011-2013, The PICRUSt Project"
+__credits__ = ["Greg Caporaso","Jesse Zaneveld"]
+__license__ = "GPL"
+__version__ = "1.0.0-dev"
+__maintainer__ = "Greg Caporaso"
+__email__ = "gregcaporaso@gmail.com"
+__status__ = "Development"
+ 
+from threading import Thread
+from cogent.util.unit_test import TestCase, main
+from biom.parse import parse_biom_table_str
+from picrust.predict_metagenomes import predict_metagenomes,\
+  predict_metagenome_variances
+from picrust.metagenome_contributions import partition_metagenome_contributions
+from picrust.prediction_server import PredictionServer,\
+  query_prediction_server, get_prediction_server_metrics
+
+class PredictionServerTests(TestCase):
+    """ """
+    
+    def setUp(self):
+        self.otu_table1 = parse_biom_table_str(otu_table1)
+        self.genome_table1 = parse_biom_table_str(genome_table1)
+        self.variance_table1 = parse_biom_table_str(variance_table1_one_gene_one_otu)
+        self.server = PredictionServer(('127.0.0.1',0),self.genome_table1,\
+          variance_table=self.variance_table1)
+        self.server_url = 'http://127.0.0.1:%i' % self.server.server_address[1]
+        self.server_thread = Thread(target=self.server.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_query_prediction_server_predict(self):
+        """query_prediction_server returns the same prediction as predict_metagenomes"""
+        obs = query_prediction_server(self.server_url,otu_table1)
+        exp = predict_metagenomes(self.otu_table1,self.genome_table1)
+        self.assertEqualItems(obs.keys(),['prediction'])
+        self.assertEqual(obs['prediction'].delimitedSelf(),exp.delimitedSelf())
+
+    def test_query_prediction_server_with_confidence(self):
+        """query_prediction_server returns variances and CIs from the resident variance table"""
+        obs = query_prediction_server(self.server_url,otu_table1,\
+          with_confidence=True,accuracy_metrics=False)
+        exp = predict_metagenome_variances(self.otu_table1,\
+          self.genome_table1,self.variance_table1)
+        for key,exp_table in zip(['prediction','variances',\
+          'lower_CI_95','upper_CI_95'],exp):
+            self.assertEqual(obs[key].delimitedSelf(),exp_table.delimitedSelf())
+
+    def test_query_prediction_server_contributions(self):
+        """query_prediction_server partitions contributions against the resident genome table"""
+        obs = query_prediction_server(self.server_url,otu_table1,\
+          endpoint='contributions',limit_to_function='f1')
+        exp = partition_metagenome_contributions(self.otu_table1,\
+          self.genome_table1,limit_to_functions=['f1'],verbose=False)
+        self.assertEqual(obs,"\n".join(["\t".join(map(str,i)) for i in exp]))
+
+    def test_query_prediction_server_raises_value_error(self):
+        """query_prediction_server raises ValueError for tables the server can't predict"""
+        self.assertRaises(ValueError,query_prediction_server,\
+          self.server_url,otu_table2)
+        metrics = get_prediction_server_metrics(self.server_url)
+        self.assertEqual(metrics['requests']['/predict']['errors'],1)
+
+    def test_concurrent_requests_and_metrics(self):
+        """PredictionServer handles concurrent requests and reports their latency"""
+        exp = predict_metagenomes(self.otu_table1,self.genome_table1).delimitedSelf()
+        results = []
+        def query():
+            obs = query_prediction_server(self.server_url,otu_table1)
+            results.append(obs['prediction'].delimitedSelf())
+        threads = [Thread(target=query) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(results,[exp]*8)
+
+        metrics = get_prediction_server_metrics(self.server_url)
+        self.assertEqual(metrics['active_requests'],0)
+        self.assertEqual(metrics['requests']['/predict']['count'],8)
+        self.assertEqual(metrics['requests']['/predict']['errors'],0)
+        self.assertTrue(metrics['requests']['/predict']['max_seconds'] >=\
+          metrics['requests']['/predict']['mean_seconds'])
+
+
+otu_table1 = """{"rows": [{"id": "GG_OTU_1", "metadata": null}, {"id": "GG_OTU_2", "metadata": null}, {"id": "GG_OTU_3", "metadata": null}], "format": "Biological Observation Matrix v0.9", "data": [[0, 0, 1.0], [0, 1, 2.0], [0, 2, 3.0], [0, 3, 5.0], [1, 0, 5.0], [1, 1, 1.0], [1, 3, 2.0], [2, 2, 1.0], [2, 3, 4.0]], "columns": [{"id": "Sample1", "metadata": null}, {"id": "Sample2", "metadata": null}, {"id": "Sample3", "metadata": null}, {"id": "Sample4", "metadata": null}], "generated_by": "QIIME 1.4.0-dev, svn revision 2753", "matrix_type": "sparse", "shape": [3, 4], "format_url": "http://www.qiime.org/svn_documentation/documentation/biom_format.html", "date": "2012-02-22T20:50:05.024661", "type": "OTU table", "id": null, "matrix_element_type": "float"}"""
+
+genome_table1 = """{"rows": [{"id": "f1", "metadata": null}, {"id": "f2", "metadata": null}, {"id": "f3", "metadata": null}], "format": "Biological Observation Matrix v0.9", "data": [[0, 0, 1.0], [0, 1, 2.0], [0, 2, 3.0], [1, 1, 1.0], [2, 2, 1.0]], "columns": [{"id": "GG_OTU_1", "metadata": null}, {"id": "GG_OTU_3", "metadata": null}, {"id": "GG_OTU_2", "metadata": null}], "generated_by": "QIIME 1.4.0-dev, svn revision 2753", "matrix_type": "sparse", "shape": [3, 3], "format_url": "http://www.qiime.org/svn_documentation/documentation/biom_format.html", "date": "2012-02-22T20:49:58.258296", "type": "OTU table", "id": null, "matrix_element_type": "float"}"""
+
+variance_table1_one_gene_one_otu = """{"rows": [{"id": "f1", "metadata": null}, {"id": "f2", "metadata": null}, {"id": "f3", "metadata": null}], "format": "Biological Observation Matrix v0.9", "data": [[0, 0, 0.0], [0, 1, 0.0], [0, 2, 0.0], [1, 1, 0.0],[2, 1, 0.0],[1, 2, 0.0], [2, 2, 1000.0]], "columns": [{"id": "GG_OTU_1", "metadata": null}, {"id": "GG_OTU_3", "metadata": null}, {"id": "GG_OTU_2", "metadata": null}], "generated_by": "QIIME 1.4.0-dev, svn revision 2753", "matrix_type": "sparse", "shape": [3, 3], "format_url": "http://www.qiime.org/svn_documentation/documentation/biom_format.html", "date": "2012-02-22T20:49:58.258296", "type": "OTU table", "id": null, "matrix_element_type": "float"}"""
+
+otu_table2 = """{"rows": [{"id": "GG_OTU_21", "metadata": null}, {"id": "GG_OTU_22", "metadata": null}], "format": "Biological Observation Matrix v0.9", "data": [[0, 0, 1.0], [1, 1, 2.0]], "columns": [{"id": "Sample1", "metadata": null}, {"id": "Sample2", "metadata": null}], "generated_by": "QIIME 1.4.0-dev, svn revision 2753", "matrix_type": "sparse", "shape": [2, 2], "format_url": "http://www.qiime.org/svn_documentation/documentation/biom_format.html", "date": "2012-02-22T20:50:05.024661", "type": "OTU table", "id": null, "matrix_element_type": "float"}"""
+
+if __name__ == "__main__":
+    main()
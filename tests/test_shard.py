@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# File created on 18 Oct 2026
+from __future__ import division
+
+__author__ = "Greg Caporaso"
+__copyright__ = "Copyright 2011-2013, The PICRUSt Project"
+__credits__ = ["Greg Caporaso","Jesse Zaneveld"]
+__license__ = "GPL"
+__version__ = "1.0.0-dev"
+__maintainer__ = "Greg Caporaso"
+__email__ = "gregcaporaso@gmail.com"
+__status__ = "Development"
+ 
+import json
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from warnings import catch_warnings, simplefilter
+from StringIO import StringIO
+from cogent.util.unit_test import TestCase, main
+from biom.parse import parse_biom_table_str
+from picrust.predict_metagenomes import load_data_table,\
+  run_metagenome_prediction, format_layered_prediction,\
+  parse_layered_prediction
+from picrust.prediction_server import parse_predicted_table_str
+from picrust.shard import get_shard_sample_ids, split_otu_table_by_samples,\
+  load_manifest, predict_shards, merge_shard_tables, merge_shard_predictions
+
+class ShardTests(TestCase):
+    """ """
+    
+    def setUp(self):
+        self.tmp_dir = mkdtemp(prefix='picrust_shard_tests')
+        self.otu_table_fp = self._write('otus.biom',otu_table1)
+        self.genome_table_fp = self._write('ko.tab',genome_table1)
+        self.variance_table_fp = self._write('ko_variances.tab',variance_table1)
+        self.shard_dir = join(self.tmp_dir,'shards')
+        self.manifest_fp = join(self.shard_dir,'manifest.json')
+
+    def tearDown(self):
+        rmtree(self.tmp_dir)
+
+    def _write(self,name,data):
+        fp = join(self.tmp_dir,name)
+        open(fp,'w').write(data)
+        return fp
+
+    def _predict_full_table(self):
+        otu_table = parse_biom_table_str(otu_table1)
+        load = lambda fp: load_data_table(fp,\
+          ids_to_load=otu_table.ObservationIds,transpose=True)
+        return run_metagenome_prediction(otu_table,load(self.genome_table_fp),\
+          load(self.variance_table_fp),with_confidence=True,accuracy_metrics=True)
+
+    def test_get_shard_sample_ids(self):
+        """get_shard_sample_ids splits samples into even, ordered shards"""
+        ids = ['S1','S2','S3','S4','S5']
+        self.assertEqual(get_shard_sample_ids(ids,num_shards=2),\
+          [['S1','S2','S3'],['S4','S5']])
+        self.assertEqual(get_shard_sample_ids(ids,samples_per_shard=2),\
+          [['S1','S2'],['S3','S4'],['S5']])
+        #never returns empty shards
+        self.assertEqual(get_shard_sample_ids(ids[:2],num_shards=3),\
+          [['S1'],['S2']])
+        self.assertRaises(ValueError,get_shard_sample_ids,ids)
+        self.assertRaises(ValueError,get_shard_sample_ids,ids,2,2)
+
+    def test_split_otu_table_by_samples(self):
+        """split_otu_table_by_samples writes shard tables with all OTUs and a manifest"""
+        manifest = split_otu_table_by_samples(self.otu_table_fp,\
+          self.shard_dir,num_shards=2)
+        self.assertEqual(load_manifest(self.manifest_fp),\
+          json.loads(json.dumps(manifest)))
+        self.assertEqual(manifest['sample_ids'],['S1','S2','S3','S4','S5'])
+        self.assertEqual([s['id'] for s in manifest['shards']],\
+          ['shard_0000','shard_0001'])
+        shard = parse_biom_table_str(open(join(self.shard_dir,\
+          manifest['shards'][1]['otu_table'])).read())
+        self.assertEqual(shard.SampleIds,('S4','S5'))
+        #B has no counts in these samples, but is kept
+        self.assertEqual(shard.ObservationIds,('A','B','C'))
+        self.assertEqual(shard.SampleMetadata,({'Site':'gut'},{'Site':'skin'}))
+
+    def test_load_manifest_checks_samples(self):
+        """load_manifest rejects manifests that don't cover each sample once"""
+        manifest = split_otu_table_by_samples(self.otu_table_fp,\
+          self.shard_dir,num_shards=2)
+        manifest['shards'][1]['sample_ids'].append('S1')
+        json.dump(manifest,open(self.manifest_fp,'w'))
+        self.assertRaises(ValueError,load_manifest,self.manifest_fp)
+
+    def test_load_manifest_checks_otu_table(self):
+        """load_manifest warns if the OTU table changed after it was split"""
+        split_otu_table_by_samples(self.otu_table_fp,self.shard_dir,\
+          num_shards=2)
+        with catch_warnings(record=True) as w:
+            simplefilter('always')
+            load_manifest(self.manifest_fp)
+            self.assertEqual(len(w),0)
+            open(self.otu_table_fp,'a').write('\n')
+            load_manifest(self.manifest_fp)
+            self.assertEqual(len(w),1)
+            self.assertTrue('has changed' in str(w[0].message))
+
+    def test_sharded_prediction_matches_full_prediction(self):
+        """predicting shards with worker processes and merging matches the full prediction"""
+        split_otu_table_by_samples(self.otu_table_fp,self.shard_dir,\
+          samples_per_shard=2)
+        prediction_dir = join(self.tmp_dir,'predictions')
+        predict_shards(self.manifest_fp,prediction_dir,self.genome_table_fp,\
+          variance_table_fp=self.variance_table_fp,\
+          accuracy_metrics_fp='nsti.tab',processes=2)
+        output_fp = join(self.tmp_dir,'merged.biom')
+        nsti_fp = join(self.tmp_dir,'nsti.tab')
+        output_fps = merge_shard_predictions(self.manifest_fp,prediction_dir,\
+          output_fp,accuracy_metrics_fp=nsti_fp)
+
+        expected = self._predict_full_table()
+        self.assertEqual(sorted(output_fps),\
+          ['lower_CI_95','prediction','upper_CI_95','variances'])
+        for name,fp in output_fps.items():
+            obs = parse_predicted_table_str(open(fp).read())
+            self.assertEqual(obs,expected[name])
+            self.assertEqual(obs.SampleMetadata,expected[name].SampleMetadata)
+            self.assertEqual(obs.ObservationMetadata,\
+              expected[name].ObservationMetadata)
+
+        lines = open(nsti_fp).read().split('\n')
+        self.assertEqual(lines[0],'#Sample\tMetric\tValue')
+        self.assertEqual([l.split('\t')[0] for l in lines[1:] if l],\
+          ['S1','S2','S3','S4','S5'])
+        self.assertFloatEqual([float(l.split('\t')[2]) for l in lines[1:] if l],\
+          [nsti for sample,nsti in expected['nsti']])
+
+    def test_merge_shard_tables_reorders_samples(self):
+        """merge_shard_tables places each shard's samples in the manifest order"""
+        manifest = {'sample_ids':['S1','S2','S3'],\
+          'shards':[{'id':'a','sample_ids':['S3','S1']},\
+                    {'id':'b','sample_ids':['S2']}]}
+        full = self._predict_full_table()
+        shard_fps = []
+        for shard in manifest['shards']:
+            in_shard = set(shard['sample_ids'])
+            results = dict((name,table.filterSamples(\
+              lambda v,id_,md: id_ in in_shard).sortSampleOrder(shard['sample_ids'])) \
+              for name,table in full.items() if name != 'nsti')
+            shard_fps.append(self._write(shard['id'] + '.biom',\
+              format_layered_prediction(results)))
+
+        output = StringIO()
+        merge_shard_tables(manifest,shard_fps,output)
+        obs = parse_layered_prediction(output.getvalue())
+        for name,table in obs.items():
+            expected = full[name].filterSamples(\
+              lambda v,id_,md: id_ in manifest['sample_ids'])
+            self.assertEqual(table,expected)
+            self.assertEqual(table.SampleMetadata,expected.SampleMetadata)
+
+    def test_merge_shard_tables_checks_shards(self):
+        """merge_shard_tables raises ValueError on mismatched shard tables"""
+        manifest = {'sample_ids':['S1','S2'],\
+          'shards':[{'id':'a','sample_ids':['S1']},\
+                    {'id':'b','sample_ids':['S2']}]}
+        full = self._predict_full_table()['prediction']
+        s1 = full.filterSamples(lambda v,id_,md: id_ == 'S1')
+        s2 = full.filterSamples(lambda v,id_,md: id_ == 'S2')
+        s1_fp = self._write('s1.biom',s1.getBiomFormatJsonString('test'))
+        s2_fp = self._write('s2.biom',s2.getBiomFormatJsonString('test'))
+        self.assertRaises(ValueError,merge_shard_tables,manifest,\
+          [s2_fp,s1_fp],StringIO())
+        s2_fewer = s2.filterObservations(lambda v,id_,md: id_ == 'K00001')
+        s2_fp = self._write('s2.biom',s2_fewer.getBiomFormatJsonString('test'))
+        self.assertRaises(ValueError,merge_shard_tables,manifest,\
+          [s1_fp,s2_fp],StringIO())
+
+    def test_merge_shard_tables_escapes_ids(self):
+        """merge_shard_tables writes ids that need escaping, and null ids, as valid JSON"""
+        sample_ids = ['S"1','S\\2']
+        manifest = {'sample_ids':sample_ids,\
+          'shards':[{'id':'a','sample_ids':[sample_ids[1]]},\
+                    {'id':'b','sample_ids':[sample_ids[0]]}]}
+        shard_fps = []
+        for shard in manifest['shards']:
+            table = {'id':None,'format':'Biological Observation Matrix 1.0.0',\
+              'format_url':'http://biom-format.org','type':'Gene table',\
+              'generated_by':'a "quoted" tool','date':'2013-07-20',\
+              'matrix_type':'sparse','matrix_element_type':'float',\
+              'shape':[2,1],'data':[[1,0,2.0]],\
+              'rows':[{'id':'K"1','metadata':None},\
+                      {'id':'K\\2','metadata':None}],\
+              'columns':[{'id':shard['sample_ids'][0],'metadata':None}]}
+            shard_fps.append(self._write(shard['id'] + '.biom',\
+              json.dumps(table)))
+
+        output = StringIO()
+        merge_shard_tables(manifest,shard_fps,output)
+        obs = json.loads(output.getvalue())
+        self.assertEqual(obs['id'],None)
+        self.assertEqual(obs['generated_by'],'a "quoted" tool')
+        self.assertEqual([r['id'] for r in obs['rows']],['K"1','K\\2'])
+        self.assertEqual([c['id'] for c in obs['columns']],sample_ids)
+        self.assertEqual(sorted(obs['data']),[[1,0,2.0],[1,1,2.0]])
+        table = parse_biom_table_str(output.getvalue())
+        self.assertEqual(table.SampleIds,tuple(sample_ids))
+
+
+otu_table1 = """{"rows": [{"id": "A", "metadata": null}, {"id": "B", "metadata": null}, {"id": "C", "metadata": null}], "format": "Biological Observation Matrix v0.9", "data": [[0, 0, 1.0], [0, 1, 2.0], [0, 3, 4.0], [1, 0, 5.0], [1, 1, 1.0], [1, 2, 3.0], [2, 2, 1.0], [2, 4, 7.0]], "columns": [{"id": "S1", "metadata": {"Site": "gut"}}, {"id": "S2", "metadata": {"Site": "skin"}}, {"id": "S3", "metadata": {"Site": "gut"}}, {"id": "S4", "metadata": {"Site": "gut"}}, {"id": "S5", "metadata": {"Site": "skin"}}], "generated_by": "QIIME 1.4.0-dev", "matrix_type": "sparse", "shape": [3, 5], "format_url": "http://www.qiime.org/svn_documentation/documentation/biom_format.html", "date": "2012-02-22T20:50:05.024661", "type": "OTU table", "id": null, "matrix_element_type": "float"}"""
+
+genome_table1 = """#OTU_IDs\tK00001\tK00002\tK00003\tmetadata_NSTI
+metadata_KEGG_Pathways\tMetabolism;Carbohydrate Metabolism;Glycolysis\tGenetic Information Processing;Replication and Repair;DNA replication\tMetabolism;Energy Metabolism;Oxidative phosphorylation
+A\t1.0\t2.0\t0.0\t0.0
+B\t1.0\t0.0\t3.0\t0.1
+C\t2.0\t1.0\t1.0\t0.2
+"""
+
+variance_table1 = """#OTU_IDs\tK00001\tK00002\tK00003\tmetadata_NSTI
+metadata_KEGG_Pathways\tMetabolism;Carbohydrate Metabolism;Glycolysis\tGenetic Information Processing;Replication and Repair;DNA replication\tMetabolism;Energy Metabolism;Oxidative phosphorylation
+A\t0.5\t0.0\t0.0\t0.0
+B\t0.0\t1.5\t2.0\t0.1
+C\t1.0\t0.0\t0.25\t0.2
+"""
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# File created on 18 Oct 2026
+from __future__ import division
+
+__author__ = "Greg Caporaso"
+__copyright__ = "Copyright 2011-2013, The PICRUSt Project"
+__credits__ = ["Greg Caporaso","Jesse Zaneveld"]
+__license__ = "GPL"
+__version__ = "1.0.0-dev"
+__maintainer__ = "Greg Caporaso"
+__email__ = "gregcaporaso@gmail.com"
+__status__ = "Development"
+ 
+import json
+from StringIO import StringIO
+from numpy import ndarray
+from cogent.util.unit_test import TestCase, main
+from biom.parse import parse_biom_table_str
+from biom.table import table_factory, SparseGeneTable
+from picrust.predict_metagenomes import predict_metagenomes, calc_nsti
+from picrust.util import convert_precalc_to_biom, get_table_data_array,\
+  PrecalcBlockReader
+from picrust.streaming import SamplePredictor, iter_json_samples,\
+  iter_tab_samples, stream_predictions
+
+class StreamingTests(TestCase):
+    """ """
+    
+    def setUp(self):
+        self.otu_table = parse_biom_table_str(otu_table1)
+        self.genome_table = convert_precalc_to_biom(precalc1)
+        self.predictor = SamplePredictor(self.genome_table,accuracy_metrics=True)
+
+    def test_sample_predictor(self):
+        """SamplePredictor matches predict_metagenomes and calc_nsti one sample at a time"""
+        exp = predict_metagenomes(self.otu_table,self.genome_table)
+        sample_ids,exp_nsti = calc_nsti(self.otu_table,self.genome_table)
+        for i,sample_id in enumerate(self.otu_table.SampleIds):
+            counts = dict(zip(self.otu_table.ObservationIds,\
+              self.otu_table.sampleData(sample_id)))
+            prediction,nsti = self.predictor.predict(counts)
+            self.assertEqual(prediction,exp.sampleData(sample_id))
+            self.assertFloatEqual(nsti,exp_nsti[i])
+        self.assertEqual(self.predictor.function_ids,['K00001','K00002'])
+
+        #OTUs with zero counts may be missing from the genome table
+        prediction,nsti = SamplePredictor(self.genome_table).predict(\
+          {'A':2,'D':0})
+        self.assertEqual(prediction,[2.0,4.0])
+        self.assertEqual(nsti,None)
+        self.assertRaises(ValueError,self.predictor.predict,{'A':1,'D':1})
+
+    def test_sample_predictor_is_sparse(self):
+        """SamplePredictor never holds a dense array of every function in every OTU"""
+        sparse_table = table_factory(get_table_data_array(self.genome_table),\
+          self.genome_table.SampleIds,self.genome_table.ObservationIds,\
+          self.genome_table.SampleMetadata,\
+          self.genome_table.ObservationMetadata,constructor=SparseGeneTable)
+        reader = PrecalcBlockReader(precalc1,processes=1,block_size=20)
+        counts = {'A':1,'B':5,'C':2}
+        for predictor in (SamplePredictor(sparse_table,accuracy_metrics=True),\
+          SamplePredictor.from_precalc_blocks(reader,accuracy_metrics=True)):
+            for value in predictor.__dict__.values():
+                if isinstance(value,ndarray):
+                    self.assertEqual(value.ndim,1)
+            self.assertEqual(predictor.function_ids,['K00001','K00002'])
+            self.assertEqual(predictor.otu_ids,['A','B','C'])
+            self.assertEqual(predictor.predict(counts),\
+              self.predictor.predict(counts))
+        self.assertEqual(len(predictor._counts),5)
+
+    def test_iter_samples(self):
+        """iter_json_samples and iter_tab_samples parse one sample per line"""
+        obs = list(iter_json_samples(['{"sample_id": "S1", "counts": {"A": 2}}\n',\
+          '\n','{"sample_id": 2, "counts": {}}']))
+        self.assertEqual(obs,[('S1',{'A':2}),('2',{})])
+        obs = list(iter_tab_samples(['#SampleID\tA\tB\n','S1\t1\t0\n','S2\t0\t3.5']))
+        self.assertEqual(obs,[('S1',{'A':1.0,'B':0.0}),('S2',{'A':0.0,'B':3.5})])
+        self.assertRaises(ValueError,list,iter_tab_samples(['#SampleID\tA\tB','S1\t1']))
+
+    def test_stream_predictions(self):
+        """stream_predictions writes one prediction per sample in the input format"""
+        output = StringIO()
+        n = stream_predictions(self.predictor,['#SampleID\tA\tB\tC\n',\
+          'S1\t1\t5\t0\n','S2\t2\t1\t0\n'],output)
+        self.assertEqual(n,2)
+        self.assertEqual(output.getvalue().split('\n'),\
+          ['#SampleID\tK00001\tK00002\tNSTI','S1\t6.0\t2.0\t0.0833333333333',\
+           'S2\t3.0\t4.0\t0.0333333333333',''])
+
+        output = StringIO()
+        errors = StringIO()
+        n = stream_predictions(self.predictor,\
+          ['{"sample_id": "S1", "counts": {"A": 1, "B": 5}}',\
+           '{"sample_id": "S2", "counts": {"D": 1}}',\
+           '{"sample_id": "S3", "counts": {"B": 1}}'],\
+          output,input_format='json',error_fh=errors)
+        self.assertEqual(n,2)
+        lines = [json.loads(l) for l in output.getvalue().splitlines()]
+        self.assertEqual(lines[0]['prediction'],{'K00001':6.0,'K00002':2.0})
+        #functions with zero counts are left out
+        self.assertEqual(lines[1],{'sample_id':'S3','prediction':{'K00001':1.0},\
+          'nsti':0.1})
+        self.assertTrue(errors.getvalue().startswith('Skipping sample S2'))
+
+        self.assertRaises(ValueError,stream_predictions,self.predictor,\
+          ['{"sample_id": "S2", "counts": {"D": 1}}'],StringIO(),'json')
+        self.assertRaises(ValueError,stream_predictions,self.predictor,\
+          [],StringIO(),'csv')
+
+
+otu_table1 = """{"rows": [{"id": "A", "metadata": null}, {"id": "B", "metadata": null}], "format": "Biological Observation Matrix v0.9", "data": [[0, 0, 1.0], [0, 1, 2.0], [1, 0, 5.0], [1, 1, 1.0]], "columns": [{"id": "Sample1", "metadata": null}, {"id": "Sample2", "metadata": null}], "generated_by": "QIIME 1.4.0-dev", "matrix_type": "sparse", "shape": [2, 2], "format_url": "http://www.qiime.org/svn_documentation/documentation/biom_format.html", "date": "2012-02-22T20:50:05.024661", "type": "OTU table", "id": null, "matrix_element_type": "float"}"""
+
+precalc1 = """#OTU_IDs\tK00001\tK00002\tmetadata_NSTI
+A\t1.0\t2.0\t0.0
+B\t1.0\t0.0\t0.1
+C\t1.0\t1.0\t0.2
+"""
+
+if __name__ == "__main__":
+    main()
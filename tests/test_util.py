@@ -19,8 +19,14 @@ from biom.parse import parse_biom_table_str
 from cogent.core.tree import TreeError
 from cogent.parse.tree import DndParser
 from picrust.util import PicrustNode,\
-  transpose_trait_table_fields, convert_precalc_to_biom, convert_biom_to_precalc, biom_meta_to_string
+  transpose_trait_table_fields, convert_precalc_to_biom, convert_biom_to_precalc, biom_meta_to_string,\
+  get_table_data_array, convert_precalc_to_biom_in_parallel, parse_precalc_trait_metadata,\
+  PrecalcBlockReader, BackgroundCall, get_sparse_coordinates,\
+  sparse_matrix_from_coordinates
+from numpy import array
+from time import sleep
 import StringIO
+import picrust.util
 
 class PicrustNodeTests(TestCase):
     def setUp(self):
@@ -108,6 +114,115 @@ class UtilTests(TestCase):
         self.assertRaises(ValueError,convert_precalc_to_biom,precalc_in_tab,['bogus_id1','bogus_id2'])
         self.assertRaises(ValueError,convert_precalc_to_biom,precalc_in_tab,['OTU_1','bogus_id2'])
 
+    def test_convert_precalc_to_biom_in_parallel(self):
+        """ convert_precalc_to_biom_in_parallel matches convert_precalc_to_biom """
+        exp = convert_precalc_to_biom(precalc_in_tab)
+        #small blocks split the table between metadata and data lines
+        for processes in [1,2]:
+            for block_size in [10,2**22]:
+                obs = convert_precalc_to_biom_in_parallel(precalc_in_tab,\
+                  processes=processes,block_size=block_size)
+                self.assertEqual(obs,exp)
+                self.assertEqual(obs.SampleMetadata,exp.SampleMetadata)
+                self.assertEqual(obs.ObservationMetadata,exp.ObservationMetadata)
+
+        exp = convert_precalc_to_biom(precalc_in_tab,transpose=False)
+        obs = convert_precalc_to_biom_in_parallel(StringIO.StringIO(precalc_in_tab),\
+          transpose=False,processes=1,block_size=10)
+        self.assertEqual(obs,exp)
+
+        ids_to_load = ['OTU_3','OTU_1']
+        obs = convert_precalc_to_biom_in_parallel(precalc_in_tab,ids_to_load,\
+          processes=1,block_size=10)
+        self.assertEqual(obs,convert_precalc_to_biom(precalc_in_tab,ids_to_load))
+
+    def test_convert_precalc_to_biom_functions_to_load(self):
+        """ convert_precalc_to_biom loads only functions_to_load """
+        for convert_f in [convert_precalc_to_biom,convert_precalc_to_biom_in_parallel]:
+            result_table = convert_f(precalc_in_tab,functions_to_load=['f3','f1'])
+            self.assertEqual(result_table.ObservationIds,('f1','f3'))
+            self.assertEqual(result_table.observationData('f3'),[3.0,0.0,4.0])
+            self.assertEqual(result_table.ObservationMetadata[1]['list'],['f3','l2','l3'])
+            self.assertEqual(result_table.SampleMetadata[0],{'NSTI':'1.2'})
+
+            result_table = convert_f(precalc_in_tab,['OTU_3'],transpose=False,\
+              functions_to_load=['f2'])
+            self.assertEqual(result_table.SampleIds,('f2',))
+            self.assertEqual(result_table.ObservationIds,('OTU_3',))
+
+            self.assertRaises(ValueError,convert_f,precalc_in_tab,\
+              functions_to_load=['f1','bogus_function'])
+
+    def test_parse_precalc_trait_metadata(self):
+        """ parse_precalc_trait_metadata reads only the trait ids and metadata """
+        obs = parse_precalc_trait_metadata(precalc_in_tab)
+        self.assertEqual([trait_id for trait_id,metadata in obs],['f1','f2','f3'])
+        self.assertEqual(obs[1][1],{'simple':'f2_desc','list':['f2','l1','l2'],\
+          'list_of_lists':[['f2','l1','l2'],['f2','l1a','l2a']]})
+
+    def test_convert_precalc_to_biom_in_parallel_value_error(self):
+        """ convert_precalc_to_biom_in_parallel raises ValueError on missing ids or bad values """
+        self.assertRaises(ValueError,convert_precalc_to_biom_in_parallel,\
+          precalc_in_tab,['OTU_1','bogus_id2'],processes=1)
+        self.assertRaises(ValueError,convert_precalc_to_biom_in_parallel,\
+          precalc_in_tab.replace('4.0','four'),processes=1)
+
+
+    def test_precalc_block_reader(self):
+        """ PrecalcBlockReader yields the parsed blocks in file order """
+        for processes in [1,2]:
+            reader = PrecalcBlockReader(precalc_in_tab,['OTU_3','OTU_1'],\
+              processes=processes,block_size=10,functions_to_load=['f3','f1'],\
+              max_blocks_ahead=1)
+            self.assertEqual(reader.trait_ids,['f1','f3'])
+            blocks = list(reader)
+            otu_ids = [otu_id for block in blocks for otu_id in block[0]]
+            self.assertEqual(otu_ids,['OTU_1','OTU_3'])
+            self.assertEqual(reader.otu_ids,otu_ids)
+            data = [row.tolist() for block in blocks for row in block[1]]
+            self.assertEqual(data,[[1.0,3.0],[4.0,4.0]])
+            col_meta = [md for block in blocks for md in block[2]]
+            self.assertEqual(col_meta,[{'NSTI':'1.2'},{'NSTI':'0.5'}])
+            self.assertEqual(reader.row_meta[1]['list'],['f3','l2','l3'])
+
+        reader = PrecalcBlockReader(precalc_in_tab,['OTU_1','bogus_id2'],\
+          processes=1)
+        self.assertRaises(ValueError,list,reader)
+
+    def test_precalc_block_reader_reads_ahead(self):
+        """ PrecalcBlockReader reads blocks in the background, up to max_blocks_ahead """
+        fh = CountingReader(precalc_in_tab)
+        reader = PrecalcBlockReader(fh,processes=1,block_size=10,\
+          max_blocks_ahead=10)
+        #the whole body is read without iterating over the reader
+        for i in range(100):
+            if fh.at_end:
+                break
+            sleep(0.01)
+        self.assertTrue(fh.at_end)
+        self.assertEqual(len(list(reader)),6)
+
+        fh = CountingReader(precalc_in_tab)
+        reader = PrecalcBlockReader(fh,processes=1,block_size=10,\
+          max_blocks_ahead=1)
+        sleep(0.1)
+        self.assertFalse(fh.at_end)
+        self.assertEqual(len(list(reader)),6)
+        self.assertTrue(fh.at_end)
+
+        #errors while reading are raised when iterating
+        fh = CountingReader(precalc_in_tab,fail=True)
+        reader = PrecalcBlockReader(fh,processes=1,block_size=10)
+        self.assertRaises(IOError,list,reader)
+
+    def test_background_call(self):
+        """ BackgroundCall returns the result of the call, or raises its exception """
+        call = BackgroundCall(convert_precalc_to_biom,precalc_in_tab,\
+          transpose=False)
+        self.assertEqual(call.result(),\
+          convert_precalc_to_biom(precalc_in_tab,transpose=False))
+        call = BackgroundCall(convert_precalc_to_biom,precalc_in_tab,['bogus_id'])
+        self.assertRaises(ValueError,call.result)
 
     def test_convert_biom_to_precalc(self):
         """ convert_biom_to_precalc as expected with valid input """
@@ -116,6 +231,56 @@ class UtilTests(TestCase):
 
         self.assertEqual(result,precalc_in_tab)
 
+    def test_get_table_data_array(self):
+        """ get_table_data_array returns the same array for dense and sparse tables """
+        exp = [[1.0,0.0,4.0],[2.0,0.0,4.0],[3.0,0.0,4.0]]
+        self.assertFloatEqual(get_table_data_array(self.precalc_in_biom),exp)
+        sparse_table = parse_biom_table_str(precalc_in_biom.replace(\
+          '"matrix_type": "dense"','"matrix_type": "sparse"').replace(\
+          '[[1.0,0.0,4.0],[2.0,0.0,4.0],[3.0,0.0,4.0]]',\
+          '[[0,0,1.0],[0,2,4.0],[1,0,2.0],[1,2,4.0],[2,0,3.0],[2,2,4.0]]'))
+        self.assertFloatEqual(get_table_data_array(sparse_table),exp)
+
+    def test_sparse_matrix_from_coordinates(self):
+        """ sparse_matrix_from_coordinates inverts get_sparse_coordinates """
+        sparse_data = sparse_matrix_from_coordinates(array([2,0,2,1]),\
+          array([1,3,0,2]),array([1.0,2.0,0.5,0.0]),(4,5))
+        self.assertEqual(sparse_data.shape,(4,5))
+        self.assertEqual(sorted(sparse_data.items()),\
+          [((0,3),2.0),((2,0),0.5),((2,1),1.0)])
+        rows,cols,values = get_sparse_coordinates(sparse_data)
+        self.assertEqual(rows.tolist(),[0,2,2])
+        self.assertEqual(cols.tolist(),[3,0,1])
+        self.assertEqual(values.tolist(),[2.0,0.5,1.0])
+        #freshly parsed sparse tables are read from their coordinate lists
+        sparse_table = parse_biom_table_str(precalc_in_biom.replace(\
+          '"matrix_type": "dense"','"matrix_type": "sparse"').replace(\
+          '[[1.0,0.0,4.0],[2.0,0.0,4.0],[3.0,0.0,4.0]]',\
+          '[[0,0,1.0],[0,2,4.0],[1,0,2.0],[1,2,4.0],[2,0,3.0],[2,2,4.0]]'))
+        rows,cols,values = get_sparse_coordinates(sparse_table._data)
+        self.assertEqual(zip(rows.tolist(),cols.tolist(),values.tolist()),\
+          [(0,0,1.0),(0,2,4.0),(1,0,2.0),(1,2,4.0),(2,0,3.0),(2,2,4.0)])
+
+    def test_sparse_coordinates_public_interface(self):
+        """ get_sparse_coordinates and sparse_matrix_from_coordinates work through biom's public interface on other biom versions """
+        exp = sparse_matrix_from_coordinates(array([2,0,2,1]),\
+          array([1,3,0,2]),array([1.0,2.0,0.5,0.0]),(4,5))
+        original_version = picrust.util.biom_version
+        picrust.util.biom_version = '0.0.0'
+        try:
+            sparse_data = sparse_matrix_from_coordinates(array([2,0,2,1]),\
+              array([1,3,0,2]),array([1.0,2.0,0.5,0.0]),(4,5))
+            self.assertEqual(sparse_data,exp)
+            rows,cols,values = get_sparse_coordinates(sparse_data)
+            self.assertEqual(sorted(zip(rows.tolist(),cols.tolist(),\
+              values.tolist())),[(0,3,2.0),(2,0,0.5),(2,1,1.0)])
+            empty = sparse_matrix_from_coordinates(array([0]),array([0]),\
+              array([0.0]),(2,3))
+            self.assertEqual(empty.shape,(2,3))
+            self.assertEqual(get_sparse_coordinates(empty)[2].tolist(),[])
+        finally:
+            picrust.util.biom_version = original_version
+
     def test_biom_meta_to_string(self):
         """ biom_meta_to_string functions as expected """
 
@@ -190,6 +355,25 @@ class UtilTests(TestCase):
         
         pass
 
+class CountingReader(object):
+    """A file-like object that records when it has been read to the end"""
+
+    def __init__(self,data,fail=False):
+        self._fh = StringIO.StringIO(data)
+        self.fail = fail
+        self.at_end = False
+
+    def readline(self):
+        return self._fh.readline()
+
+    def read(self,size):
+        if self.fail:
+            raise IOError("Can't read the file")
+        data = self._fh.read(size)
+        if not data:
+            self.at_end = True
+        return data
+
 precalc_in_tab="""#OTU_IDs	f1	f2	f3	metadata_NSTI
 metadata_simple	f1_desc	f2_desc	f3_desc
 metadata_list	f1;l1;l2	f2;l1;l2	f3;l2;l3
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# File created on 18 Oct 2026
+from __future__ import division
+
+__author__ = "Greg Caporaso"
+__copyright__ = "Copyright 2011-2013, The PICRUSt Project"
+__credits__ = ["Greg Caporaso","Jesse Zaneveld"]
+__license__ = "GPL"
+__version__ = "1.0.0-dev"
+__maintainer__ = "Greg Caporaso"
+__email__ = "gregcaporaso@gmail.com"
+__status__ = "Development"
+ 
+from os import utime
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from cogent.util.unit_test import TestCase, main
+from biom.parse import parse_biom_table_str
+from picrust.util import file_digest
+from picrust.workflow import run_picrust_workflow, stage_key,\
+  IntermediateCache
+
+class WorkflowTests(TestCase):
+    """ """
+    
+    def setUp(self):
+        self.tmp_dir = mkdtemp(prefix='picrust_workflow_tests')
+        self.cache_dir = join(self.tmp_dir,'cache')
+        self.otu_table_fp = self._write('otus.biom',otu_table1)
+        self.copy_number_fp = self._write('16S.tab',copy_number_table1)
+        self.genome_table_fp = self._write('ko.tab',genome_table1)
+
+    def tearDown(self):
+        rmtree(self.tmp_dir)
+
+    def _write(self,name,data):
+        fp = join(self.tmp_dir,name)
+        open(fp,'w').write(data)
+        return fp
+
+    def _run(self,**kwargs):
+        return run_picrust_workflow(self.otu_table_fp,self.copy_number_fp,\
+          self.genome_table_fp,metadata_category='KEGG_Pathways',\
+          cache_dir=self.cache_dir,**kwargs)
+
+    def test_run_picrust_workflow(self):
+        """run_picrust_workflow normalizes, predicts and collapses the OTU table"""
+        obs = self._run(categorize_levels=[1],limit_to_functions=['K00002'])
+        self.assertEqual(obs['cached_stages'],[])
+
+        normalized = obs['normalized']
+        self.assertEqual(normalized.ObservationIds,('A','B'))
+        self.assertFloatEqual(normalized.observationData('B'),[2.5,0.5])
+
+        prediction = obs['prediction']['prediction']
+        #predictions are rounded (3.5 and 2.5 before rounding)
+        self.assertFloatEqual(prediction.observationData('K00001'),[4.0,2.0])
+        self.assertFloatEqual(prediction.observationData('K00002'),[2.0,4.0])
+
+        collapsed = parse_biom_table_str(obs['categorized'][1])
+        #K00001 is in two Metabolism pathways, so is counted twice
+        self.assertFloatEqual(collapsed.observationData('Metabolism'),[8.0,4.0])
+
+        lines = obs['contributions'].split('\n')
+        #B has no copies of K00002, so only contributes zero rows (removed)
+        self.assertEqual(len(lines),3)
+        self.assertEqual(lines[1].split('\t')[:3],['K00002','Sample1','A'])
+
+    def test_run_picrust_workflow_reuses_cached_stages(self):
+        """run_picrust_workflow only reruns stages whose inputs changed"""
+        first = self._run(categorize_levels=[1],accuracy_metrics=True)
+        second = self._run(categorize_levels=[1,2],accuracy_metrics=True)
+        self.assertEqual(second['cached_stages'],\
+          ['normalize','predict','categorize level 1'])
+        self.assertEqual(second['prediction']['prediction'],\
+          first['prediction']['prediction'])
+        self.assertEqual(second['prediction']['nsti'],first['prediction']['nsti'])
+        self.assertEqual(second['categorized'][1],first['categorized'][1])
+        self.assertEqual(second['normalized'],first['normalized'])
+
+        #changing an upstream input invalidates everything downstream
+        self._write('16S.tab',copy_number_table1.replace('B\t2','B\t1'))
+        third = self._run(categorize_levels=[1,2],accuracy_metrics=True)
+        self.assertEqual(third['cached_stages'],[])
+        self.assertFloatEqual(third['normalized'].observationData('B'),[5.0,1.0])
+
+    def test_stage_key(self):
+        """stage_key depends on the stage, inputs and parameters"""
+        key = stage_key('predict',['abc'],{'a':1,'b':2})
+        self.assertEqual(key,stage_key('predict',['abc'],{'b':2,'a':1}))
+        self.assertNotEqual(key,stage_key('normalize',['abc'],{'a':1,'b':2}))
+        self.assertNotEqual(key,stage_key('predict',['abd'],{'a':1,'b':2}))
+        self.assertNotEqual(key,stage_key('predict',['abc'],{'a':1,'b':3}))
+
+    def test_intermediate_cache(self):
+        """IntermediateCache stores entries on disk, or nothing without a cache dir"""
+        cache = IntermediateCache(self.cache_dir)
+        self.assertEqual(cache.get('abc'),None)
+        cache.put('abc',{'table':'x'})
+        self.assertEqual(IntermediateCache(self.cache_dir).get('abc'),\
+          {'table':'x'})
+
+        no_cache = IntermediateCache()
+        no_cache.put('abc',{'table':'x'})
+        self.assertEqual(no_cache.get('abc'),None)
+
+    def test_intermediate_cache_file_digest(self):
+        """IntermediateCache.file_digest only rehashes files whose size or mtime changed"""
+        utime(self.genome_table_fp,(1e9,1e9))
+        cache = IntermediateCache(self.cache_dir)
+        digest = cache.file_digest(self.genome_table_fp)
+        self.assertEqual(digest,file_digest(self.genome_table_fp))
+
+        #the same size and mtime are taken to mean the same contents, so
+        #the file isn't read again, even by a new cache on the same dir
+        self._write('ko.tab',genome_table1.replace('C\t1.0','C\t2.0'))
+        utime(self.genome_table_fp,(1e9,1e9))
+        self.assertEqual(cache.file_digest(self.genome_table_fp),digest)
+        self.assertEqual(IntermediateCache(self.cache_dir).file_digest(\
+          self.genome_table_fp),digest)
+
+        utime(self.genome_table_fp,(1e9,1e9+10))
+        self.assertEqual(IntermediateCache(self.cache_dir).file_digest(\
+          self.genome_table_fp),file_digest(self.genome_table_fp))
+        self.assertNotEqual(file_digest(self.genome_table_fp),digest)
+
+        #without a cache dir, digests are only remembered by the cache
+        no_cache = IntermediateCache()
+        self.assertEqual(no_cache.file_digest(self.otu_table_fp),\
+          file_digest(self.otu_table_fp))
+
+
+otu_table1 = """{"rows": [{"id": "A", "metadata": null}, {"id": "B", "metadata": null}], "format": "Biological Observation Matrix v0.9", "data": [[0, 0, 1.0], [0, 1, 2.0], [1, 0, 5.0], [1, 1, 1.0]], "columns": [{"id": "Sample1", "metadata": null}, {"id": "Sample2", "metadata": null}], "generated_by": "QIIME 1.4.0-dev", "matrix_type": "sparse", "shape": [2, 2], "format_url": "http://www.qiime.org/svn_documentation/documentation/biom_format.html", "date": "2012-02-22T20:50:05.024661", "type": "OTU table", "id": null, "matrix_element_type": "float"}"""
+
+copy_number_table1 = """#OTU_IDs\t16S_rRNA_Count
+A\t1
+B\t2
+C\t3
+"""
+
+genome_table1 = """#OTU_IDs\tK00001\tK00002\tmetadata_NSTI
+metadata_KEGG_Pathways\tMetabolism;Carbohydrate Metabolism;Glycolysis|Metabolism;Energy Metabolism;Oxidative phosphorylation\tGenetic Information Processing;Replication and Repair;DNA replication
+A\t1.0\t2.0\t0.0
+B\t1.0\t0.0\t0.1
+C\t1.0\t1.0\t0.2
+"""
+
+if __name__ == "__main__":
+    main()